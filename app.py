@@ -1,186 +1,192 @@
-from flask import Flask, redirect, url_for, render_template, request, jsonify
-from functions import initialize_conversation, initialize_conv_reco, get_chat_completions, moderation_check,intent_confirmation_layer, recommendation_validation, gen_updated_latop_data
+from flask import Flask, redirect, url_for, render_template, request, jsonify, session, Response, stream_with_context, g
+from functions import initialize_conversation, get_introduction, recommend_batch_jsonl, BATCH_FIELDS, LAPTOP_DATA
+from catalog import get_catalog
+from chat_turn import run_turn, ERROR_MESSAGE
+from session_store import create_session_store
+from metrics import registry, HTTP_REQUEST_SECONDS
+from scheduler import get_scheduler
+from jobs import get_job_store, start_job
 
 import openai
 import pandas as pd
 import json
+import logging
+import os
+import secrets
 import threading
+import time
+import uuid
+
+# Log level of the app's modules; DEBUG adds turn timings, retries and circuit breaker transitions
+logging.basicConfig(level=os.environ.get("SHOPASSIST_LOG_LEVEL", "WARNING").upper())
 
 # Load the OpenAI API key from a file
 openai.api_key = open("OpenAI_API_Key.txt", "r").read().strip()
 
 # Initialize Flask app
 app = Flask(__name__)
-
-# Global variable to track task status
-task_status = {"status": "Not Started"}  # Possible statuses: "Not Started", "In Progress", "Completed"
-
-# Initialize conversation and conversation_bot
-conversation_bot = []
-conversation = initialize_conversation()
-introduction = get_chat_completions(conversation)
-conversation.append({"role": "assistant", "content": introduction})
-conversation_bot.append({'bot': introduction})
-top_3_laptops = None
+# The session cookie only carries the session id; multi-worker deployments must share this key
+app.secret_key = os.environ.get("SHOPASSIST_SECRET_KEY") or secrets.token_hex(32)
+
+# Per-session conversation state (conversation, conversation_bot, top_3_laptops, conversation_reco),
+# created on first use so that importing the app does no I/O beyond reading the API key
+_session_store = None
+_session_store_lock = threading.Lock()
+
+def get_session_store():
+    global _session_store
+    if _session_store is None:
+        with _session_store_lock:
+            if _session_store is None:
+                _session_store = create_session_store()
+    return _session_store
+
+# Start a new conversation state with the assistant's introduction (never fetched)
+def new_session_state():
+    conversation = initialize_conversation()
+    introduction = get_introduction()
+    conversation.append({"role": "assistant", "content": introduction})
+    return {"conversation": conversation,
+            "conversation_bot": [{'bot': introduction}],
+            "top_3_laptops": None,
+            "conversation_reco": None}
+
+# Return (session_id, state) for the current browser, creating a new conversation if needed
+def load_session_state():
+    session_id = session.get("session_id")
+    state = get_session_store().get(session_id) if session_id else None
+    if state is None:
+        session_id = uuid.uuid4().hex
+        session["session_id"] = session_id
+        state = new_session_state()
+        get_session_store().save(session_id, state)
+    return session_id, state
+
+# Time every request for the shopassist_http_request_seconds histogram
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        # Label by route pattern rather than raw path to keep the number of series bounded
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, route = route, method = request.method,
+                                     status = response.status_code)
+    return response
 
 # Default route to render the chat interface
 @app.route("/")
 def default_func():
-    global conversation, conversation_bot, top_3_laptops
-    return render_template("index_chat.html", name = conversation_bot)
+    session_id, state = load_session_state()
+    return render_template("index_chat.html", name = state["conversation_bot"])
 
 # Route to end the conversation and restart the chat
 @app.route("/end_conv", methods = ["POST", "GET"])
 def end_conv():
-    global conversation_bot, conversation, top_3_laptops
-    conversation_bot = []
-    conversation = initialize_conversation()
-    introduction = get_chat_completions(conversation)
-    conversation.append({"role": "assistant", "content": introduction})
-    conversation_bot.append({'bot': introduction})
-    top_3_laptops = None
+    session_id = session.get("session_id")
+    if session_id:
+        get_session_store().delete(session_id)
+    session.pop("session_id", None)
     return redirect(url_for("default_func"))
 
 # Route to handle the user's chat messages and respond with recommendations
 @app.route("/chat", methods = ["POST"])
 def chat():
-    global conversation_bot, conversation, top_3_laptops, conversation_reco
+    session_id, state = load_session_state()
     user_input = request.form.get("user_input_message")
 
-    # Add a prompt to remind the assistant of its role (laptop-focused)
-    prompt = '. Remember your system message and that you are an intelligent laptop assistant. So, you only help with questions around laptop. If user asks about something else, tell him explicitly that you answer only laptop related questions.'
-
-    # Check user input for inappropriate content
-    moderation = moderation_check(user_input)
-    if moderation == 'Flagged':
-        print("Sorry, this message has been flagged. Please restart your conversation.")
-        return redirect(url_for("end_conv"))
-
-     # If top 3 laptops is not yet retrieved, use the LLM to ask more questions.
-     # If top 3 laptops are fetched, recommend the laptions, and remind the user to end the conversation
-    if top_3_laptops is None:
-
-        conversation.append({"role": "user", "content": user_input + prompt})
-        conversation_bot.append({"user": user_input})
-
-        # Get chatbot response
-        response_assistant = get_chat_completions(conversation)
-
-        # Check the assistant's response for flagged content
-        moderation = moderation_check(response_assistant)
-        if moderation == 'Flagged':
-            print("Sorry, this message has been flagged. Please restart your conversation.")
+    for event in run_turn(state, user_input):
+        if event["event"] == "flagged":
             return redirect(url_for("end_conv"))
 
-
-        # Verify if the intent confirmation is complete
-        confirmation = intent_confirmation_layer(response_assistant)
-
-        print("Intent Confirmation Yes/No:",confirmation.get('result'))
-
-        # If confirmation is incomplete, continue the conversation
-        if "No" in confirmation.get('result'):
-            conversation.append({"role": "assistant", "content": str(response_assistant)})
-            conversation_bot.append({"bot":  str(response_assistant)})
-            print("\n" + str(response_assistant) + "\n")
-
-        else:
-            # If the confirmation is successful, proceed to generate laptop recommendations
-            print("\n" + str(response_assistant) + "\n")
-            print('\n' + "Variables extracted!" + '\n')
-
-            print("Thank you for providing all the information. Kindly wait, while I fetch the products: \n")
-            conversation.append({"role": "user", "content": json.dumps(response_assistant)})
-            conversation.append({"role": "assistant", "content": "Thank you for providing all the information. Kindly wait, while I fetch the top 3 laptops from the catalogue:"})
-            conversation_bot.append({"bot":  "Thank you for providing all the information. Kindly wait, while I fetch the products:"})
-
-            # Get the top 3 laptops based on the user's input
-            top_3_laptops = get_chat_completions(conversation)
-            print("top 3 laptops are", top_3_laptops)
-
-            # Validate recommendations based on extracted variables
-            validated_reco = recommendation_validation(top_3_laptops)
-
-            # If no laptops match the user's preferences, notify the user
-            if len(validated_reco) == 0:
-                print("Sorry, we do not have laptops that match your requirement. Connecting you to a human assistant.")
-                conversation_bot.append({"bot":  "Sorry, we do not have laptops that match your requirement. Connecting you to a human assistant."})
-
-            # Initialize a new conversation for recommendations
-            conversation_reco = initialize_conv_reco(validated_reco)
-            recommendation = get_chat_completions(conversation_reco)
-
-            # Check the moderation status of the recommendation
-            moderation = moderation_check(recommendation)
-            if moderation == 'Flagged':
-                print("Sorry, this message has been flagged. Please restart your conversation.")
-                return redirect(url_for("end_conv"))
-
-            # Add recommendations to the conversation history
-            conversation_reco.append({"role": "user", "content": "This is my user profile" + str(response_assistant)})
-            conversation_reco.append({"role": "assistant", "content": str(recommendation)})
-            conversation_bot.append({"bot":  recommendation})
-
-            print(str(recommendation) + '\n')
-    else:
-        # If recommendations are already provided, remind the user to end the conversation
-        if conversation_reco is not None:
-            conversation_bot.append({"user":  user_input})
-            conversation_bot.append({"bot":  "Top 3 recommendations already provided. Please end the conversation."})    
-        else:    
-            # Continue conversation with additional user input
-            conversation_reco.append({"role": "user", "content": user_input})
-            conversation_bot.append({"user":  user_input})
-
-            # Get chatbot response for the follow-up conversation
-            response_asst_reco = get_chat_completions(conversation_reco)
-
-            # Check moderation for the assistant's response
-            moderation = moderation_check(response_asst_reco)
-            if moderation == 'Flagged':
-                print("Sorry, this message has been flagged. Please restart your conversation.")
-                return redirect(url_for("end_conv"))
-
-            # Append response to the conversation history
-            print('\n' + response_asst_reco + '\n')
-            conversation.append({"role": "assistant", "content": response_asst_reco})
-            response_asst_reco = response_asst_reco.replace("\n", "<br/><br/>")
-            conversation_bot.append({"bot":  response_asst_reco})
+    # Persist the updated conversation for this session
+    get_session_store().save(session_id, state)
 
     # Redirect back to the default chat route
     return redirect(url_for("default_func"))
 
-# Function for CSV generation
-def gen_updated_laptop_data():
-    global task_status
-    task_status["status"] = "In Progress"
-    task_status["progress"] = 0
-
-    # Generate the updated laptop data CSV
-    gen_updated_latop_data()
-    task_status["status"] = "Completed"
+# Route to handle a chat message, streaming the assistant's reply as Server-Sent Events
+@app.route("/chat_stream", methods = ["POST"])
+def chat_stream():
+    session_id, state = load_session_state()
+    user_input = request.form.get("user_input_message")
 
-# Route to start the CSV generation task
+    def generate():
+        try:
+            for event in run_turn(state, user_input, stream=True):
+                yield f"event: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+                if event["event"] == "flagged":
+                    get_session_store().delete(session_id)
+                    return
+
+            get_session_store().save(session_id, state)
+        except Exception:
+            # run_turn undoes its own failures; this is e.g. the session store failing. Without "done"
+            # the page keeps the conversation it has and lets the user retry
+            app.logger.exception("Streaming chat turn failed")
+            yield f"event: error\ndata: {json.dumps(ERROR_MESSAGE)}\n\n"
+            return
+        yield "event: done\ndata: null\n\n"
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# Route to recommend laptops for many stored profiles without the LLM: JSON Lines in, JSON Lines out
+@app.route("/recommend/batch", methods = ["POST"])
+def recommend_batch_route():
+    k = request.args.get("k", 3, type = int)
+    fields = tuple(request.args["fields"].split(",")) if request.args.get("fields") else BATCH_FIELDS
+    columns = {name for name, values in get_catalog(LAPTOP_DATA).columns}
+    unknown = [name for name in fields if name not in columns]
+    if k is None or k < 1 or unknown:
+        return jsonify({"error": f"Unknown fields: {', '.join(unknown)}" if unknown else "k must be a positive integer"}), 400
+
+    return Response(stream_with_context(recommend_batch_jsonl(request.stream, k = k, fields = fields)),
+                    mimetype = "application/x-ndjson")
+
+# Route to the admin page for the catalogue generation job
 @app.route("/admin", methods=["GET"])
 def admin():
-    global task_status
-    task_status["status"] = "Not Started"  # Reset status before starting new task
     return render_template("admin.html")
 
-# Route to start the CSV generation asynchronously
+# Route to queue the CSV generation as a background job; returns the new job, or the one already running
 @app.route("/start_generation", methods=["POST"])
 def start_generation():
-    global task_status
-    # Start the generation in a separate thread to prevent blocking
-    if task_status["status"] == "Not Started":
-        thread = threading.Thread(target=gen_updated_laptop_data)
-        thread.start()
-    return jsonify({"message": "Generation started"}), 202
-
-# Route to check the status of CSV generation
+    job, created = start_job("catalog_generation")
+    message = "Generation started" if created else "Generation already in progress"
+    return jsonify({"message": message, "job_id": job["id"], "job": job}), 202
+
+# Route to check the status of a job (the latest CSV generation unless job_id is given)
 @app.route("/check_status", methods=["GET"])
 def check_status():
-    return jsonify(task_status), 200
+    job_id = request.args.get("job_id")
+    job = get_job_store().get(job_id) if job_id else get_job_store().latest("catalog_generation")
+    if job_id and job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    # Include this worker's LLM scheduler stats; the job's own are in its progress
+    return jsonify({"job": job, "scheduler": get_scheduler().stats()}), 200
+
+# Route to list recent background jobs, newest first
+@app.route("/jobs", methods=["GET"])
+def list_jobs():
+    limit = request.args.get("limit", 20, type = int)
+    return jsonify({"jobs": get_job_store().list(limit = limit)}), 200
+
+# Route to cancel a queued or running job
+@app.route("/jobs/<job_id>/cancel", methods=["POST"])
+def cancel_job(job_id):
+    job = get_job_store().cancel(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify({"job": job}), 202
+
+# Prometheus metrics of this worker process
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4; charset=utf-8")
 
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
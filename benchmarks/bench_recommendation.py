@@ -0,0 +1,268 @@
+"""
+Scaling benchmark of the recommendation engine.
+
+For each catalogue size, a synthetic catalogue in the updated_laptop.csv schema is generated
+and profile-to-top-3 is measured: compare_laptops_with_user's work (CatalogIndex.top_k_json)
+followed by recommendation_validation. Two paths are timed separately:
+
+- table: complete profiles answered from the precomputed RecommendationTable
+- scan:  the vectorised scoring pass over every laptop within budget (used for partial
+         profiles, k > 3, or when no table has been built)
+
+Reported per size: latency percentiles and throughput of each path, the number of distinct
+prices (which sets the table's budget buckets), the time, peak memory (tracemalloc) and size
+of the table, the peak memory of a query, the resident size of the index and, up to
+--load-max-rows, the time to load the catalogue from CSV.
+
+Results can be stored as a baseline and later runs checked against it:
+    python benchmarks/bench_recommendation.py --save-baseline
+    python benchmarks/bench_recommendation.py --check
+    python benchmarks/bench_recommendation.py --sizes 1000,10000,100000,1000000,10000000
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from catalog import CatalogIndex, FEATURE_KEYS, LEVEL_CODES, _DictColumn
+from functions import recommendation_validation
+
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000, 10000000]
+BASELINE = os.path.join(ROOT, 'benchmarks', 'baselines', 'bench_recommendation.json')
+
+# Vocabularies of the synthetic catalogue's text columns
+VOCABULARY = {
+    'Brand': ['Dell', 'HP', 'Lenovo', 'ASUS', 'Acer', 'MSI', 'Apple', 'Microsoft', 'Razer', 'Samsung'],
+    'Model Name': ['Inspiron', 'EliteBook', 'ThinkPad', 'ZenBook', 'Aspire', 'GL65', 'MacBook Pro', 'Surface', 'Blade', 'Galaxy Book'],
+    'Core': ['i3', 'i5', 'i7', 'i9', 'Ryzen 3', 'Ryzen 5', 'Ryzen 7', 'M1', 'M2'],
+    'CPU Manufacturer': ['Intel', 'AMD', 'Apple'],
+    'Clock Speed': ['1.8 GHz', '2.1 GHz', '2.4 GHz', '2.6 GHz', '2.8 GHz', '3.2 GHz'],
+    'RAM Size': ['8GB', '12GB', '16GB', '32GB', '64GB'],
+    'Storage Type': ['SSD', 'HDD', 'HDD+SSD'],
+    'Display Type': ['LCD', 'LED', 'IPS', 'OLED', 'Retina'],
+    'Display Size': ['13.3"', '14"', '15.6"', '16"', '17.3"'],
+    'Graphics Processor': ['Intel UHD', 'Intel Iris Xe', 'AMD Radeon', 'NVIDIA GTX', 'NVIDIA RTX', 'Apple M1'],
+    'Screen Resolution': ['1366x768', '1920x1080', '2560x1600', '3840x2160'],
+    'OS': ['Windows 10', 'Windows 11', 'macOS', 'Linux'],
+    'Laptop Weight': ['1.2 kg', '1.5 kg', '1.8 kg', '2.3 kg', '2.5 kg', '2.8 kg'],
+    'Special Features': ['Backlit Keyboard', 'Fingerprint Sensor', 'RGB Keyboard', 'Touchscreen', 'Thunderbolt'],
+    'Warranty': ['1 year', '2 years', '3 years'],
+    'Average Battery Life': ['4 hours', '6 hours', '8 hours', '10 hours', '12 hours'],
+}
+
+# Prices are whole rupees in this range (INR); marketplace prices are rarely round, and the number
+# of distinct prices is what drives the recommendation table's size
+PRICE_RANGE = (25000, 300000)
+
+LEVEL_NAMES = {code: name for name, code in LEVEL_CODES.items()}
+
+
+# Draw the encoded columns of a synthetic catalogue: text column codes, prices and feature levels
+def synthetic_arrays(n, seed=0):
+    rng = np.random.default_rng(seed)
+    codes = {name: rng.integers(len(values), size=n, dtype=np.uint8) for name, values in VOCABULARY.items()}
+    prices = rng.integers(PRICE_RANGE[0], PRICE_RANGE[1] + 1, size=n, dtype=np.int64)
+    levels = rng.integers(1, 4, size=(n, len(FEATURE_KEYS)), dtype=np.uint8)
+    return codes, prices, levels
+
+
+# One description per (brand, model) pair, addressed by brand_code * len(models) + model_code
+def _descriptions():
+    return [f"The {brand} {model} is a laptop from the synthetic benchmark catalogue."
+            for brand in VOCABULARY['Brand'] for model in VOCABULARY['Model Name']]
+
+
+def synthetic_index(n, seed=0):
+    """
+    Builds a CatalogIndex over a synthetic catalogue without going through CSV, with text
+    columns dictionary-encoded like the compiled catalogue artifact.
+    """
+    codes, prices, levels = synthetic_arrays(n, seed)
+    description_codes = codes['Brand'].astype(np.uint16) * len(VOCABULARY['Model Name']) + codes['Model Name']
+    columns = [(name, _DictColumn(codes[name], values)) for name, values in VOCABULARY.items()]
+    columns.append(('Price', prices))
+    columns.append(('Description', _DictColumn(description_codes, _descriptions())))
+    return CatalogIndex(columns, prices, levels)
+
+
+def synthetic_frame(n, seed=0):
+    """
+    Returns the same synthetic catalogue as synthetic_index as a DataFrame in the
+    updated_laptop.csv schema (prices formatted "35,000", laptop_feature as a dict string).
+    """
+    codes, prices, levels = synthetic_arrays(n, seed)
+    frame = pd.DataFrame({name: np.asarray(values, dtype=object)[codes[name]] for name, values in VOCABULARY.items()})
+    frame['Price'] = pd.Series(prices).map('{:,}'.format)
+    description_codes = codes['Brand'].astype(np.intp) * len(VOCABULARY['Model Name']) + codes['Model Name']
+    frame['Description'] = np.asarray(_descriptions(), dtype=object)[description_codes]
+
+    # laptop_feature strings, formatted once per distinct level combination
+    combos, inverse = np.unique(levels, axis=0, return_inverse=True)
+    features = [str({key: LEVEL_NAMES[int(code)] for key, code in zip(FEATURE_KEYS, combo)}) for combo in combos]
+    frame['laptop_feature'] = np.asarray(features, dtype=object)[inverse.ravel()]
+    return frame
+
+
+# Complete user profiles with budgets spread over the catalogue's price range
+def sample_profiles(count, seed=0):
+    rng = np.random.default_rng(seed + 1)
+    profiles = []
+    for _ in range(count):
+        profile = {key: LEVEL_NAMES[int(code)] for key, code in zip(FEATURE_KEYS, rng.integers(1, 4, len(FEATURE_KEYS)))}
+        profile['Budget'] = int(rng.integers(PRICE_RANGE[0], PRICE_RANGE[1] + 1))
+        profiles.append(profile)
+    return profiles
+
+
+# profile -> top 3 JSON -> validated recommendations, as in a chat turn
+def recommend(index, profile):
+    return recommendation_validation(index.top_k_json(profile, k=3))
+
+
+def percentiles(seconds):
+    ms = np.asarray(seconds) * 1000
+    return {'p50_ms': round(float(np.percentile(ms, 50)), 4),
+            'p95_ms': round(float(np.percentile(ms, 95)), 4),
+            'p99_ms': round(float(np.percentile(ms, 99)), 4),
+            'mean_ms': round(float(ms.mean()), 4)}
+
+
+# Time queries until all profiles ran or the time budget is spent (at least min_queries)
+def time_queries(index, profiles, time_budget, min_queries=10):
+    latencies = []
+    started = time.perf_counter()
+    for profile in profiles:
+        start = time.perf_counter()
+        recommend(index, profile)
+        latencies.append(time.perf_counter() - start)
+        if len(latencies) >= min_queries and time.perf_counter() - started > time_budget:
+            break
+    total = sum(latencies)
+    return dict(percentiles(latencies), queries=len(latencies), throughput_qps=round(len(latencies) / total, 1))
+
+
+# Run fn and return (seconds, peak traced memory in MB)
+def traced(fn):
+    tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        fn()
+        seconds = time.perf_counter() - start
+        return round(seconds, 3), round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 2)
+    finally:
+        tracemalloc.stop()
+
+
+def index_nbytes(index):
+    total = index.prices.nbytes + index.levels.nbytes
+    for name, values in index.columns:
+        if isinstance(values, _DictColumn):
+            total += values.codes.nbytes
+        elif isinstance(values, np.ndarray) and values is not index.prices:
+            total += values.nbytes
+    return total
+
+
+def bench_size(n, args):
+    result = {'rows': n}
+
+    if n <= args.load_max_rows:
+        with tempfile.TemporaryDirectory() as workdir:
+            path = os.path.join(workdir, 'updated_laptop.csv')
+            synthetic_frame(n, args.seed).to_csv(path, index=False)
+            start = time.perf_counter()
+            CatalogIndex.from_csv(path)
+            result['csv_load_seconds'] = round(time.perf_counter() - start, 3)
+
+    index = synthetic_index(n, args.seed)
+    result['index_mb'] = round(index_nbytes(index) / 2 ** 20, 2)
+    result['distinct_prices'] = len(np.unique(index.prices))
+
+    result['table_build_seconds'], result['table_build_peak_mb'] = traced(index.build_table)
+    result['table_mb'] = round(index.table.nbytes / 2 ** 20, 2)
+    result['table_budget_buckets'] = index.table.stats()['budget_buckets']
+
+    profiles = sample_profiles(args.queries, args.seed)
+    # Memory is measured on the worst case, a budget covering the whole catalogue
+    widest = dict(profiles[0], Budget=PRICE_RANGE[1])
+    result['table'] = time_queries(index, profiles, args.time_budget)
+    result['table']['peak_mb'] = traced(lambda: recommend(index, widest))[1]
+
+    # The same profiles without the table take the full scoring pass
+    table, index.table = index.table, None
+    result['scan'] = time_queries(index, profiles, args.time_budget)
+    result['scan']['peak_mb'] = traced(lambda: recommend(index, widest))[1]
+    index.table = table
+    return result
+
+
+# Compare results with the baseline; returns the list of regressions
+def check(results, baseline, tolerance):
+    regressions = []
+    by_rows = {entry['rows']: entry for entry in baseline['results']}
+    for entry in results:
+        base = by_rows.get(entry['rows'])
+        if base is None:
+            continue
+        metrics = [('table', 'p50_ms'), ('scan', 'p50_ms'), ('table', 'peak_mb'), ('scan', 'peak_mb'),
+                   (None, 'table_build_peak_mb'), (None, 'table_mb')]
+        for section, metric in metrics:
+            current = entry[section][metric] if section else entry[metric]
+            reference = base[section][metric] if section else base[metric]
+            if current > reference * (1 + tolerance):
+                name = f"{section}.{metric}" if section else metric
+                regressions.append(f"{entry['rows']} rows: {name} {current} > {reference} (+{tolerance:.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)), help='comma-separated catalogue sizes')
+    parser.add_argument('--queries', type=int, default=500, help='profiles per path and size')
+    parser.add_argument('--time-budget', type=float, default=5.0, help='seconds of queries per path and size')
+    parser.add_argument('--load-max-rows', type=int, default=100000, help='largest size also loaded from CSV')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='also write the results to this JSON file')
+    parser.add_argument('--baseline', default=BASELINE, help='baseline JSON file')
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the new baseline')
+    parser.add_argument('--check', action='store_true', help='exit with status 1 on regressions against the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='allowed relative slowdown / memory growth')
+    args = parser.parse_args()
+
+    results = []
+    for n in (int(size) for size in args.sizes.split(',')):
+        result = bench_size(n, args)
+        print(json.dumps(result))
+        results.append(result)
+
+    report = {'python': sys.version.split()[0], 'numpy': np.__version__, 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+
+    if args.check:
+        with open(args.baseline) as f:
+            regressions = check(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print("Regression:", regression)
+        if regressions:
+            sys.exit(1)
+        print("No regressions against the baseline")
+
+
+if __name__ == '__main__':
+    main()
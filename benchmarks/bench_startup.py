@@ -0,0 +1,86 @@
+"""
+Worker boot-time benchmark for the Flask app.
+
+Each run starts a fresh interpreter, imports app.py and serves the first request to "/"
+through the Flask test client, reporting how long each step took. The OpenAI endpoint is
+pointed at a closed local port so any network call made during startup fails the run
+instead of silently slowing it down.
+
+Usage (from the repository root):
+    python benchmarks/bench_startup.py [--runs 5] [--output startup.json] [--max-seconds 3]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs inside the fresh interpreter and prints the step timings as JSON
+PROBE = r"""
+import json, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+client = app.app.test_client()
+response = client.get("/")
+served = time.perf_counter()
+assert response.status_code == 200, response.status_code
+print(json.dumps({"import_seconds": imported - start,
+                  "first_request_seconds": served - imported,
+                  "total_seconds": served - start}))
+"""
+
+
+# Start one fresh interpreter and return its timings
+def run_once(timeout, workdir):
+    env = dict(os.environ)
+    env["OPENAI_BASE_URL"] = "http://127.0.0.1:9/v1"
+    # Keep the benchmark's session and cache files out of the working tree
+    env.setdefault("SHOPASSIST_SESSION_DB", os.path.join(workdir, "sessions.db"))
+    env.setdefault("SHOPASSIST_RESPONSE_CACHE_DB", os.path.join(workdir, "llm_cache.db"))
+    result = subprocess.run([sys.executable, "-c", PROBE], cwd=ROOT, env=env, capture_output=True,
+                            text=True, timeout=timeout)
+    if result.returncode != 0:
+        raise RuntimeError(f"startup failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def summarize(samples):
+    summary = {}
+    for key in ("import_seconds", "first_request_seconds", "total_seconds"):
+        values = [s[key] for s in samples]
+        summary[key] = {"min": round(min(values), 4),
+                        "median": round(statistics.median(values), 4),
+                        "max": round(max(values), 4)}
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="number of fresh interpreters to start")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds before a run counts as hung")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    parser.add_argument("--max-seconds", type=float,
+                        help="exit with status 1 if the median import + first request exceeds this")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        samples = [run_once(args.timeout, workdir) for _ in range(args.runs)]
+    results = {"runs": args.runs, "python": sys.version.split()[0], "summary": summarize(samples)}
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.max_seconds is not None and results["summary"]["total_seconds"]["median"] > args.max_seconds:
+        print(f"Startup median exceeds {args.max_seconds}s")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""
+Load test of the chat routes.
+
+Drives N concurrent chat sessions through the Flask app and reports throughput and
+p50/p95/p99 latency per route. By default the app runs in this process on the simulated
+LLM backend (SHOPASSIST_LLM_BACKEND=simulated), so no API quota is used; pass --url to
+load-test a running server instead.
+
+Each session loads "/", sends the scripted user messages to /chat (or /chat_stream with
+--stream) and ends with /end_conv. With the default simulator settings the third message
+completes the profile, so every session also runs intent confirmation, catalogue scoring
+and the recommendation.
+
+Usage (from the repository root):
+    python benchmarks/load_test.py --sessions 200 --concurrency 50 [--stream] [--latency-ms 800]
+    python benchmarks/load_test.py --url http://127.0.0.1:5000 --sessions 20 --concurrency 5
+    python benchmarks/load_test.py --sessions 200 --concurrency 50 --rpm 500 --tpm 200000
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+USER_MESSAGES = [
+    "I am a video editor and mostly work with After Effects",
+    "I travel sometimes but do not carry my laptop",
+    "My budget is {budget} INR",
+    "Can you tell me more about the first laptop?",
+]
+
+BUDGETS = [60000, 80000, 100000, 150000, 200000]
+
+
+# Scripted user messages of one session; budgets vary between sessions
+def session_messages(index, turns):
+    budget = random.Random(index).choice(BUDGETS)
+    return [message.format(budget=budget) for message in USER_MESSAGES[:turns]]
+
+
+# Nearest-rank percentile of sorted values
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    rank = max(int(round(p / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+class Recorder:
+    """
+    Thread-safe collection of request latencies and errors per route.
+    """
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def record(self, route, seconds, ok):
+        with self._lock:
+            self.latencies.setdefault(route, []).append(seconds)
+            if not ok:
+                self.errors[route] = self.errors.get(route, 0) + 1
+
+    def report(self, wall_seconds):
+        routes = {}
+        for route, values in self.latencies.items():
+            values = sorted(values)
+            routes[route] = {"requests": len(values),
+                             "errors": self.errors.get(route, 0),
+                             "throughput_rps": round(len(values) / wall_seconds, 2),
+                             "mean_ms": round(sum(values) / len(values) * 1000, 1),
+                             "p50_ms": round(percentile(values, 50) * 1000, 1),
+                             "p95_ms": round(percentile(values, 95) * 1000, 1),
+                             "p99_ms": round(percentile(values, 99) * 1000, 1)}
+        return routes
+
+
+class AppClient:
+    """
+    Session client for the app running in this process (Flask test client).
+    """
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        response = self.client.open(path, method=method, data=data)
+        # Read the whole body so streamed responses are timed to their last event
+        response.get_data()
+        return response.status_code
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class HTTPClient:
+    """
+    Session client for a running server, keeping the session cookie and not following redirects.
+    """
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+                                                  _NoRedirect())
+
+    def request(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode('utf-8') if data is not None else None
+        try:
+            with self.opener.open(urllib.request.Request(self.base_url + path, data=body, method=method)) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+
+def run_session(client, index, args, recorder):
+    def timed(route, method, path, data=None):
+        start = time.perf_counter()
+        try:
+            ok = client.request(method, path, data) < 400
+        except Exception:
+            ok = False
+        recorder.record(route, time.perf_counter() - start, ok)
+
+    timed("GET /", "GET", "/")
+    chat_path = "/chat_stream" if args.stream else "/chat"
+    for message in session_messages(index, args.turns):
+        timed(f"POST {chat_path}", "POST", chat_path, {"user_input_message": message})
+    timed("GET /end_conv", "GET", "/end_conv")
+
+
+# Settings of the in-process app, applied before it is imported
+def configure_environment(args):
+    os.environ["SHOPASSIST_LLM_BACKEND"] = args.backend
+    os.environ["SHOPASSIST_SIM_LATENCY_MS"] = str(args.latency_ms)
+    os.environ["SHOPASSIST_SIM_JITTER"] = args.jitter
+    os.environ["SHOPASSIST_SIM_JITTER_MS"] = str(args.jitter_ms)
+    os.environ["SHOPASSIST_SIM_MODERATION_MS"] = str(args.moderation_ms)
+    os.environ["SHOPASSIST_SIM_TOKEN_MS"] = str(args.token_ms)
+    os.environ["SHOPASSIST_SIM_SEED"] = str(args.seed)
+    # The simulator has no rate limits, so the scheduler only throttles when limits are given
+    os.environ["SHOPASSIST_LLM_RPM"] = str(args.rpm)
+    os.environ["SHOPASSIST_LLM_TPM"] = str(args.tpm)
+    # Every session sends the same prompts, so a warm response cache would hide the backend latency
+    if not args.cache:
+        os.environ["SHOPASSIST_RESPONSE_CACHE"] = "0"
+    # Turn timings, intent confirmations and retries are logged at debug level
+    if args.verbose:
+        os.environ["SHOPASSIST_LOG_LEVEL"] = "DEBUG"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=50, help="number of chat sessions to run")
+    parser.add_argument("--concurrency", type=int, default=10, help="sessions running at the same time")
+    parser.add_argument("--turns", type=int, default=len(USER_MESSAGES), help="user messages per session")
+    parser.add_argument("--stream", action="store_true", help="send messages to /chat_stream instead of /chat")
+    parser.add_argument("--url", help="load-test a running server instead of the app in this process")
+    parser.add_argument("--backend", default="simulated", help="LLM backend of the in-process app")
+    parser.add_argument("--latency-ms", type=float, default=800, help="mean simulated completion latency")
+    parser.add_argument("--jitter", default="lognormal", choices=["none", "uniform", "normal", "lognormal"])
+    parser.add_argument("--jitter-ms", type=float, default=200, help="spread of the simulated latencies")
+    parser.add_argument("--moderation-ms", type=float, default=150, help="mean simulated moderation latency")
+    parser.add_argument("--token-ms", type=float, default=15, help="simulated delay between streamed tokens")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--rpm", type=float, default=0, help="requests per minute the scheduler admits (0: unlimited)")
+    parser.add_argument("--tpm", type=float, default=0, help="tokens per minute the scheduler admits (0: unlimited)")
+    parser.add_argument("--cache", action="store_true", help="keep the LLM response cache enabled")
+    parser.add_argument("--verbose", action="store_true", help="show the app's debug log")
+    parser.add_argument("--output", help="also write the report to this JSON file")
+    args = parser.parse_args()
+
+    if args.url:
+        make_client = lambda: HTTPClient(args.url)
+    else:
+        configure_environment(args)
+        os.chdir(ROOT)
+        sys.path.insert(0, ROOT)
+        import app
+        make_client = lambda: AppClient(app.app)
+
+    recorder = Recorder()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        futures = [pool.submit(run_session, make_client(), index, args, recorder) for index in range(args.sessions)]
+        for future in futures:
+            future.result()
+    wall = time.perf_counter() - start
+
+    requests = sum(len(v) for v in recorder.latencies.values())
+    report = {"target": args.url or f"in-process ({args.backend} backend)",
+              "sessions": args.sessions,
+              "concurrency": args.concurrency,
+              "wall_seconds": round(wall, 2),
+              "sessions_per_second": round(args.sessions / wall, 2),
+              "requests_per_second": round(requests / wall, 2),
+              "routes": recorder.report(wall)}
+    if not args.url:
+        from scheduler import get_scheduler
+        report["scheduler"] = get_scheduler().stats()
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,697 @@
+import ast
+import itertools
+import json
+import logging
+import math
+import os
+import shutil
+import threading
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from llm_cache import LRUCache
+from search_index import SearchIndex
+
+logger = logging.getLogger(__name__)
+
+# Path of the enriched catalogue produced by gen_updated_latop_data
+LAPTOP_DATA = 'updated_laptop.csv'
+
+# Directory of the compiled, memory-mappable catalogue artifact
+CATALOG_ARTIFACT = os.environ.get('SHOPASSIST_CATALOG_ARTIFACT', 'catalog_artifact')
+ARTIFACT_VERSION = 2
+
+# The five feature keys shared by the user profile and the laptop_feature column
+FEATURE_KEYS = ['GPU intensity', 'Display quality', 'Portability', 'Multitasking', 'Processing speed']
+
+# Feature levels are stored as small integers; 0 means missing or not one of low/medium/high
+LEVEL_CODES = {'low': 1, 'medium': 2, 'high': 3}
+
+# Number of results precomputed per (profile, budget bucket) in the recommendation table
+TABLE_TOP_K = 3
+# Budget buckets of the recommendation table; catalogues with more distinct prices share a bucket
+# between several prices, which bounds the table at about 243 * k * 5 bytes per bucket
+TABLE_MAX_BUCKETS = int(os.environ.get('SHOPASSIST_TABLE_MAX_BUCKETS', '1024'))
+
+# Keys of a profile the recommendation table can answer; any other key changes the score
+TABLE_PROFILE_KEYS = frozenset(FEATURE_KEYS + ['Budget'])
+# Level codes of every complete profile, ordered so that RecommendationTable.profile_index() addresses them
+_TABLE_PROFILES = np.array([combo[::-1] for combo in itertools.product((1, 2, 3), repeat=len(FEATURE_KEYS))],
+                           dtype=np.uint8)
+
+# Field selections whose batch records are cached; the selection comes from the caller, so the
+# least recently used ones are dropped
+RECORD_CACHE_FIELD_SETS = int(os.environ.get('SHOPASSIST_RECORD_CACHE_FIELD_SETS', '8'))
+
+
+# Convert a 'low'/'medium'/'high' string to its integer code
+def encode_level(value):
+    return LEVEL_CODES.get(value, 0)
+
+
+# Parse the laptop_feature column, which holds a python-repr dictionary string
+def parse_features(value):
+    if isinstance(value, dict):
+        return value
+    try:
+        parsed = ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return {}
+    return parsed if isinstance(parsed, dict) else {}
+
+
+# Parse the Price column ("35,000") into an integer array
+def parse_prices(prices):
+    return pd.Series(prices).astype(str).str.replace(',', '').astype(np.int64).to_numpy()
+
+
+# Largest budget magnitude that fits the int64 price comparisons
+BUDGET_LIMIT = int(np.iinfo(np.int64).max)
+
+
+# Budget of a profile as an integer, or None if it is not a finite number within the int64 range
+def parse_budget(value):
+    try:
+        budget = value if type(value) is int else int(value or 0)
+    except (TypeError, ValueError, OverflowError):
+        return None
+    return budget if -BUDGET_LIMIT <= budget <= BUDGET_LIMIT else None
+
+
+def encode_profiles(profiles):
+    """
+    Encodes user profiles as arrays for batch scoring.
+
+    Parameters:
+    profiles (list): Profiles shaped like get_user_info's output.
+
+    Returns:
+    tuple: (codes, budgets, complete) - a uint8 (profiles x FEATURE_KEYS) level matrix, an
+    int64 budget array, and a mask of the profiles the recommendation table can answer
+    (every level set, a numeric budget and no other keys).
+    """
+    count = len(profiles)
+    codes = np.empty((count, len(FEATURE_KEYS)), dtype=np.uint8)
+    for col, key in enumerate(FEATURE_KEYS):
+        codes[:, col] = np.fromiter((LEVEL_CODES.get(p.get(key), 0) for p in profiles), dtype=np.uint8, count=count)
+    budgets = [parse_budget(p.get('Budget', 0)) for p in profiles]
+    valid = np.fromiter((b is not None for b in budgets), dtype=bool, count=count)
+    budgets = np.fromiter((b or 0 for b in budgets), dtype=np.int64, count=count)
+    plain = np.fromiter((p.keys() <= TABLE_PROFILE_KEYS for p in profiles), dtype=bool, count=count)
+    return codes, budgets, (codes > 0).all(axis=1) & valid & plain
+
+
+# Convert numpy / pandas scalars into plain JSON-serialisable python values
+def _json_value(value):
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+class CatalogIndex:
+    """
+    In-memory index over the enriched laptop catalogue.
+
+    Prices are kept as an int64 array and the five feature levels as a uint8 matrix
+    (one row per laptop, one column per FEATURE_KEYS entry), so a user profile is
+    scored against every laptop in a single vectorised pass.
+    """
+
+    def __init__(self, columns, prices, levels, path=None, mtime=None):
+        # columns: list of (name, numpy object array) used to build the output records
+        self.columns = columns
+        self.prices = prices
+        self.levels = levels
+        self.path = path
+        self.mtime = mtime
+        # Generation directory of the artifact the catalogue is memory-mapped from, None if parsed from the CSV
+        self.artifact = None
+        self.table = None
+        # BM25 index over the text columns, compiled into the artifact (see search_index.get_search_index)
+        self.search_index = None
+        # fields -> {row: record} for the most recently used field selections, see record_fields and record_prefix
+        self._record_fields = LRUCache(RECORD_CACHE_FIELD_SETS)
+        self._record_prefixes = LRUCache(RECORD_CACHE_FIELD_SETS)
+
+    @classmethod
+    def from_frame(cls, laptop_df, path=None, mtime=None):
+        prices = parse_prices(laptop_df['Price'])
+
+        levels = np.zeros((len(laptop_df), len(FEATURE_KEYS)), dtype=np.uint8)
+        for row, value in enumerate(laptop_df['laptop_feature']):
+            features = parse_features(value)
+            for col, key in enumerate(FEATURE_KEYS):
+                levels[row, col] = encode_level(features.get(key))
+
+        columns = []
+        for name in laptop_df.columns:
+            if name == 'laptop_feature':
+                continue
+            values = prices if name == 'Price' else laptop_df[name].to_numpy(dtype=object)
+            columns.append((name, values))
+
+        return cls(columns, prices, levels, path=path, mtime=mtime)
+
+    @classmethod
+    def from_csv(cls, path=LAPTOP_DATA):
+        mtime = os.path.getmtime(path)
+        return cls.from_frame(pd.read_csv(path), path=path, mtime=mtime)
+
+    def __len__(self):
+        return len(self.prices)
+
+    # Precompute the top-k for every complete profile and budget bucket
+    def build_table(self, k=TABLE_TOP_K):
+        self.table = RecommendationTable.build(self.levels, self.prices, k)
+        return self.table
+
+    # Translate a user profile into (columns to compare, required level codes, constant score offset)
+    @staticmethod
+    def profile_codes(user_req):
+        cols = []
+        codes = []
+        offset = 0
+        for key, user_value in user_req.items():
+            if key == 'Budget':
+                continue
+            if key in FEATURE_KEYS:
+                cols.append(FEATURE_KEYS.index(key))
+                codes.append(encode_level(user_value))
+            elif encode_level(user_value) == 0:
+                # The catalogue has no such feature, which only "meets" an unknown requirement
+                offset += 1
+        return np.array(cols, dtype=np.intp), np.array(codes, dtype=np.uint8), offset
+
+    def score(self, user_req, rows=None):
+        """
+        Scores laptops against the user requirements.
+
+        Parameters:
+        user_req (dict): The user profile, as returned by get_user_info.
+        rows (np.ndarray): Optional row indices to score; defaults to the whole catalogue.
+
+        Returns:
+        np.ndarray: Number of features for which each laptop meets or exceeds the requirement.
+        """
+        cols, codes, offset = self.profile_codes(user_req)
+        levels = self.levels if rows is None else self.levels[rows]
+        scores = (levels[:, cols] >= codes).sum(axis=1, dtype=np.int64)
+        return scores + offset
+
+    def top_k(self, user_req, k=3):
+        """
+        Returns the indices and scores of the k best laptops within the user's budget.
+
+        Laptops are ranked by score (descending); equal scores keep catalogue order.
+        Complete profiles are answered from the precomputed table when it has been built.
+        """
+        table = self.table
+        if table is not None and k <= table.k:
+            found = table.lookup(user_req, self.prices)
+            if found is not None:
+                rows, scores = found
+                return rows[:k], scores[:k]
+
+        budget = int(user_req.get('Budget', 0) or 0)
+        rows = np.flatnonzero(self.prices <= budget)
+        if len(rows) == 0:
+            return rows, np.zeros(0, dtype=np.int64)
+
+        scores = self.score(user_req, rows)
+
+        # Composite key: higher score first, then lower row position
+        keys = scores * len(self) - rows
+        if len(rows) > k:
+            best = np.argpartition(-keys, k - 1)[:k]
+        else:
+            best = np.arange(len(rows))
+        best = best[np.argsort(-keys[best], kind='stable')]
+        return rows[best], scores[best]
+
+    def records(self, rows, scores):
+        records = []
+        for row, score in zip(rows, scores):
+            record = {name: _json_value(values[row]) for name, values in self.columns}
+            record['Score'] = int(score)
+            records.append(record)
+        return records
+
+    def top_k_json(self, user_req, k=3):
+        rows, scores = self.top_k(user_req, k)
+        return json.dumps(self.records(rows, scores))
+
+    def top_k_batch(self, profiles, k=3):
+        """
+        Top-k laptops for many profiles at once.
+
+        Complete profiles are answered with one vectorised gather from the recommendation table;
+        the others (and every profile when there is no table or k exceeds it) go through top_k.
+
+        Parameters:
+        profiles (list): Profiles shaped like get_user_info's output.
+        k (int): Number of laptops per profile.
+
+        Returns:
+        tuple: (rows, scores) - (profiles x k) arrays in ranking order, with row -1 where fewer
+        than k laptops are within budget. Raises ValueError for a non-numeric budget, like top_k.
+        """
+        rows = np.full((len(profiles), k), -1, dtype=np.int64)
+        scores = np.zeros((len(profiles), k), dtype=np.int64)
+        table = self.table
+        if table is not None and k <= table.k:
+            codes, budgets, complete = encode_profiles(profiles)
+            found = np.flatnonzero(complete)
+            table_rows, table_scores = table.lookup_batch(codes[found], budgets[found], self.prices)
+            rows[found] = table_rows[:, :k]
+            scores[found] = table_scores[:, :k]
+            pending = np.flatnonzero(~complete)
+        else:
+            pending = range(len(profiles))
+
+        for i in pending:
+            found_rows, found_scores = self.top_k(profiles[i], k)
+            rows[i, :len(found_rows)] = found_rows
+            scores[i, :len(found_rows)] = found_scores
+        return rows, scores
+
+    # Selected fields of a laptop as a dictionary, cached per row since batch results repeat rows
+    def record_fields(self, row, fields):
+        cache = _field_cache(self._record_fields, fields)
+        record = cache.get(row)
+        if record is None:
+            columns = dict(self.columns)
+            record = cache[row] = {name: _json_value(columns[name][row]) for name in fields}
+        return record
+
+    # JSON text of record_fields without the closing brace, so a score can be appended
+    def record_prefix(self, row, fields):
+        cache = _field_cache(self._record_prefixes, fields)
+        prefix = cache.get(row)
+        if prefix is None:
+            prefix = cache[row] = json.dumps(self.record_fields(row, fields))[:-1]
+        return prefix
+
+
+# The per-row cache of a field selection, created on first use
+def _field_cache(caches, fields):
+    cache = caches.get(fields)
+    if cache is None:
+        cache = {}
+        caches.set(fields, cache)
+    return cache
+
+
+class RecommendationTable:
+    """
+    Precomputed top-k results for every complete user profile and budget bucket.
+
+    A complete profile has one of low/medium/high for each of the five FEATURE_KEYS,
+    so there are 3^5 of them. The ranking only changes at the catalogue's distinct
+    price points, so budgets are bucketed at those prices. Catalogues with more than
+    max_buckets distinct prices get edges at evenly spaced price ranks instead; a budget
+    above its bucket's lower edge then rescans the few laptops priced in between and merges
+    them into the bucket's top-k, so results stay exact while the table stays bounded.
+    """
+
+    def __init__(self, breakpoints, covered, rows, scores, order, levels, build_seconds):
+        # breakpoints: sorted bucket edges; bucket b covers budgets in [breakpoints[b-1], breakpoints[b])
+        self.breakpoints = breakpoints
+        # covered: laptops (in price order) ranked in each bucket, i.e. those priced up to its lower edge
+        self.covered = covered
+        # rows / scores: (profiles, buckets, k) arrays, padded with row -1 when fewer than k laptops fit
+        self.rows = rows
+        self.scores = scores
+        # order: catalogue rows sorted by price, for the rescan above a bucket's lower edge
+        self.order = order
+        self.sorted_prices = None
+        self.levels = levels
+        self.build_seconds = build_seconds
+
+    @property
+    def k(self):
+        return self.rows.shape[2]
+
+    @property
+    def nbytes(self):
+        return self.breakpoints.nbytes + self.covered.nbytes + self.rows.nbytes + self.scores.nbytes + self.order.nbytes
+
+    def stats(self):
+        return {
+            'profiles': self.rows.shape[0],
+            'budget_buckets': self.rows.shape[1],
+            'k': self.k,
+            'build_seconds': round(self.build_seconds, 4),
+            'nbytes': self.nbytes,
+        }
+
+    # Index of a complete profile in the table, or None if the profile is partial / has other values
+    @staticmethod
+    def profile_index(user_req):
+        index = 0
+        for key in reversed(FEATURE_KEYS):
+            code = encode_level(user_req.get(key))
+            if code == 0:
+                return None
+            index = index * 3 + (code - 1)
+        if any(key != 'Budget' and key not in FEATURE_KEYS for key in user_req):
+            return None
+        return index
+
+    def budget_bucket(self, budget):
+        return int(np.searchsorted(self.breakpoints, budget, side='right'))
+
+    # Laptops within budget but above the bucket's lower edge, which the bucket's top-k does not include
+    def _uncovered(self, bucket, budget, prices):
+        if self.sorted_prices is None:
+            self.sorted_prices = prices[self.order]
+        return self.order[self.covered[bucket]:np.searchsorted(self.sorted_prices, budget, side='right')]
+
+    # Merge the bucket's top-k of one profile with the uncovered laptops, ranked by score then row
+    def _merge(self, index, bucket, extra):
+        rows = self.rows[index, bucket]
+        rows = rows[rows >= 0].astype(np.intp)
+        scores = self.scores[index, bucket][:len(rows)].astype(np.int64)
+        if len(extra):
+            profile = _TABLE_PROFILES[index]
+            rows = np.concatenate([rows, extra])
+            scores = np.concatenate([scores, (self.levels[extra] >= profile).sum(axis=1, dtype=np.int64)])
+            best = np.argsort(-(scores * len(self.order) - rows), kind='stable')[:self.k]
+            rows, scores = rows[best], scores[best]
+        return rows, scores
+
+    def lookup(self, user_req, prices):
+        """
+        Returns the (rows, scores) of the profile, or None if it is not in the table.
+
+        Parameters:
+        user_req (dict): The user profile.
+        prices (np.ndarray): The catalogue's prices, for the rescan above a bucket's lower edge.
+        """
+        index = self.profile_index(user_req)
+        if index is None:
+            return None
+        budget = int(user_req.get('Budget', 0) or 0)
+        bucket = self.budget_bucket(budget)
+        return self._merge(index, bucket, self._uncovered(bucket, budget, prices))
+
+    def lookup_batch(self, codes, budgets, prices):
+        """
+        Vectorised lookup of complete profiles.
+
+        Parameters:
+        codes (np.ndarray): (profiles x FEATURE_KEYS) level codes, all between 1 and 3.
+        budgets (np.ndarray): Budget of each profile.
+        prices (np.ndarray): The catalogue's prices, for the rescan above a bucket's lower edge.
+
+        Returns:
+        tuple: (rows, scores) - (profiles x k) arrays, with row -1 as padding.
+        """
+        # Same addressing as profile_index: the first feature key is the least significant digit
+        weights = 3 ** np.arange(len(FEATURE_KEYS), dtype=np.intp)
+        index = (codes.astype(np.intp) - 1) @ weights
+        buckets = np.searchsorted(self.breakpoints, budgets, side='right')
+        rows = self.rows[index, buckets].astype(np.int64)
+        scores = self.scores[index, buckets].astype(np.int64)
+
+        # Only budgets above their bucket's lower edge need a rescan; none do when every price is an edge
+        if self.sorted_prices is None:
+            self.sorted_prices = prices[self.order]
+        stops = np.searchsorted(self.sorted_prices, budgets, side='right')
+        for i in np.flatnonzero(stops > self.covered[buckets]):
+            found_rows, found_scores = self._merge(index[i], buckets[i], self.order[self.covered[buckets[i]]:stops[i]])
+            rows[i] = -1
+            rows[i, :len(found_rows)] = found_rows
+            scores[i] = 0
+            scores[i, :len(found_rows)] = found_scores
+        return rows, scores
+
+    @classmethod
+    def build(cls, levels, prices, k=TABLE_TOP_K, max_buckets=TABLE_MAX_BUCKETS):
+        started = time.perf_counter()
+        n = len(prices)
+        profiles = _TABLE_PROFILES
+
+        order = np.argsort(prices, kind='stable')
+        sorted_prices = prices[order]
+        breakpoints = np.unique(sorted_prices)
+        if len(breakpoints) > max_buckets:
+            # Edges at evenly spaced price ranks, so every bucket leaves about as many laptops to rescan
+            breakpoints = np.unique(sorted_prices[np.arange(max_buckets) * n // max_buckets])
+        covered = np.zeros(len(breakpoints) + 1, dtype=np.int64)
+        covered[1:] = np.searchsorted(sorted_prices, breakpoints, side='right')
+
+        table_rows = np.full((len(profiles), len(breakpoints) + 1, k), -1, dtype=np.int32)
+        table_scores = np.zeros((len(profiles), len(breakpoints) + 1, k), dtype=np.uint8)
+
+        # A laptop's score only depends on its combination of levels, so score each profile against
+        # every combination once (level 0 is never met) and gather the laptops' scores from that
+        combos = np.array(list(itertools.product(range(4), repeat=len(FEATURE_KEYS))), dtype=np.uint8)
+        combo_scores = (combos[None, :, :] >= profiles[:, None, :]).sum(axis=2, dtype=np.int64)
+        laptop_combos = levels.astype(np.intp) @ (4 ** np.arange(len(FEATURE_KEYS) - 1, -1, -1, dtype=np.intp))
+
+        # Running top-k per profile, ranked by (score, -row) encoded as score * n - row
+        sentinel = -(n + 1)
+        best_keys = np.full((len(profiles), k), sentinel, dtype=np.int64)
+
+        for bucket in range(1, len(breakpoints) + 1):
+            group = order[covered[bucket - 1]:covered[bucket]]
+            group_scores = combo_scores[:, laptop_combos[group]]
+            keys = np.concatenate([best_keys, group_scores * n - group], axis=1)
+            if keys.shape[1] > k:
+                keys = np.take_along_axis(keys, np.argpartition(-keys, k - 1, axis=1)[:, :k], axis=1)
+            best_keys = -np.sort(-keys, axis=1)
+
+            valid = best_keys > sentinel
+            scores = np.where(valid, (best_keys + n - 1) // n, 0)
+            table_rows[:, bucket] = np.where(valid, scores * n - best_keys, -1)
+            table_scores[:, bucket] = scores
+
+        table = cls(breakpoints, covered, table_rows, table_scores, order, levels, time.perf_counter() - started)
+        table.sorted_prices = sorted_prices
+        return table
+
+
+class _DictColumn:
+    """Dictionary-encoded column: integer codes into a list of distinct values."""
+
+    def __init__(self, codes, values):
+        self.codes = codes
+        self.values = values
+
+    def __getitem__(self, row):
+        return self.values[self.codes[row]]
+
+
+class _TextColumn:
+    """UTF-8 strings stored back to back in one buffer, addressed through an offsets array."""
+
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    def __getitem__(self, row):
+        return self.data[self.offsets[row]:self.offsets[row + 1]].tobytes().decode('utf-8')
+
+
+# Smallest unsigned integer type able to hold n distinct codes
+def _code_dtype(n):
+    return np.uint8 if n <= 2 ** 8 else np.uint16 if n <= 2 ** 16 else np.uint32
+
+
+def compile_catalog(path=LAPTOP_DATA, artifact_dir=CATALOG_ARTIFACT):
+    """
+    Compiles the enriched CSV into a typed catalogue artifact that workers memory-map at startup.
+
+    The artifact holds int64 prices, the uint8 feature-level matrix, dictionary-encoded
+    categorical columns (Brand, Model Name, ...), the precomputed recommendation table, the
+    BM25 search index of follow-up questions and, in a separate side file, the descriptions. Each compile writes a new generation directory
+    and then atomically repoints artifact_dir/CURRENT at it, so running workers never see a
+    half-written artifact.
+
+    Returns:
+    str: The generation directory that was written.
+    """
+    source_mtime = os.path.getmtime(path)
+    laptop_df = pd.read_csv(path)
+    catalog = CatalogIndex.from_frame(laptop_df)
+    table = catalog.build_table()
+
+    os.makedirs(artifact_dir, exist_ok=True)
+    generation = f"gen-{time.time_ns()}-{uuid.uuid4().hex[:8]}"
+    target = os.path.join(artifact_dir, generation)
+    os.makedirs(target)
+
+    np.save(os.path.join(target, 'price.npy'), catalog.prices)
+    np.save(os.path.join(target, 'levels.npy'), catalog.levels)
+    np.save(os.path.join(target, 'table_breakpoints.npy'), table.breakpoints)
+    np.save(os.path.join(target, 'table_covered.npy'), table.covered)
+    np.save(os.path.join(target, 'table_order.npy'), table.order)
+    np.save(os.path.join(target, 'table_rows.npy'), table.rows)
+    np.save(os.path.join(target, 'table_scores.npy'), table.scores)
+    # Built here, in the generation job, so no chat turn ever waits for it
+    search = SearchIndex.from_catalog(catalog)
+
+    columns = []
+    for position, name in enumerate(laptop_df.columns):
+        if name == 'laptop_feature':
+            continue
+        if name == 'Price':
+            columns.append({'name': name, 'kind': 'price'})
+        elif name == 'Description':
+            encoded = [str(value).encode('utf-8') for value in laptop_df[name]]
+            offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum([len(value) for value in encoded])
+            with open(os.path.join(target, 'descriptions.bin'), 'wb') as f:
+                f.write(b''.join(encoded))
+            np.save(os.path.join(target, 'descriptions.offsets.npy'), offsets)
+            columns.append({'name': name, 'kind': 'text'})
+        else:
+            codes, values = pd.factorize(laptop_df[name], use_na_sentinel=False)
+            values = [_json_value(value) for value in values]
+            file = f'col{position}.codes.npy'
+            np.save(os.path.join(target, file), codes.astype(_code_dtype(len(values))))
+            columns.append({'name': name, 'kind': 'dict', 'file': file, 'values': values})
+
+    meta = {'version': ARTIFACT_VERSION,
+            'rows': len(catalog),
+            'source': os.path.abspath(path),
+            'source_mtime': source_mtime,
+            'columns': columns,
+            'table': table.stats(),
+            'search': search.save(target)}
+    with open(os.path.join(target, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+    # Publish the new generation, then drop all but the previous one
+    pointer = os.path.join(artifact_dir, 'CURRENT')
+    with open(pointer + '.tmp', 'w') as f:
+        f.write(generation)
+    os.replace(pointer + '.tmp', pointer)
+    for old in sorted(os.listdir(artifact_dir))[:-2]:
+        if old.startswith('gen-') and old != generation:
+            shutil.rmtree(os.path.join(artifact_dir, old), ignore_errors=True)
+
+    return target
+
+
+def load_artifact(artifact_dir=CATALOG_ARTIFACT, path=LAPTOP_DATA):
+    """
+    Memory-maps the current catalogue artifact.
+
+    Returns:
+    CatalogIndex: The catalogue (with its recommendation table), or None if there is no
+    artifact or it was compiled from an older version of the CSV at path.
+    """
+    try:
+        with open(os.path.join(artifact_dir, 'CURRENT')) as f:
+            target = os.path.join(artifact_dir, f.read().strip())
+        with open(os.path.join(target, 'meta.json')) as f:
+            meta = json.load(f)
+    except FileNotFoundError:
+        return None
+    if meta['version'] != ARTIFACT_VERSION or meta['source_mtime'] != os.path.getmtime(path):
+        return None
+
+    # Plain ndarray views of the mappings; indexing np.memmap objects directly is much slower
+    def load(file):
+        return np.asarray(np.load(os.path.join(target, file), mmap_mode='r'))
+
+    prices = load('price.npy')
+    columns = []
+    for column in meta['columns']:
+        if column['kind'] == 'price':
+            values = prices
+        elif column['kind'] == 'text':
+            data = np.zeros(0, dtype=np.uint8)
+            if os.path.getsize(os.path.join(target, 'descriptions.bin')):
+                data = np.asarray(np.memmap(os.path.join(target, 'descriptions.bin'), dtype=np.uint8, mode='r'))
+            values = _TextColumn(data, load('descriptions.offsets.npy'))
+        else:
+            values = _DictColumn(load(column['file']), column['values'])
+        columns.append((column['name'], values))
+
+    levels = load('levels.npy')
+    catalog = CatalogIndex(columns, prices, levels, path=path, mtime=meta['source_mtime'])
+    catalog.artifact = target
+    catalog.table = RecommendationTable(load('table_breakpoints.npy'), load('table_covered.npy'), load('table_rows.npy'),
+                                        load('table_scores.npy'), load('table_order.npy'), levels,
+                                        meta['table']['build_seconds'])
+    if meta.get('search'):
+        catalog.search_index = SearchIndex.load(target, meta['search'])
+    return catalog
+
+
+# Build the recommendation table of a catalogue parsed from the CSV (the artifact carries its own)
+def _build_table(catalog):
+    try:
+        table = catalog.build_table()
+    except Exception:
+        logger.exception("Building the recommendation table failed")
+        return
+    logger.debug("Recommendation table built: %s", table.stats())
+
+
+_catalog = None
+_catalog_signature = None
+_catalog_lock = threading.Lock()
+
+
+# Change signature of the catalogue sources: the CSV and the artifact's CURRENT pointer
+def _source_signature(path, artifact_dir):
+    try:
+        artifact_mtime = os.path.getmtime(os.path.join(artifact_dir, 'CURRENT'))
+    except OSError:
+        artifact_mtime = None
+    return path, os.path.getmtime(path), artifact_mtime
+
+
+# Return the shared catalogue index, (re)loading it if the CSV or the artifact changed on disk
+def get_catalog(path=LAPTOP_DATA, artifact_dir=CATALOG_ARTIFACT):
+    return _shared_catalog(path, artifact_dir, parse_csv=True)
+
+
+# Return the shared catalogue index if it is memory-mapped from a current artifact, otherwise None;
+# never parses the CSV, for catalogues too large to hold in memory
+def get_artifact_catalog(path=LAPTOP_DATA, artifact_dir=CATALOG_ARTIFACT):
+    catalog = _shared_catalog(path, artifact_dir, parse_csv=False)
+    return catalog if catalog is not None and catalog.artifact is not None else None
+
+
+def _shared_catalog(path, artifact_dir, parse_csv):
+    global _catalog, _catalog_signature
+    catalog = _catalog
+    signature = _source_signature(path, artifact_dir)
+    if catalog is not None and _catalog_signature == signature:
+        return catalog
+
+    with _catalog_lock:
+        if _catalog is None or _catalog_signature != signature:
+            # Prefer the memory-mapped artifact; fall back to parsing the CSV if it is missing or stale
+            catalog = load_artifact(artifact_dir, path)
+            if catalog is None:
+                if not parse_csv:
+                    return None
+                catalog = CatalogIndex.from_csv(path)
+                # Requests are answered by full scans until the table is ready, so none waits for the build
+                threading.Thread(target=_build_table, args=(catalog,), name='recommendation-table', daemon=True).start()
+            _catalog = catalog
+            _catalog_signature = signature
+        return _catalog
+
+
+# Drop the cached catalogue so the next call to get_catalog re-reads it
+def reload_catalog(path=LAPTOP_DATA, artifact_dir=CATALOG_ARTIFACT):
+    global _catalog
+    with _catalog_lock:
+        _catalog = None
+    return get_catalog(path, artifact_dir)
+
+
+if __name__ == '__main__':
+    # Compile the current updated_laptop.csv into the artifact
+    print("Catalogue artifact written to", compile_catalog())
@@ -0,0 +1,160 @@
+import heapq
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from catalog import (CatalogIndex, FEATURE_KEYS, LAPTOP_DATA, CATALOG_ARTIFACT, encode_level, parse_budget,
+                     parse_features, parse_prices, get_artifact_catalog, _json_value)
+
+# 'memory' scores the catalogue held by get_catalog; 'stream' reads it in chunks on every request
+CATALOG_MODE = os.environ.get('SHOPASSIST_CATALOG_MODE', 'memory')
+
+# Rows read and scored per chunk in stream mode
+STREAM_CHUNK_ROWS = int(os.environ.get('SHOPASSIST_STREAM_CHUNK_ROWS', '100000'))
+
+# Order of laptops with equal scores: catalogue order, cheapest first or most expensive first
+TIE_BREAKS = ('row', 'price_asc', 'price_desc')
+STREAM_TIE_BREAK = os.environ.get('SHOPASSIST_STREAM_TIE_BREAK', 'row')
+
+
+# Level codes of a laptop_feature column; each distinct dictionary string is parsed only once
+def _feature_levels(values):
+    codes, uniques = pd.factorize(pd.Series(values), use_na_sentinel=False)
+    parsed = np.zeros((len(uniques), len(FEATURE_KEYS)), dtype=np.uint8)
+    for i, value in enumerate(uniques):
+        features = parse_features(value)
+        parsed[i] = [encode_level(features.get(key)) for key in FEATURE_KEYS]
+    return parsed[codes]
+
+
+def iter_csv_chunks(path=LAPTOP_DATA, chunk_rows=STREAM_CHUNK_ROWS):
+    """
+    Reads an enriched catalogue CSV chunk by chunk.
+
+    Yields:
+    tuple: (first_row, prices, levels, record) per chunk - the global index of the chunk's first
+    row, its int64 prices, its uint8 level matrix, and a function returning the output record
+    of a row of the chunk.
+    """
+    first_row = 0
+    for chunk in pd.read_csv(path, chunksize=chunk_rows):
+        prices = parse_prices(chunk['Price'])
+        levels = _feature_levels(chunk['laptop_feature'].to_numpy(dtype=object))
+        columns = [name for name in chunk.columns if name != 'laptop_feature']
+
+        def record(row, chunk=chunk, prices=prices, columns=columns):
+            values = chunk.iloc[row]
+            return {name: _json_value(prices[row] if name == 'Price' else values[name]) for name in columns}
+
+        yield first_row, prices, levels, record
+        first_row += len(chunk)
+
+
+def iter_index_chunks(catalog, chunk_rows=STREAM_CHUNK_ROWS):
+    """
+    Reads a CatalogIndex chunk by chunk, in the form of iter_csv_chunks. With the memory-mapped
+    artifact from load_artifact only the pages of the chunk being scored are touched.
+    """
+    for start in range(0, len(catalog), chunk_rows):
+        end = min(start + chunk_rows, len(catalog))
+
+        def record(row, start=start):
+            return catalog.records([start + row], [0])[0]
+
+        yield start, catalog.prices[start:end], catalog.levels[start:end], record
+
+
+# Heap key of a laptop: larger is better, so the heap's smallest entry is the one to evict
+def _heap_key(score, price, row, tie_break):
+    if tie_break == 'price_asc':
+        return (score, -price, -row)
+    if tie_break == 'price_desc':
+        return (score, price, -row)
+    return (score, -row)
+
+
+# Positions (within the chunk) of at most k laptops that can still make the overall top k
+def _chunk_candidates(scores, prices, k, tie_break):
+    if len(scores) <= k:
+        return np.arange(len(scores))
+    # The k-th best score of the chunk; everything above it is a candidate
+    kth = np.partition(scores, len(scores) - k)[len(scores) - k]
+    above = np.flatnonzero(scores > kth)
+    tied = np.flatnonzero(scores == kth)
+    need = k - len(above)
+    if tie_break == 'price_asc':
+        tied = tied[np.lexsort((tied, prices[tied]))]
+    elif tie_break == 'price_desc':
+        tied = tied[np.lexsort((tied, -prices[tied]))]
+    return np.concatenate([above, tied[:need]])
+
+
+def stream_top_k(user_req, chunks, k=3, tie_break=STREAM_TIE_BREAK):
+    """
+    Scores a catalogue chunk by chunk and keeps only a bounded top-k heap, so memory stays
+    flat however large the catalogue is.
+
+    Parameters:
+    user_req (dict): The user profile, as returned by get_user_info.
+    chunks (iterable): Chunks from iter_csv_chunks or iter_index_chunks.
+    k (int): Number of laptops to return.
+    tie_break (str): Order of laptops with equal scores, one of TIE_BREAKS.
+
+    Returns:
+    list: Records of the top k laptops within budget, best first, each with its 'Score'.
+    With tie_break='row' this is the same ranking as CatalogIndex.top_k.
+    """
+    if tie_break not in TIE_BREAKS:
+        raise ValueError(f"tie_break must be one of {TIE_BREAKS}, got {tie_break!r}")
+    budget = parse_budget(user_req.get('Budget', 0))
+    if budget is None:
+        raise ValueError(f"'Budget' must be a finite number within the 64-bit integer range, got {user_req['Budget']!r}")
+    cols, codes, offset = CatalogIndex.profile_codes(user_req)
+
+    heap = []
+    for first_row, prices, levels, record in chunks:
+        within = np.flatnonzero(prices <= budget)
+        if len(within) == 0:
+            continue
+        scores = (levels[within][:, cols] >= codes).sum(axis=1, dtype=np.int64) + offset
+        for i in _chunk_candidates(scores, prices[within], k, tie_break):
+            row = int(within[i])
+            key = _heap_key(int(scores[i]), int(prices[row]), first_row + row, tie_break)
+            if len(heap) < k:
+                heapq.heappush(heap, (key, dict(record(row), Score=int(scores[i]))))
+            elif key > heap[0][0]:
+                heapq.heapreplace(heap, (key, dict(record(row), Score=int(scores[i]))))
+
+    return [entry for key, entry in sorted(heap, key=lambda item: item[0], reverse=True)]
+
+
+def stream_top_k_json(user_req, path=LAPTOP_DATA, artifact_dir=CATALOG_ARTIFACT, k=3, tie_break=STREAM_TIE_BREAK,
+                      chunk_rows=STREAM_CHUNK_ROWS):
+    """
+    Streaming counterpart of CatalogIndex.top_k_json: reads the current artifact if there is
+    one for path (memory-mapped once and shared, see get_artifact_catalog), otherwise the CSV
+    itself, and returns the top k as a JSON string.
+    """
+    catalog = get_artifact_catalog(path, artifact_dir)
+    if catalog is not None:
+        chunks = iter_index_chunks(catalog, chunk_rows)
+    else:
+        chunks = iter_csv_chunks(path, chunk_rows)
+    return json.dumps(stream_top_k(user_req, chunks, k, tie_break))
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Top-k laptops of a catalogue CSV too large for memory.')
+    parser.add_argument('profile', help='user profile as JSON, e.g. \'{"GPU intensity": "high", ..., "Budget": 150000}\'')
+    parser.add_argument('--source', default=LAPTOP_DATA, help='enriched catalogue CSV')
+    parser.add_argument('--k', type=int, default=3)
+    parser.add_argument('--tie-break', default=STREAM_TIE_BREAK, choices=TIE_BREAKS)
+    parser.add_argument('--chunk-rows', type=int, default=STREAM_CHUNK_ROWS)
+    args = parser.parse_args()
+    for laptop in stream_top_k(json.loads(args.profile), iter_csv_chunks(args.source, args.chunk_rows), args.k,
+                               args.tie_break):
+        print(json.dumps(laptop))
@@ -0,0 +1,307 @@
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from functions import initialize_conv_reco, get_chat_completions, moderation_check, intent_confirmation_layer, recommendation_validation, register_trusted_text, CompletionStream, compare_laptops_with_user, structured_profile, followup_messages
+from history import compact_history
+from metrics import TURN_STAGE_SECONDS, TURN_SECONDS, TURN_LLM_CALLS, CallCounter, counting_llm_calls
+import resilience
+
+logger = logging.getLogger(__name__)
+
+# Prompt appended to the newest user message of each request to remind the assistant of its role (laptop-focused).
+# It is not stored in the conversation, see compact_history
+ROLE_REMINDER = '. Remember your system message and that you are an intelligent laptop assistant. So, you only help with questions around laptop. If user asks about something else, tell him explicitly that you answer only laptop related questions.'
+
+FLAGGED_MESSAGE = "Sorry, this message has been flagged. Please restart your conversation."
+FETCHING_MESSAGE = "Thank you for providing all the information. Kindly wait, while I fetch the products:"
+NO_MATCH_MESSAGE = "Sorry, we do not have laptops that match your requirement. Connecting you to a human assistant."
+ALREADY_PROVIDED_MESSAGE = "Top 3 recommendations already provided. Please end the conversation."
+UNAVAILABLE_MESSAGE = "Sorry, I am having trouble answering right now. Please try again in a moment."
+ERROR_MESSAGE = "Sorry, something went wrong while answering. Please try again."
+register_trusted_text(FLAGGED_MESSAGE, FETCHING_MESSAGE, NO_MATCH_MESSAGE, ALREADY_PROVIDED_MESSAGE, UNAVAILABLE_MESSAGE,
+                      ERROR_MESSAGE)
+
+# A streamed response is moderated each time it has grown by this many characters and
+# reaches a sentence boundary, and once more when it is complete
+MODERATION_CHECKPOINT_CHARS = 300
+
+# Moderation runs in the background so it overlaps with the completion and the token stream
+_moderation_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="moderation")
+# Non-streamed completions run here while the request thread waits on input moderation
+_completion_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="completion")
+
+
+class Flagged(Exception):
+    pass
+
+
+class TurnTimings:
+    """
+    Wall-clock timings of the stages of one chat turn, in milliseconds from the start of the turn.
+    Stages that run concurrently (e.g. input moderation and the completion) overlap in time.
+    Every stage is also observed in the shopassist_turn_stage_seconds histogram. llm_calls
+    counts the turn's LLM backend calls by operation.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = []
+        self.llm_calls = CallCounter()
+
+    def _ms(self, t):
+        return round((t - self.started) * 1000, 1)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            TURN_STAGE_SECONDS.observe(end - start, stage=name)
+            self.stages.append({"stage": name, "start_ms": self._ms(start), "end_ms": self._ms(end),
+                                "duration_ms": round((end - start) * 1000, 1)})
+
+    # Call fn(*args) inside a stage; used to time work submitted to the thread pools
+    def timed(self, name, fn, *args):
+        with self.stage(name):
+            return fn(*args)
+
+    def as_dict(self):
+        return {"total_ms": self._ms(time.perf_counter()),
+                "llm_calls": self.llm_calls.as_dict(),
+                "stages": sorted(self.stages, key=lambda s: s["start_ms"])}
+
+
+# Raise Flagged if the text does not pass moderation
+def _check_moderation(text, timings, stage="output_moderation"):
+    if timings.timed(stage, moderation_check, text) == 'Flagged':
+        raise Flagged()
+
+
+# Wait for the input moderation started at the beginning of the turn
+def _check_input(input_check):
+    if input_check is not None and input_check.result() == 'Flagged':
+        raise Flagged()
+
+
+def _complete(messages, stream, timings, stage="completion", input_check=None):
+    """
+    Gets a chat completion and checks it for flagged content, yielding "token" events while it streams.
+
+    The completion is started without waiting for input_check, the pending moderation of the
+    user's message; if that comes back flagged the completion is discarded (or the stream closed)
+    and nothing is shown to the user. Returns the completion output.
+    """
+    if not stream:
+        future = resilience.submit(_completion_pool, timings.timed, stage, get_chat_completions, messages)
+        try:
+            _check_input(input_check)
+        except Flagged:
+            future.cancel()
+            raise
+        output = future.result()
+        _check_moderation(output, timings)
+        return output
+
+    completion = CompletionStream(messages)
+    text = ''
+    checked = 0
+    checkpoints = []
+    # Tokens are held back until the user's message has passed moderation
+    held = []
+    try:
+        with timings.stage(stage):
+            for token in completion:
+                text += token
+                if input_check is not None:
+                    if not input_check.done():
+                        held.append(token)
+                        continue
+                    _check_input(input_check)
+                    input_check = None
+                    token = ''.join(held) + token
+                    held = []
+                yield {"event": "token", "data": token}
+
+                # Stop streaming as soon as a finished checkpoint comes back flagged
+                if any(f.done() and f.result() == 'Flagged' for f in checkpoints):
+                    raise Flagged()
+                if len(text) - checked >= MODERATION_CHECKPOINT_CHARS and text.rstrip()[-1:] in ('.', '!', '?', ':'):
+                    checkpoints.append(resilience.submit(_moderation_pool, moderation_check, text))
+                    checked = len(text)
+    finally:
+        completion.close()
+
+    _check_input(input_check)
+    if held:
+        yield {"event": "token", "data": ''.join(held)}
+    _check_moderation(completion.output, timings)
+    if any(f.result() == 'Flagged' for f in checkpoints):
+        raise Flagged()
+    return completion.output
+
+
+def run_turn(state, user_input, stream=False):
+    """
+    Runs one chat turn against a session state, mutating the state in place.
+
+    Parameters:
+    state (dict): The session state ('conversation', 'conversation_bot', 'top_3_laptops', 'conversation_reco').
+    user_input (str): The user's message.
+    stream (bool): Stream assistant completions and emit their text as "token" events.
+
+    Yields:
+    dict: Events with keys "event" and "data". "token" carries a piece of streamed assistant
+    text, "message" a complete bot message, and "flagged" ends the turn because moderation
+    flagged the input or the response; the state must then be discarded. "unavailable" ends
+    the turn because the LLM backend could not answer within the turn deadline (or its circuit
+    breaker is open); the turn is then undone, except for the notice shown in the chat. "error"
+    ends the turn the same way after any other failure (e.g. an unparseable reply). Every
+    turn ends with a "timings" event carrying TurnTimings.as_dict().
+    """
+    timings = TurnTimings()
+    outcome = "completed"
+    snapshot = _snapshot(state)
+    try:
+        # Every LLM call of the turn, including retries, has to finish within the turn deadline
+        with resilience.deadline(), counting_llm_calls(timings.llm_calls):
+            yield from _run_turn(state, user_input, stream, timings)
+    except Flagged:
+        outcome = "flagged"
+        logger.debug("Turn flagged by moderation")
+        yield {"event": "flagged", "data": FLAGGED_MESSAGE}
+    except resilience.Unavailable as e:
+        outcome = "unavailable"
+        logger.debug("Turn abandoned: %r", e)
+        _restore(state, snapshot)
+        state["conversation_bot"].extend([{"user": user_input}, {"bot": UNAVAILABLE_MESSAGE}])
+        yield {"event": "unavailable", "data": UNAVAILABLE_MESSAGE}
+    except Exception:
+        outcome = "error"
+        logger.exception("Chat turn failed")
+        _restore(state, snapshot)
+        state["conversation_bot"].extend([{"user": user_input}, {"bot": ERROR_MESSAGE}])
+        yield {"event": "error", "data": ERROR_MESSAGE}
+
+    TURN_SECONDS.observe(time.perf_counter() - timings.started, outcome=outcome)
+    TURN_LLM_CALLS.observe(timings.llm_calls.total())
+
+    turn_timings = timings.as_dict()
+    logger.debug("Turn timings: %s", turn_timings)
+    yield {"event": "timings", "data": turn_timings}
+
+
+# Top 3 laptops (JSON) for a confirmed profile. A structured profile is scored locally; only a profile
+# described in prose needs the LLM, to call compare_laptops_with_user with it
+def _score_catalog(response_assistant, conversation):
+    profile = structured_profile(response_assistant)
+    if profile is not None:
+        return compare_laptops_with_user(profile)
+    return get_chat_completions(compact_history(conversation))
+
+
+# What a turn may change in a session state, to undo an abandoned turn
+def _snapshot(state):
+    conversation_reco = state["conversation_reco"]
+    return (len(state["conversation"]), len(state["conversation_bot"]), state["top_3_laptops"], conversation_reco,
+            None if conversation_reco is None else len(conversation_reco))
+
+
+def _restore(state, snapshot):
+    conversation_length, bot_length, top_3_laptops, conversation_reco, reco_length = snapshot
+    del state["conversation"][conversation_length:]
+    del state["conversation_bot"][bot_length:]
+    state["top_3_laptops"] = top_3_laptops
+    state["conversation_reco"] = conversation_reco
+    if conversation_reco is not None:
+        del conversation_reco[reco_length:]
+
+
+def _run_turn(state, user_input, stream, timings):
+    conversation = state["conversation"]
+    conversation_bot = state["conversation_bot"]
+
+    # Check user input for inappropriate content, concurrently with the completion below
+    input_check = resilience.submit(_moderation_pool, timings.timed, "input_moderation", moderation_check, user_input)
+
+    # If top 3 laptops is not yet retrieved, use the LLM to ask more questions.
+    # If top 3 laptops are fetched, recommend the laptops, and remind the user to end the conversation
+    if state["top_3_laptops"] is None:
+
+        conversation.append({"role": "user", "content": user_input})
+        conversation_bot.append({"user": user_input})
+
+        # Get chatbot response on the budgeted history, checking it for flagged content
+        response_assistant = yield from _complete(compact_history(conversation, reminder=ROLE_REMINDER), stream, timings,
+                                                  input_check=input_check)
+
+        # Verify if the intent confirmation is complete
+        confirmation = timings.timed("intent_confirmation", intent_confirmation_layer, response_assistant)
+
+        logger.debug("Intent confirmation: %s", confirmation.get('result'))
+
+        # If confirmation is incomplete, continue the conversation
+        if "No" in confirmation.get('result'):
+            conversation.append({"role": "assistant", "content": str(response_assistant)})
+            conversation_bot.append({"bot":  str(response_assistant)})
+            if not isinstance(response_assistant, str):
+                yield {"event": "message", "data": str(response_assistant)}
+
+        else:
+            # If the confirmation is successful, proceed to generate laptop recommendations
+            logger.debug("Profile extracted: %s", response_assistant)
+            conversation.append({"role": "user", "content": json.dumps(response_assistant)})
+            conversation.append({"role": "assistant", "content": "Thank you for providing all the information. Kindly wait, while I fetch the top 3 laptops from the catalogue:"})
+            conversation_bot.append({"bot":  FETCHING_MESSAGE})
+            yield {"event": "message", "data": FETCHING_MESSAGE}
+
+            # Get the top 3 laptops based on the user's input
+            top_3_laptops = timings.timed("catalog_scoring", _score_catalog, response_assistant, conversation)
+            state["top_3_laptops"] = top_3_laptops
+
+            # Validate recommendations based on extracted variables
+            validated_reco = timings.timed("validation", recommendation_validation, top_3_laptops)
+
+            conversation_reco = initialize_conv_reco(validated_reco)
+            if len(validated_reco) == 0:
+                # If no laptops match the user's preferences, notify the user; there is nothing for the LLM to summarise
+                recommendation = NO_MATCH_MESSAGE
+                yield {"event": "message", "data": NO_MATCH_MESSAGE}
+            else:
+                # Initialize a new conversation for recommendations, checking the recommendation's moderation status
+                recommendation = yield from _complete(conversation_reco, stream, timings, stage="recommendation")
+
+            # Add recommendations to the conversation history
+            conversation_reco.append({"role": "user", "content": "This is my user profile" + str(response_assistant)})
+            conversation_reco.append({"role": "assistant", "content": str(recommendation)})
+            conversation_bot.append({"bot":  recommendation})
+            state["conversation_reco"] = conversation_reco
+    else:
+        conversation_reco = state["conversation_reco"]
+
+        # If there is no recommendation conversation to continue, remind the user to end the conversation
+        if conversation_reco is None:
+            _check_input(input_check)
+            conversation_bot.append({"user":  user_input})
+            conversation_bot.append({"bot":  ALREADY_PROVIDED_MESSAGE})
+            yield {"event": "message", "data": ALREADY_PROVIDED_MESSAGE}
+        else:
+            # Continue conversation with additional user input
+            conversation_reco.append({"role": "user", "content": user_input})
+            conversation_bot.append({"user":  user_input})
+
+            # Only the catalogue excerpts that match the question are sent with it, not the full product records
+            products = recommendation_validation(state["top_3_laptops"])
+            messages = timings.timed("retrieval", followup_messages, conversation_reco, products)
+
+            # Get chatbot response for the follow-up conversation, checking its moderation status
+            response_asst_reco = yield from _complete(compact_history(messages), stream, timings, input_check=input_check)
+
+            # Append response to the conversation history
+            conversation_reco.append({"role": "assistant", "content": response_asst_reco})
+            response_asst_reco = response_asst_reco.replace("\n", "<br/><br/>")
+            conversation_bot.append({"bot":  response_asst_reco})
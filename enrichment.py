@@ -0,0 +1,193 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Concurrency and rate limits of catalogue enrichment, overridable from the environment
+ENRICHMENT_WORKERS = int(os.environ.get('SHOPASSIST_ENRICHMENT_WORKERS', '8'))
+ENRICHMENT_RPM = float(os.environ.get('SHOPASSIST_ENRICHMENT_RPM', '300'))
+
+# 'rules' classifies from the structured columns and uses the LLM only as a fallback; 'llm' classifies every row
+ENRICHMENT_ENGINE = os.environ.get('SHOPASSIST_ENRICHMENT_ENGINE', 'rules')
+
+# Per-description checkpoint of classification results
+ENRICHMENT_DB = os.environ.get('SHOPASSIST_ENRICHMENT_DB', 'enrichment.db')
+
+
+# Content hash of a description; the namespace keeps results of different classifiers apart
+def description_hash(description, namespace='product_map_layer'):
+    return hashlib.sha256(f"{namespace}\0{description}".encode('utf-8')).hexdigest()
+
+
+class EnrichmentCheckpoint:
+    """
+    Classification results keyed by description hash, stored in a local SQLite file.
+
+    Every result is committed as soon as its row finishes, so an interrupted run resumes
+    where it stopped and rows whose Description did not change are never re-classified.
+    """
+
+    def __init__(self, path=ENRICHMENT_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""CREATE TABLE IF NOT EXISTS enrichment (
+                                      description_hash TEXT PRIMARY KEY,
+                                      result TEXT NOT NULL,
+                                      updated_at REAL NOT NULL)""")
+
+    def get_many(self, hashes):
+        found = {}
+        hashes = list(set(hashes))
+        with self._lock:
+            # Stay well below SQLite's limit on bound parameters
+            for start in range(0, len(hashes), 500):
+                chunk = hashes[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT description_hash, result FROM enrichment WHERE description_hash IN ({','.join('?' * len(chunk))})",
+                    chunk)
+                found.update((h, json.loads(result)) for h, result in rows)
+        return found
+
+    def put(self, description_hash, result):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO enrichment (description_hash, result, updated_at) VALUES (?, ?, ?)",
+                               (description_hash, json.dumps(result), time.time()))
+
+    def put_many(self, items):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO enrichment (description_hash, result, updated_at) VALUES (?, ?, ?)",
+                                   [(h, json.dumps(result), now) for h, result in items])
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM enrichment").fetchone()[0]
+
+    def close(self):
+        self._conn.close()
+
+
+class RateLimiter:
+    """
+    Limiter that spaces calls evenly so at most `rpm` start per minute.
+    """
+
+    def __init__(self, rpm):
+        self.interval = 60.0 / rpm if rpm else 0.0
+        self._next_slot = time.monotonic()
+        self._lock = threading.Lock()
+
+    # Reserve the next start slot and return how many seconds the caller must wait for it
+    def reserve(self):
+        if not self.interval:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        return slot - now
+
+    # Wait until the caller may start its request, without holding a thread
+    async def aacquire(self):
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class EnrichmentProgress:
+    """
+    Completed/total row counts and throughput of an enrichment run.
+    """
+
+    def __init__(self, total, reused=0):
+        self.total = total
+        self.reused = reused
+        self.completed = reused
+        self.started = time.monotonic()
+
+    def as_dict(self):
+        elapsed = time.monotonic() - self.started
+        classified = self.completed - self.reused
+        return {'completed': self.completed,
+                'total': self.total,
+                'reused': self.reused,
+                'elapsed_seconds': round(elapsed, 1),
+                'rows_per_second': round(classified / elapsed, 2) if elapsed > 0 else 0.0}
+
+
+# Group rows by description and reuse checkpointed results; returns the shared state of a run
+def _prepare(descriptions, checkpoint, namespace):
+    descriptions = list(descriptions)
+    results = [None] * len(descriptions)
+
+    # Group rows by description so each distinct description is classified once
+    rows_by_hash = {}
+    description_by_hash = {}
+    for row, description in enumerate(descriptions):
+        h = description_hash(description, namespace)
+        rows_by_hash.setdefault(h, []).append(row)
+        description_by_hash[h] = description
+
+    stored = checkpoint.get_many(rows_by_hash) if checkpoint is not None else {}
+    for h, result in stored.items():
+        for row in rows_by_hash[h]:
+            results[row] = result
+
+    progress = EnrichmentProgress(len(descriptions), reused=sum(len(rows_by_hash[h]) for h in stored))
+    return results, rows_by_hash, description_by_hash, stored, progress
+
+
+async def aenrich_descriptions(descriptions, aclassify, max_concurrency=ENRICHMENT_WORKERS, rpm=ENRICHMENT_RPM,
+                               on_progress=None, checkpoint=None, namespace='product_map_layer'):
+    """
+    Classifies laptop descriptions as concurrent coroutines on the running event loop.
+
+    Parameters:
+    descriptions (list): Laptop descriptions, one per catalogue row.
+    aclassify (coroutine function): Maps one description to its classification (e.g. aproduct_map_layer).
+    max_concurrency (int): Maximum number of classifications in flight.
+    rpm (float): Maximum number of classifications started per minute (0 for no limit).
+    on_progress (callable): Called with EnrichmentProgress.as_dict() after every completed row.
+    checkpoint (EnrichmentCheckpoint): Optional store of earlier results; rows whose description
+        is already in it are reused, and every new result is written to it as soon as it is ready.
+    namespace (str): Identifies the classifier in the checkpoint's description hashes.
+
+    Returns:
+    list: The classifications, in the same order as descriptions.
+    """
+    results, rows_by_hash, description_by_hash, stored, progress = _prepare(descriptions, checkpoint, namespace)
+    limiter = RateLimiter(rpm)
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run(h):
+        async with semaphore:
+            await limiter.aacquire()
+            result = await aclassify(description_by_hash[h])
+        if checkpoint is not None:
+            checkpoint.put(h, result)
+        for row in rows_by_hash[h]:
+            results[row] = result
+        progress.completed += len(rows_by_hash[h])
+        if on_progress is not None:
+            on_progress(progress.as_dict())
+
+    if on_progress is not None:
+        on_progress(progress.as_dict())
+
+    tasks = [asyncio.ensure_future(run(h)) for h in rows_by_hash if h not in stored]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        # Don't start the remaining rows once one has failed
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+    return results
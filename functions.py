@@ -1,7 +1,25 @@
-import openai
 import pandas as pd
 import json
-from tenacity import retry, wait_random_exponential, stop_after_attempt
+import ast
+import math
+import asyncio
+import logging
+import os
+import re
+import time
+from catalog import get_catalog, reload_catalog, compile_catalog, parse_features, parse_budget, FEATURE_KEYS
+from catalog_stream import CATALOG_MODE, stream_top_k_json
+from llm_cache import response_cache, moderation_cache, make_key
+from llm_client import close_async_client, async_limit
+from llm_backend import get_backend
+from metrics import LLM_REQUEST_SECONDS, LLM_CACHE, record_llm_call
+import resilience
+import scheduler
+from enrichment import aenrich_descriptions, EnrichmentCheckpoint, ENRICHMENT_WORKERS, ENRICHMENT_RPM, ENRICHMENT_DB, ENRICHMENT_ENGINE
+from product_rules import classify_catalog, classification_stats
+from search_index import SearchIndex, get_search_index, matching_sentences
+
+logger = logging.getLogger(__name__)
 
 # Set model and data paths
 MODEL = 'gpt-3.5-turbo'
@@ -222,65 +240,353 @@ def initialize_conversation():
     return conversation
 
 
+# Build the arguments of a chat completion request
+def _completion_request(input, func_call = True, seed = 2345):
+    request = {"model": MODEL, "messages": input, "seed": seed}
+    if func_call:
+        # Enable function calling
+        request["functions"] = function_descriptions
+        request["function_call"] = 'auto'
+    return request
+
+
+# Cache key of a request: the hash of (backend, model, messages, functions, seed), so simulated
+# answers never reach the OpenAI backend's callers
+def _response_cache_key(request):
+    return make_key(backend = get_backend().name, model = request["model"], messages = request["messages"],
+                    functions = request.get("functions"), seed = request["seed"])
+
+
+# Look up a cached completion, counting hits and misses
+def _cache_lookup(key, use_cache):
+    if not use_cache:
+        return None
+    message = response_cache.get(key)
+    LLM_CACHE.inc(result = "miss" if message is None else "hit")
+    return message
+
+
+# Parse a response with output, evicting it from the cache if it was served from there and does not parse
+def _cached_output(key, message, output):
+    try:
+        return output(message)
+    except Exception:
+        response_cache.delete(key)
+        raise
+
+
+# Get a chat completion from the LLM backend and return output(message), answering from the response
+# cache when possible. Requests go through the resilience layer (retries, circuit breaker, turn deadline
+# and hedging), and each attempt is admitted by the shared rate-limit scheduler. A response is only
+# cached once output has parsed it, so a malformed reply is not replayed to later requests
+def _cached_completion(request, output, use_cache = True, operation = "completion"):
+    key = _response_cache_key(request)
+    message = _cache_lookup(key, use_cache)
+    if message is not None:
+        return _cached_output(key, message, output)
+
+    record_llm_call(operation)
+    with LLM_REQUEST_SECONDS.time(operation = operation):
+        message = resilience.call(operation, scheduler.scheduled(get_backend().complete, request), request,
+                                  hedge = True)
+    result = output(message)
+    if use_cache:
+        response_cache.set(key, message)
+    return result
+
+
+# Async counterpart of _cached_completion, sharing the same response cache
+async def _acached_completion(request, output, use_cache = True, operation = "completion"):
+    key = _response_cache_key(request)
+    message = _cache_lookup(key, use_cache)
+    if message is not None:
+        return _cached_output(key, message, output)
+
+    record_llm_call(operation)
+    async with async_limit():
+        with LLM_REQUEST_SECONDS.time(operation = operation):
+            message = await resilience.acall(operation, scheduler.ascheduled(get_backend().acomplete, request),
+                                             request)
+    result = output(message)
+    if use_cache:
+        response_cache.set(key, message)
+    return result
+
+
+# Return the message text, or execute the function the model called and return its result
+def _message_output(message):
+    function_call = message["function_call"]
+
+    if function_call is None:
+        return message["content"]
+
+    # If a function is called, execute the function
+    function_name = function_call["name"]
+    function_args = json.loads(function_call["arguments"])
+
+    # Dynamically call the function from the globals() dictionary
+    function_to_call = globals()[function_name]
+    return function_to_call(function_args)
+
+
 # Function to get chat completions with optional function calling
-@retry(wait=wait_random_exponential(min=1, max=20), stop=stop_after_attempt(6))
-def get_chat_completions(input, func_call = True):
+def get_chat_completions(input, func_call = True, use_cache = True):
+    """
+    Parameters:
+    input (list): The conversation messages.
+    func_call (bool): Let the model call the functions in function_descriptions.
+    use_cache (bool): Look up and store the response in the shared response cache.
 
-    if func_call:
-        # Call OpenAI API with function calling enabled
-        chat_completion = openai.chat.completions.create(
-                model = MODEL,
-                messages = input,
-                functions =  function_descriptions,
-                function_call = 'auto',            
-                seed = 2345)
-    else:
-         # Call OpenAI API without function calling
-        chat_completion = openai.chat.completions.create(
-                model = MODEL,
-                messages = input,       
-                seed = 2345)        
+    Returns:
+    str or the called function's result: The assistant's reply.
+    """
+    return _cached_completion(_completion_request(input, func_call), _message_output, use_cache)
 
-    # Check if a function call was invoked
-    function_call = chat_completion.choices[0].message.function_call
 
-    if function_call is None:
-        output = chat_completion.choices[0].message.content
-    else:
-        # If a function is called, execute the function
-        function_name = function_call.name
-        function_args = json.loads(function_call.arguments)
+# Async variant of get_chat_completions, for issuing many requests from one event loop
+async def aget_chat_completions(input, func_call = True, use_cache = True):
+    return await _acached_completion(_completion_request(input, func_call), _message_output, use_cache)
 
-        # Dynamically call the function from the globals() dictionary
-        function_to_call = globals()[function_name]
-        output = function_to_call(function_args)
 
-    return output
+# Open a streaming chat completion; only opening the stream is retried, and it is not hedged
+def _create_completion_stream(request):
+    return resilience.call("stream", scheduler.scheduled(get_backend().stream, request), request)
 
 
-# Function to check for inappropriate content using OpenAI moderation API
-def moderation_check(user_input):
+class CompletionStream:
+    """
+    Streaming counterpart of get_chat_completions.
+
+    Iterating yields the assistant's text as it arrives. Once iteration finishes, `output`
+    holds the same value get_chat_completions would have returned: the full text, or the
+    result of the called function when the model invokes one. Cached responses are
+    replayed as a single chunk, and completed streams are added to the cache.
+    """
+
+    def __init__(self, input, func_call = True, use_cache = True):
+        self.request = _completion_request(input, func_call)
+        self.use_cache = use_cache
+        self.output = None
+        self._stream = None
+
+    def __iter__(self):
+        key = _response_cache_key(self.request)
+        message = _cache_lookup(key, self.use_cache)
+        if message is not None:
+            if message["content"]:
+                yield message["content"]
+            self.output = _cached_output(key, message, _message_output)
+            return
+
+        started = time.perf_counter()
+        record_llm_call("completion")
+        self._stream = _create_completion_stream(self.request)
+        content = []
+        function_name = ''
+        function_arguments = []
+
+        try:
+            # A stream that outlives the turn deadline is cut off
+            for delta in resilience.bounded(self._stream):
+                if delta["function_call"] is not None:
+                    # Function calls arrive as fragments of the name and JSON arguments
+                    function_name += delta["function_call"]["name"] or ''
+                    function_arguments.append(delta["function_call"]["arguments"] or '')
+                elif delta["content"]:
+                    content.append(delta["content"])
+                    yield delta["content"]
+        except resilience.DeadlineExceeded:
+            # bounded closes the stream once its pending read returns
+            self._stream = None
+            raise
+
+        if function_name:
+            message = {"content": None,
+                       "function_call": {"name": function_name, "arguments": ''.join(function_arguments)}}
+        else:
+            message = {"content": ''.join(content), "function_call": None}
+        LLM_REQUEST_SECONDS.observe(time.perf_counter() - started, operation = "stream")
+        self.output = _message_output(message)
+        if self.use_cache:
+            response_cache.set(key, message)
+
+    # Stop reading the response, e.g. when moderation flags the partial text
+    def close(self):
+        if self._stream is not None:
+            self._stream.close()
+
+
+# Short replies that are passed by the moderation pre-screen without a remote call
+SAFE_PHRASES = {'yes', 'no', 'ok', 'okay', 'sure', 'yes please', 'no thanks', 'thanks', 'thank you',
+                'hi', 'hello', 'hey', 'exit', 'low', 'medium', 'high', 'correct', 'right', 'fine'}
+
+# Budget-like replies such as "150000", "1.5 lakh", "Rs 80,000" or "50k inr"
+SAFE_BUDGET_PATTERN = re.compile(r'(rs\.?|inr|₹)?\s*\d[\d,]*(\.\d+)?\s*(k|l|lac|lacs|lakh|lakhs|thousand|inr|rs|rupees)?\s*(inr|rs|rupees)?')
+
+# Normalised texts the app generated itself (canned messages), see register_trusted_text
+_trusted_texts = set()
+
+
+# Normalise text for moderation lookups: lower-case, collapse whitespace, drop edge punctuation
+def normalize_moderation_text(text):
+    return ' '.join(str(text).lower().split()).strip(' .!?,')
+
+
+# Mark app-generated texts as safe so the moderation pre-screen passes them
+def register_trusted_text(*texts):
+    for text in texts:
+        _trusted_texts.add(normalize_moderation_text(text))
+
+
+# Local pre-screen: True if the normalised text is trivially safe
+def moderation_prescreen(normalized_text):
+    return (normalized_text in SAFE_PHRASES
+            or normalized_text in _trusted_texts
+            or SAFE_BUDGET_PATTERN.fullmatch(normalized_text) is not None)
+
+
+# Local part of moderation: returns (verdict, cache key); the verdict is None if the API must be asked
+def _moderation_lookup(user_input):
 
     if isinstance(user_input, dict):
-        return "Not Flagged"
+        return "Not Flagged", None
+
+    # Trivially safe inputs skip the remote call
+    normalized = normalize_moderation_text(user_input)
+    if moderation_prescreen(normalized):
+        moderation_cache.count_prescreened()
+        return "Not Flagged", None
+
+    # Reuse the verdict for text that was already moderated
+    key = moderation_cache.key(normalized)
+    return moderation_cache.get(key), key
+
 
-    # Call the OpenAI API to perform moderation on the user's input.
-    response = openai.moderations.create(input=user_input)
+# Turn the backend's flagged result into a verdict and remember it
+def _moderation_verdict(flagged, key):
 
-    # Extract the moderation result from the API response.
-    moderation_output = response.results[0].flagged
     # Check if the input was flagged by the moderation system.
-    if response.results[0].flagged == True:
+    if flagged == True:
         # If flagged, return "Flagged"
-        return "Flagged"
+        verdict = "Flagged"
     else:
         # If not flagged, return "Not Flagged"
-        return "Not Flagged"
+        verdict = "Not Flagged"
+
+    moderation_cache.set(key, verdict)
+    return verdict
+
+
+# Function to check for inappropriate content using OpenAI moderation API
+def moderation_check(user_input):
+    verdict, key = _moderation_lookup(user_input)
+    if verdict is not None:
+        return verdict
+
+    # Ask the LLM backend (the OpenAI moderation API by default) to moderate the user's input.
+    record_llm_call("moderation")
+    with LLM_REQUEST_SECONDS.time(operation = "moderation"):
+        flagged = resilience.call("moderation", get_backend().moderate, user_input, hedge = True)
+    return _moderation_verdict(flagged, key)
+
 
+# Async variant of moderation_check
+async def amoderation_check(user_input):
+    verdict, key = _moderation_lookup(user_input)
+    if verdict is not None:
+        return verdict
 
-# Function to confirm if user intent is fully captured    
-def intent_confirmation_layer(response_assistant):
+    record_llm_call("moderation")
+    async with async_limit():
+        with LLM_REQUEST_SECONDS.time(operation = "moderation"):
+            flagged = await resilience.acall("moderation", get_backend().amoderate, user_input)
+    return _moderation_verdict(flagged, key)
 
+
+# Greeting of every new conversation; the welcome message the system prompt asks for
+DEFAULT_INTRODUCTION = "Hello! I'm here to help you find the best laptop that suits your needs. Could you please share with me what you primarily use or plan to use your laptop for? This will help me understand your requirements better."
+register_trusted_text(DEFAULT_INTRODUCTION)
+
+
+def get_introduction():
+    """
+    Returns the assistant's opening message, DEFAULT_INTRODUCTION, without any network I/O.
+    """
+    return DEFAULT_INTRODUCTION
+
+
+# Keys of a complete user profile, as produced by get_user_info
+PROFILE_KEYS = FEATURE_KEYS + ['Budget']
+
+
+# Validate a user profile dictionary locally, applying the same rules as the intent confirmation prompt
+def validate_user_profile(profile):
+    """
+    Parameters:
+    profile (dict): The user profile to check.
+
+    Returns:
+    dict: {'result': 'Yes'} if every key is filled correctly, otherwise {'result': 'No', 'reason': ...}.
+    """
+    allowed_values = ('low', 'medium', 'high')
+
+    missing = [key for key in PROFILE_KEYS if key not in profile]
+    if missing:
+        return {'result': 'No', 'reason': f"Missing keys: {', '.join(missing)}."}
+
+    for key in FEATURE_KEYS:
+        if profile[key] not in allowed_values:
+            return {'result': 'No', 'reason': f"'{key}' must be one of low, medium or high, got {profile[key]!r}."}
+
+    budget = profile['Budget']
+    if isinstance(budget, str):
+        budget = budget.replace(',', '').strip()
+        is_number = re.fullmatch(r'\d+(\.\d+)?', budget) is not None
+    else:
+        is_number = isinstance(budget, (int, float)) and not isinstance(budget, bool) and math.isfinite(budget)
+    if not is_number:
+        return {'result': 'No', 'reason': f"'Budget' must be a finite number, got {profile['Budget']!r}."}
+
+    return {'result': 'Yes'}
+
+
+# Find a python / JSON dictionary holding profile keys inside free text
+def extract_user_profile(text):
+    for match in re.finditer(r'\{[^{}]*\}', text):
+        candidate = match.group(0)
+        for parse in (json.loads, ast.literal_eval):
+            try:
+                profile = parse(candidate)
+            except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError):
+                # literal_eval raises TypeError for e.g. unhashable keys ({[1]: 2}) and the others on deep nesting
+                continue
+            if isinstance(profile, dict) and any(key in profile for key in PROFILE_KEYS):
+                return profile
+    return None
+
+
+# Local part of intent confirmation: the verdict, or None if the response needs the LLM evaluator
+def _intent_local_check(response_assistant):
+
+    # Structured responses (the model called get_user_info) are validated locally
+    if isinstance(response_assistant, dict):
+        return validate_user_profile(response_assistant)
+
+    # So are free-text responses that embed the profile dictionary
+    profile = extract_user_profile(response_assistant)
+    if profile is not None:
+        return validate_user_profile(profile)
+
+    # A response that does not even mention every key cannot hold a complete profile
+    missing = [key for key in PROFILE_KEYS if key.lower() not in response_assistant.lower()]
+    if missing:
+        return {'result': 'No', 'reason': f"Missing keys: {', '.join(missing)}."}
+
+    return None
+
+
+# Chat completion request of the LLM evaluator of intent confirmation
+def _intent_request(response_assistant):
     delimiter = "####"
 
     allowed_values = {'low','medium','high'}
@@ -310,20 +616,59 @@ def intent_confirmation_layer(response_assistant):
     messages=[{"role": "system", "content":prompt },
               {"role": "user", "content":f"""Here is the input: {response_assistant}""" }]
 
-    response = openai.chat.completions.create(
-                                    model=MODEL,
-                                    messages = messages,
-                                    seed = 1234
-                                    # n = 5
-                                    )
+    return {"model": MODEL, "messages": messages, "seed": 1234}
+
 
-    print("\n\nin the intent confirmation \n\n")
-    print(response)
-    json_output = json.loads(response.choices[0].message.content)
+# Parse the evaluator's JSON verdict
+def _intent_output(response):
+    json_output = json.loads(response["content"])
 
     return json_output
 
 
+# Function to confirm if user intent is fully captured
+def intent_confirmation_layer(response_assistant, use_cache = True):
+    verdict = _intent_local_check(response_assistant)
+    if verdict is not None:
+        return verdict
+
+    # Otherwise the profile may be described in prose, so ask the LLM evaluator
+    return _cached_completion(_intent_request(response_assistant), _intent_output, use_cache, operation = "intent")
+
+
+# Async variant of intent_confirmation_layer
+async def aintent_confirmation_layer(response_assistant, use_cache = True):
+    verdict = _intent_local_check(response_assistant)
+    if verdict is not None:
+        return verdict
+
+    return await _acached_completion(_intent_request(response_assistant), _intent_output, use_cache,
+                                     operation = "intent")
+
+
+# The validated profile dictionary held by an assistant response, or None if it has to be read by the LLM
+def structured_profile(response_assistant):
+    """
+    Parameters:
+    response_assistant (dict or str): The assistant's response, e.g. get_user_info's output.
+
+    Returns:
+    dict: The profile with an integer 'Budget', shaped like get_user_info's output, if the
+    response is or embeds a profile that passes validate_user_profile; otherwise None.
+    """
+    profile = response_assistant if isinstance(response_assistant, dict) else extract_user_profile(str(response_assistant))
+    if profile is None or validate_user_profile(profile)['result'] != 'Yes':
+        return None
+    budget = profile['Budget']
+    if isinstance(budget, str):
+        budget = float(budget.replace(',', '').strip())
+    # Budgets beyond the catalogue's int64 prices (e.g. "1e400" digits) are left to the LLM path
+    budget = parse_budget(budget)
+    if budget is None:
+        return None
+    return dict(profile, Budget = budget)
+
+
 # Function to compare laptops based on user input and recommend top 3
 def compare_laptops_with_user(user_req_string):
 
@@ -337,53 +682,120 @@ def compare_laptops_with_user(user_req_string):
     str: A JSON string containing the top 3 recommended laptops.
     """
  
-    laptop_df = pd.read_csv(LAPTOP_DATA)
-
-    budget = user_req_string.get('Budget', '0')
-  
-    # # Creating a copy of the DataFrame and filtering laptops based on the budget
-    filtered_laptops = laptop_df.copy()
-    filtered_laptops['Price'] = filtered_laptops['Price'].str.replace(',', '').astype(int)
-    filtered_laptops = filtered_laptops[filtered_laptops['Price'] <= budget].copy()
-    # filtered_laptops
-    # # # Mapping string values 'low', 'medium', 'high' to numerical scores 0, 1, 2
-    mappings = {'low': 0, 'medium': 1, 'high': 2}
-
-    # # # Creating a new column 'Score' in the filtered DataFrame and initializing it to 0
-    filtered_laptops['Score'] = 0
-
-
-    # # # Iterating over each laptop in the filtered DataFrame to calculate scores based on user requirements
-    for index, row in filtered_laptops.iterrows():
-        user_product_match_str = row['laptop_feature']
-        laptop_values = user_product_match_str
-        user_product_match_str = user_product_match_str.replace("'", '"')
-        laptop_values = json.loads(user_product_match_str)
-        # print("laptop_values - 2")
-        # print(laptop_values)
-        score = 0
-
-        ## Comparing user requirements with laptop features and updating scores
-        for key, user_value in user_req_string.items():
-            if key == 'Budget':
-                continue  # Skipping budget comparison
-            laptop_value = laptop_values.get(key, None)
-            # print(key, laptop_value)
-            laptop_mapping = mappings.get(laptop_value, -1)
-            user_mapping = mappings.get(user_value, -1)
-            # print(laptop_mapping,user_mapping)
-            if laptop_mapping >= user_mapping:
-                score += 1  # Incrementing score if laptop value meets or exceeds user value
-
-        filtered_laptops.loc[index, 'Score'] = score  # Updating the 'Score' column in the DataFrame
-
-    # Sorting laptops by score in descending order and selecting the top 3 products
-    top_laptops = filtered_laptops.drop('laptop_feature', axis=1)
-    top_laptops = top_laptops.sort_values('Score', ascending=False).head(3)
-    top_laptops_json = top_laptops.to_json(orient='records')  # Converting the top laptops DataFrame to JSON format
-
-    # top_laptops
-    return top_laptops_json
+    if CATALOG_MODE == 'stream':
+        # Catalogues too large for memory are scored chunk by chunk on every call
+        return stream_top_k_json(user_req_string, LAPTOP_DATA, k=3)
+
+    # Score every laptop in one vectorised pass over the cached catalogue index
+    return get_catalog(LAPTOP_DATA).top_k_json(user_req_string, k=3)
+
+
+# Laptop fields in batch recommendations, and profiles scored per vectorised pass
+BATCH_FIELDS = ('Brand', 'Model Name', 'Price')
+BATCH_CHUNK_SIZE = 65536
+
+
+# Score profiles chunk by chunk; yields (ids, rows, scores, errors) per chunk, errors mapping position -> message
+def _batch_chunks(items, k, chunk_size):
+    position = 0
+    chunk = []
+    items = iter(items)
+    while True:
+        chunk.clear()
+        for item in items:
+            chunk.append(item)
+            if len(chunk) == chunk_size:
+                break
+        if not chunk:
+            return
+
+        ids = []
+        profiles = []
+        errors = {}
+        for offset, profile in enumerate(chunk):
+            profile_id = position + offset
+            if isinstance(profile, dict) and 'id' in profile:
+                # The id is passed through, also on error lines, and must not count as a requirement when scoring
+                profile = dict(profile)
+                profile_id = profile.pop('id')
+            if isinstance(profile, Exception):
+                errors[offset] = str(profile)
+                profile = {}
+            elif not isinstance(profile, dict):
+                errors[offset] = "Profile must be a JSON object."
+                profile = {}
+            elif parse_budget(profile.get('Budget', 0)) is None:
+                errors[offset] = f"'Budget' must be a finite number within the 64-bit integer range, got {profile['Budget']!r}."
+                profile = {}
+            ids.append(profile_id)
+            profiles.append(profile)
+
+        rows, scores = get_catalog(LAPTOP_DATA).top_k_batch(profiles, k)
+        yield ids, rows, scores, errors
+        position += len(chunk)
+
+
+def recommend_batch(profiles, k = 3, fields = BATCH_FIELDS, chunk_size = BATCH_CHUNK_SIZE):
+    """
+    Recommends the top k laptops for each of a stream of user profiles, without the LLM.
+
+    Profiles are scored chunk_size at a time; complete profiles are answered with one
+    vectorised lookup in the recommendation table per chunk.
+
+    Parameters:
+    profiles (iterable): Dictionaries shaped like get_user_info's output, optionally with an 'id'.
+    k (int): Number of laptops per profile.
+    fields (tuple): Catalogue columns included for each laptop.
+    chunk_size (int): Profiles per vectorised pass.
+
+    Yields:
+    dict: {'id': ..., 'laptops': [{<fields>, 'Score': n}, ...]} per profile in input order, or
+    {'id': ..., 'error': ...} for a profile that cannot be scored. The id defaults to the
+    profile's position in the stream.
+    """
+    fields = tuple(fields)
+    catalog = get_catalog(LAPTOP_DATA)
+    for ids, rows, scores, errors in _batch_chunks(profiles, k, chunk_size):
+        for i, profile_id in enumerate(ids):
+            if i in errors:
+                yield {'id': profile_id, 'error': errors[i]}
+                continue
+            yield {'id': profile_id,
+                   'laptops': [dict(catalog.record_fields(int(row), fields), Score=int(score))
+                               for row, score in zip(rows[i], scores[i]) if row >= 0]}
+
+
+# Parse JSON Lines into profiles, turning malformed lines into errors reported in their place
+def _parse_jsonl(lines):
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            yield ValueError(f"Invalid JSON: {e}")
+
+
+def recommend_batch_jsonl(lines, k = 3, fields = BATCH_FIELDS, chunk_size = BATCH_CHUNK_SIZE):
+    """
+    JSON Lines form of recommend_batch: reads one profile per line and yields the results as
+    blocks of JSON Lines, one block per chunk, in input order. Blank lines are skipped.
+    """
+    fields = tuple(fields)
+    catalog = get_catalog(LAPTOP_DATA)
+    for ids, rows, scores, errors in _batch_chunks(_parse_jsonl(lines), k, chunk_size):
+        out = []
+        for i, profile_id in enumerate(ids):
+            profile_id = str(profile_id) if type(profile_id) is int else json.dumps(profile_id)
+            if i in errors:
+                out.append(f'{{"id": {profile_id}, "error": {json.dumps(errors[i])}}}\n')
+                continue
+            laptops = ', '.join(f'{catalog.record_prefix(row, fields)}, "Score": {score}}}'
+                                for row, score in zip(rows[i].tolist(), scores[i].tolist()) if row >= 0)
+            out.append(f'{{"id": {profile_id}, "laptops": [{laptops}]}}\n')
+        yield ''.join(out)
 
 
 # Validate if recommended laptops match user preferences
@@ -417,8 +829,86 @@ def initialize_conv_reco(products):
     return conversation
 
 
-# Map given laptop descriptions to feature classification, and update the dataframe
-def product_map_layer(laptop_description):
+# Fields that identify a laptop in follow-up requests, instead of its full record
+FOLLOWUP_FIELDS = ('Brand', 'Model Name', 'Price', 'Special Features')
+
+# Laptops whose excerpts are sent with a follow-up question
+FOLLOWUP_HITS = int(os.environ.get('SHOPASSIST_FOLLOWUP_HITS', '3'))
+
+
+# The identifying fields of a laptop and the sentences of its description that match the question
+def _laptop_excerpt(record, question):
+    excerpt = {field: record.get(field) for field in FOLLOWUP_FIELDS}
+    sentences = matching_sentences(record.get('Description'), question)
+    if sentences:
+        excerpt['Description'] = ' '.join(sentences)
+    return excerpt
+
+
+def followup_context(question, products, k = FOLLOWUP_HITS):
+    """
+    Retrieves the catalogue excerpts relevant to a follow-up question with the BM25 search index.
+
+    Parameters:
+    question (str): The user's follow-up question.
+    products (list): The recommended laptops (records as returned by compare_laptops_with_user).
+    k (int): Maximum number of laptops to return.
+
+    Returns:
+    tuple: (scope, excerpts) - scope is 'recommended' if the question matches the recommended
+    laptops, 'catalogue' if it only matches other laptops of the catalogue, otherwise 'none';
+    excerpts lists the matching laptops' identifying fields and matching description sentences.
+    """
+    hits = SearchIndex.from_records(products).search(question, k)
+    if hits:
+        return 'recommended', [_laptop_excerpt(products[row], question) for row, score in hits]
+
+    # Catalogue-wide questions ("do you have any laptop with a fingerprint sensor?") search every laptop;
+    # a streamed catalogue is not held in memory, so only the recommended laptops are searched then.
+    # The catalogue index comes with the compiled artifact; without one it is built in the background
+    # and catalogue-wide search is skipped until it is ready
+    if CATALOG_MODE != 'stream':
+        catalog = get_catalog(LAPTOP_DATA)
+        index = get_search_index(catalog)
+        rows = [row for row, score in index.search(question, k)] if index is not None else []
+        if rows:
+            return 'catalogue', [_laptop_excerpt(record, question) for record in catalog.records(rows, [0] * len(rows))]
+
+    return 'none', []
+
+
+def followup_messages(conversation_reco, products):
+    """
+    Builds the request for a follow-up question in the recommendation conversation.
+
+    The full product records in the conversation are replaced by their identifying fields, and
+    only the excerpts retrieved for the question (see followup_context) are added before it.
+
+    Parameters:
+    conversation_reco (list): The recommendation conversation, ending with the user's question.
+    products (list): The recommended laptops.
+
+    Returns:
+    list: The messages to send.
+    """
+    summary = [{field: product.get(field) for field in FOLLOWUP_FIELDS} for product in products]
+    question = conversation_reco[-1]["content"]
+    scope, excerpts = followup_context(question, products)
+
+    if scope == 'recommended':
+        note = f"Catalogue details of the user's products that are relevant to the next question: {excerpts}"
+    elif scope == 'catalogue':
+        note = f"None of the user's products mention this. These other laptops from the catalogue do: {excerpts}"
+    else:
+        note = "No laptop description in the catalogue matches the next question; answer from the user's products."
+
+    return ([conversation_reco[0], {"role": "user", "content": f""" These are the user's products: {summary}"""}]
+            + conversation_reco[2:-1]
+            + [{"role": "system", "content": note}, conversation_reco[-1]])
+
+
+# Messages asking the LLM to classify one laptop description
+def _product_map_messages(laptop_description):
     delimiter = "#####"
 
     lap_spec = {
@@ -476,17 +966,95 @@ def product_map_layer(laptop_description):
 
     messages=[{"role": "system", "content":prompt },{"role": "user","content":input}]
 
-    response = get_chat_completions(messages)
+    return messages
+
+
+# Map given laptop descriptions to feature classification, and update the dataframe
+def product_map_layer(laptop_description):
+    response = get_chat_completions(_product_map_messages(laptop_description))
 
     return response
 
 
+# Async variant of product_map_layer
+async def aproduct_map_layer(laptop_description):
+    return await aget_chat_completions(_product_map_messages(laptop_description))
+
+
 # Function to generate an updated laptop CSV with extracted features
-def gen_updated_latop_data():
+def gen_updated_latop_data(on_progress = None, max_workers = ENRICHMENT_WORKERS, rpm = ENRICHMENT_RPM, checkpoint_path = ENRICHMENT_DB,
+                           engine = ENRICHMENT_ENGINE):
+    """
+    Parameters:
+    on_progress (callable): Called with completed/total counts and throughput as rows finish, and
+        once more with phase 'writing' before the CSV is written. It may raise to stop the run.
+    max_workers (int): Maximum number of product_map_layer calls in flight.
+    rpm (float): Maximum number of product_map_layer calls started per minute.
+    checkpoint_path (str): SQLite file of per-description results. Only descriptions that are not
+        in it yet are sent to product_map_layer, so re-runs and resumed runs are incremental.
+    engine (str): 'rules' classifies from the structured columns with product_rules and only sends
+        rows the rules cannot resolve to product_map_layer; 'llm' sends every row.
+
+    Returns:
+    dict: How many rows the rules resolved and how many fell back to the LLM.
+    """
     ##Run this code once to extract product info in the form of a dictionary
     laptop_df= pd.read_csv(LAPTOP_DATA_ORIGINAL)
 
+    # Classify locally first; rows with any unresolved feature fall back to the LLM
+    if engine == 'rules':
+        rule_features = classify_catalog(laptop_df)
+    elif engine == 'llm':
+        rule_features = pd.DataFrame(index = laptop_df.index, columns = FEATURE_KEYS, dtype = object)
+    else:
+        raise ValueError(f"Unknown enrichment engine: {engine}")
+    stats = classification_stats(rule_features)
+    logger.debug("Rule-based classification: %s", stats)
+    fallback = rule_features.isna().any(axis = 1).to_numpy()
+
+    # Report progress over the whole catalogue, counting rule-resolved rows as done
+    def report(progress):
+        if on_progress is not None:
+            on_progress(dict(progress, completed = progress['completed'] + stats['resolved'], total = len(laptop_df),
+                             rules_resolved = stats['resolved']))
+
+    # The fallback rows are classified as coroutines on one event loop sharing a pooled client
+    async def classify_fallback():
+        try:
+            return await aenrich_descriptions(laptop_df.loc[fallback, 'Description'], aproduct_map_layer,
+                                              max_concurrency = max_workers, rpm = rpm, on_progress = report,
+                                              checkpoint = checkpoint)
+        finally:
+            await close_async_client()
+
+    checkpoint = EnrichmentCheckpoint(checkpoint_path)
+    try:
+        # Live chat turns are admitted ahead of the enrichment's requests
+        with scheduler.priority(scheduler.BACKGROUND):
+            llm_features = asyncio.run(classify_fallback())
+    finally:
+        checkpoint.close()
+
     ## Create a new column "laptop_feature" that contains the dictionary of the product features
-    laptop_df['laptop_feature'] = laptop_df['Description'].apply(lambda x: product_map_layer(x))
+    laptop_features = []
+    llm_results = iter(llm_features)
+    for row, features in zip(fallback, rule_features.to_dict('records')):
+        if row:
+            # Keep the levels the rules did resolve and take the rest from the LLM
+            llm_values = parse_features(str(next(llm_results)))
+            features = {key: value if isinstance(value, str) else llm_values.get(key) for key, value in features.items()}
+        laptop_features.append(str(features))
+    laptop_df['laptop_feature'] = laptop_features
+
+    # Last chance for the caller to stop the run (e.g. a cancelled job) before the catalogue files are replaced
+    if on_progress is not None:
+        on_progress({'completed': len(laptop_df), 'total': len(laptop_df), 'rules_resolved': stats['resolved'],
+                     'phase': 'writing'})
 
     laptop_df.to_csv(LAPTOP_DATA,index=False,header = True)
+
+    # Compile the memory-mapped catalogue artifact (typed columns and recommendation table) and load it
+    compile_catalog(LAPTOP_DATA)
+    reload_catalog(LAPTOP_DATA)
+
+    return stats
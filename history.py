@@ -0,0 +1,131 @@
+import math
+import os
+
+from functions import MODEL, extract_user_profile
+
+try:
+    import tiktoken
+except ImportError:  # Fall back to a character-based estimate
+    tiktoken = None
+
+# Token budget of the messages sent with each request, overridable from the environment.
+# The system message, the latest profile and the newest message are always sent, even over budget.
+HISTORY_TOKEN_BUDGET = int(os.environ.get('SHOPASSIST_HISTORY_TOKEN_BUDGET', '3000'))
+
+# Tokens spent on the condensed summary of turns that no longer fit the budget
+HISTORY_SUMMARY_TOKENS = int(os.environ.get('SHOPASSIST_HISTORY_SUMMARY_TOKENS', '200'))
+
+# Tokens the chat format adds around every message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Average characters per token of English text, used when tiktoken is not installed
+CHARS_PER_TOKEN = 4
+
+_encoding = None
+
+
+# Tokenizer of the chat model, loaded on first use
+def _get_encoding():
+    global _encoding
+    if _encoding is None:
+        try:
+            _encoding = tiktoken.encoding_for_model(MODEL)
+        except KeyError:
+            _encoding = tiktoken.get_encoding('cl100k_base')
+    return _encoding
+
+
+# Number of tokens in a text, counted locally
+def count_tokens(text):
+    text = str(text or '')
+    if tiktoken is not None:
+        return len(_get_encoding().encode(text))
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+# Tokens a message costs in a request
+def message_tokens(message):
+    return MESSAGE_OVERHEAD_TOKENS + count_tokens(message.get('content'))
+
+
+# Cut a text down to roughly max_tokens, marking the cut
+def _truncate(text, max_tokens):
+    if count_tokens(text) <= max_tokens:
+        return text
+    if tiktoken is not None:
+        return _get_encoding().decode(_get_encoding().encode(text)[:max_tokens]) + '...'
+    return text[:max_tokens * CHARS_PER_TOKEN] + '...'
+
+
+# Condense dropped turns into one system note built from what the user said in them
+def _summarize(dropped, max_tokens):
+    lines = []
+    remaining = max_tokens
+    # Prefer the most recent statements when the summary budget runs out
+    for message in reversed(dropped):
+        if message['role'] != 'user' or remaining <= 0:
+            continue
+        line = _truncate(' '.join(str(message['content']).split()), remaining)
+        lines.append(f'- "{line}"')
+        remaining -= count_tokens(line) + 2
+    if not lines:
+        return None
+    return {'role': 'system',
+            'content': 'Earlier turns of this conversation were condensed. The user said:\n' + '\n'.join(reversed(lines))}
+
+
+def compact_history(conversation, budget = HISTORY_TOKEN_BUDGET, reminder = None, summary_tokens = HISTORY_SUMMARY_TOKENS):
+    """
+    Selects the messages to send for the next request so they fit within a token budget.
+
+    Parameters:
+    conversation (list): The full conversation, starting with the system message. It is not modified.
+    budget (int): Token budget of the returned messages.
+    reminder (str): Text appended to the newest message if it is from the user (e.g. ROLE_REMINDER),
+        so it is sent once per request instead of being stored with every user message.
+    summary_tokens (int): Token budget of the summary that replaces dropped turns.
+
+    Returns:
+    list: The system message, a summary of dropped turns (if any were dropped), the latest message
+    holding a user profile and as many of the most recent messages as the budget allows.
+    """
+    if not conversation:
+        return []
+
+    head = [conversation[0]] if conversation[0]['role'] == 'system' else []
+    rest = conversation[len(head):]
+    if not rest:
+        return list(head)
+
+    latest = dict(rest[-1])
+    if reminder and latest['role'] == 'user':
+        latest['content'] = str(latest['content']) + reminder
+
+    # The most recent message holding (part of) the user's profile is always kept
+    profile_index = None
+    for index in range(len(rest) - 2, -1, -1):
+        if extract_user_profile(str(rest[index]['content'])) is not None:
+            profile_index = index
+            break
+
+    used = sum(message_tokens(m) for m in head) + message_tokens(latest)
+    if profile_index is not None:
+        used += message_tokens(rest[profile_index])
+
+    # Walk back from the newest message, keeping turns while they fit
+    start = len(rest) - 1
+    while start > 0:
+        index = start - 1
+        cost = 0 if index == profile_index else message_tokens(rest[index])
+        if used + cost > budget - (summary_tokens if index > 0 else 0):
+            break
+        used += cost
+        start = index
+
+    kept = rest[start:-1] + [latest]
+    dropped = [m for i, m in enumerate(rest[:start]) if i != profile_index]
+    if profile_index is not None and profile_index < start:
+        kept.insert(0, rest[profile_index])
+
+    summary = _summarize(dropped, summary_tokens) if dropped else None
+    return head + ([summary] if summary is not None else []) + kept
@@ -0,0 +1,311 @@
+import json
+import logging
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Local SQLite file of background jobs, shared by every worker process on the host
+JOBS_DB = os.environ.get('SHOPASSIST_JOBS_DB', 'jobs.db')
+# Seconds between liveness updates of a running job, and after which a silent job counts as lost
+JOB_HEARTBEAT_SECONDS = float(os.environ.get('SHOPASSIST_JOB_HEARTBEAT_SECONDS', '5'))
+JOB_HEARTBEAT_TIMEOUT = float(os.environ.get('SHOPASSIST_JOB_HEARTBEAT_TIMEOUT', '60'))
+# Minimum seconds between progress writes (and cancellation checks) of a running job
+JOB_PROGRESS_INTERVAL = float(os.environ.get('SHOPASSIST_JOB_PROGRESS_INTERVAL', '0.5'))
+# Share of the LLM request and token budgets (SHOPASSIST_LLM_RPM / SHOPASSIST_LLM_TPM) a job's worker
+# process may use. Its scheduler cannot see the chat turns' queue, so the rest is left to them
+JOB_LLM_SHARE = float(os.environ.get('SHOPASSIST_JOB_LLM_SHARE', '0.25'))
+
+QUEUED = 'queued'
+RUNNING = 'running'
+COMPLETED = 'completed'
+CANCELLED = 'cancelled'
+FAILED = 'failed'
+ACTIVE_STATES = (QUEUED, RUNNING)
+JOB_STATES = (QUEUED, RUNNING, COMPLETED, CANCELLED, FAILED)
+
+LOST_WORKER_ERROR = "Worker process stopped responding (exited or the host restarted)"
+
+
+class JobCancelled(Exception):
+    """
+    Raised inside a job's worker process once cancellation has been requested.
+    """
+
+
+class JobLost(Exception):
+    """
+    Raised inside a job's worker process once its job is no longer running, e.g. because it was
+    marked failed after missing heartbeats; the worker stops so it never races a newer job.
+    """
+
+
+class JobStore:
+    """
+    Background jobs in a local SQLite file.
+
+    A job is queued when it is created, running once its worker process has claimed it, and ends
+    completed, cancelled or failed. At most one job per kind is active at a time. Running jobs
+    record their progress and a heartbeat; an active job whose heartbeat stops (its worker was
+    killed or the host restarted) is marked failed the next time jobs are read.
+    """
+
+    def __init__(self, path=JOBS_DB):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                                id TEXT PRIMARY KEY,
+                                kind TEXT NOT NULL,
+                                state TEXT NOT NULL,
+                                created_at REAL NOT NULL,
+                                started_at REAL,
+                                finished_at REAL,
+                                heartbeat REAL NOT NULL,
+                                pid INTEGER,
+                                progress TEXT,
+                                result TEXT,
+                                error TEXT,
+                                cancel_requested INTEGER NOT NULL DEFAULT 0)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_created_at ON jobs (created_at)")
+            # Enforces one active job per kind across processes
+            conn.execute("""CREATE UNIQUE INDEX IF NOT EXISTS jobs_one_active ON jobs (kind)
+                                WHERE state IN ('queued', 'running')""")
+
+    # One connection per thread; WAL lets readers and a writer proceed concurrently
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # Fail active jobs whose worker has stopped sending heartbeats
+    def _expire_lost(self, conn, now):
+        conn.execute("""UPDATE jobs SET state = ?, error = ?, finished_at = ?
+                        WHERE state IN (?, ?) AND heartbeat < ?""",
+                     (FAILED, LOST_WORKER_ERROR, now, QUEUED, RUNNING, now - JOB_HEARTBEAT_TIMEOUT))
+
+    def create(self, kind):
+        """
+        Queues a job of this kind, unless one is already queued or running.
+
+        Returns:
+        tuple: (job, created), where job is the new job or the active one and created is False
+            if the job already existed.
+        """
+        now = time.time()
+        job_id = uuid.uuid4().hex
+        with self._connect() as conn:
+            self._expire_lost(conn, now)
+            try:
+                conn.execute("INSERT INTO jobs (id, kind, state, created_at, heartbeat) VALUES (?, ?, ?, ?, ?)",
+                             (job_id, kind, QUEUED, now, now))
+                created = True
+            except sqlite3.IntegrityError:
+                row = conn.execute("SELECT id FROM jobs WHERE kind = ? AND state IN (?, ?)",
+                                   (kind, QUEUED, RUNNING)).fetchone()
+                job_id, created = row['id'], False
+        return self.get(job_id), created
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            self._expire_lost(conn, time.time())
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return _job_dict(row) if row is not None else None
+
+    def latest(self, kind):
+        with self._connect() as conn:
+            self._expire_lost(conn, time.time())
+            row = conn.execute("SELECT * FROM jobs WHERE kind = ? ORDER BY created_at DESC LIMIT 1",
+                               (kind,)).fetchone()
+        return _job_dict(row) if row is not None else None
+
+    def list(self, limit=20):
+        with self._connect() as conn:
+            self._expire_lost(conn, time.time())
+            rows = conn.execute("SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+        return [_job_dict(row) for row in rows]
+
+    def cancel(self, job_id):
+        """
+        Cancels a queued job at once; a running job is asked to stop and is cancelled by its
+        worker at its next progress update. Returns the job, or None if it does not exist.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET state = ?, finished_at = ? WHERE id = ? AND state = ?",
+                         (CANCELLED, now, job_id, QUEUED))
+            conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND state = ?", (job_id, RUNNING))
+        return self.get(job_id)
+
+    # Worker side: take a queued job; False if it was cancelled or expired before the worker started
+    def claim(self, job_id, pid):
+        now = time.time()
+        with self._connect() as conn:
+            claimed = conn.execute("""UPDATE jobs SET state = ?, pid = ?, started_at = ?, heartbeat = ?
+                                      WHERE id = ? AND state = ?""",
+                                   (RUNNING, pid, now, now, job_id, QUEUED)).rowcount
+        return claimed == 1
+
+    # Worker side: record a heartbeat (and progress, if given) of a running job.
+    # Returns (state, cancel_requested); a state other than running means the worker must stop
+    def beat(self, job_id, progress=None):
+        with self._connect() as conn:
+            if progress is None:
+                conn.execute("UPDATE jobs SET heartbeat = ? WHERE id = ? AND state = ?", (time.time(), job_id, RUNNING))
+            else:
+                conn.execute("UPDATE jobs SET heartbeat = ?, progress = ? WHERE id = ? AND state = ?",
+                             (time.time(), json.dumps(progress), job_id, RUNNING))
+            row = conn.execute("SELECT state, cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None, False
+        return row['state'], bool(row['cancel_requested'])
+
+    # Worker side: record how the job ended
+    def finish(self, job_id, state, result=None, error=None):
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET state = ?, finished_at = ?, result = ?, error = ? WHERE id = ? AND state = ?",
+                         (state, time.time(), json.dumps(result) if result is not None else None, error,
+                          job_id, RUNNING))
+
+
+# Row of the jobs table as a JSON-serialisable dictionary, with the estimated seconds left of a running job
+def _job_dict(row):
+    job = dict(row)
+    job['cancel_requested'] = bool(job['cancel_requested'])
+    job['progress'] = json.loads(job['progress']) if job['progress'] else None
+    job['result'] = json.loads(job['result']) if job['result'] else None
+    job['eta_seconds'] = None
+    progress = job['progress']
+    if job['state'] == RUNNING and progress and progress.get('rows_per_second'):
+        job['eta_seconds'] = round((progress['total'] - progress['completed']) / progress['rows_per_second'], 1)
+    return job
+
+
+# Regenerate updated_laptop.csv and its artifact; imported here so that only the worker process loads the app code
+def _generate_catalog(on_progress):
+    from functions import gen_updated_latop_data
+    return gen_updated_latop_data(on_progress=on_progress)
+
+
+# Job kinds and the function each runs; it is called with an on_progress callback and returns a JSON-serialisable result
+JOB_KINDS = {'catalog_generation': _generate_catalog}
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+# The job store of this process, created on first use
+def get_job_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = JobStore()
+    return _store
+
+
+def start_job(kind):
+    """
+    Queues a job and starts a worker process to run it. Jobs run in their own process, so they
+    never compete with request threads for the GIL, and keep running across page reloads.
+
+    Parameters:
+    kind (str): One of JOB_KINDS.
+
+    Returns:
+    tuple: (job, created); if a job of this kind is already active it is returned instead.
+    """
+    if kind not in JOB_KINDS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    # Reap worker processes of finished jobs
+    multiprocessing.active_children()
+
+    job, created = get_job_store().create(kind)
+    if created:
+        import openai
+        # 'spawn' starts a fresh interpreter rather than forking a process that holds threads and sockets
+        worker = multiprocessing.get_context('spawn').Process(
+            target=_run_job, args=(job['id'], kind, get_job_store().path, openai.api_key),
+            name=f"shopassist-job-{job['id'][:8]}")
+        worker.start()
+        logger.info("Job %s (%s) started in worker process %s", job['id'], kind, worker.pid)
+    return job, created
+
+
+# Entry point of a job's worker process
+def _run_job(job_id, kind, path, api_key):
+    # A spawned interpreter does not import app.py, so configure logging the same way here
+    logging.basicConfig(level=os.environ.get("SHOPASSIST_LOG_LEVEL", "WARNING").upper())
+    store = JobStore(path)
+    if not store.claim(job_id, os.getpid()):
+        return
+
+    # Heartbeats from a separate thread, so long steps without progress don't look like a lost worker
+    stopped = threading.Event()
+    lost = threading.Event()
+
+    def heartbeat():
+        while not stopped.wait(JOB_HEARTBEAT_SECONDS):
+            try:
+                state, _ = store.beat(job_id)
+            except sqlite3.Error as e:
+                # e.g. the database stayed locked; try again at the next beat rather than going silent
+                logger.warning("Job %s heartbeat failed: %s", job_id, e)
+                continue
+            if state != RUNNING:
+                lost.set()
+                return
+
+    threading.Thread(target=heartbeat, daemon=True).start()
+
+    last_write = [0.0]
+
+    # Write progress at most every JOB_PROGRESS_INTERVAL seconds, and stop the job if it was cancelled or
+    # is no longer running. The last update before the catalogue files are written is never skipped
+    def on_progress(progress):
+        if lost.is_set():
+            raise JobLost(job_id)
+        now = time.monotonic()
+        final = progress.get('phase') == 'writing' or progress.get('completed') == progress.get('total')
+        if now - last_write[0] < JOB_PROGRESS_INTERVAL and not final:
+            return
+        last_write[0] = now
+        from scheduler import get_scheduler
+        state, cancel_requested = store.beat(job_id, dict(progress, scheduler=get_scheduler().stats()))
+        if state != RUNNING:
+            lost.set()
+            raise JobLost(job_id)
+        if cancel_requested:
+            raise JobCancelled(job_id)
+
+    try:
+        if api_key:
+            import openai
+            openai.api_key = api_key
+        import scheduler
+        scheduler.set_scheduler(scheduler.Scheduler(rpm=scheduler.LLM_RPM * JOB_LLM_SHARE,
+                                                    tpm=scheduler.LLM_TPM * JOB_LLM_SHARE))
+        result = JOB_KINDS[kind](on_progress)
+    except JobCancelled:
+        store.finish(job_id, CANCELLED)
+        logger.info("Job %s cancelled", job_id)
+    except JobLost:
+        logger.warning("Job %s is no longer running; stopped before writing the catalogue", job_id)
+    except Exception as e:
+        store.finish(job_id, FAILED, error=f"{type(e).__name__}: {e}")
+        logger.exception("Job %s failed", job_id)
+    else:
+        store.finish(job_id, COMPLETED, result=result)
+        logger.info("Job %s completed: %s", job_id, result)
+    finally:
+        stopped.set()
@@ -0,0 +1,321 @@
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+
+from catalog import FEATURE_KEYS
+from llm_client import get_client, get_async_client, LLM_TIMEOUT, MODERATION_TIMEOUT
+from metrics import record_tokens
+
+# Which backend answers LLM calls: 'openai' or 'simulated', overridable from the environment
+LLM_BACKEND = os.environ.get('SHOPASSIST_LLM_BACKEND', 'openai')
+
+# Simulated backend settings: latencies are in milliseconds, jitter is one of 'none', 'uniform', 'normal', 'lognormal'
+SIM_SEED = int(os.environ.get('SHOPASSIST_SIM_SEED', '0'))
+SIM_LATENCY_MS = float(os.environ.get('SHOPASSIST_SIM_LATENCY_MS', '800'))
+SIM_JITTER = os.environ.get('SHOPASSIST_SIM_JITTER', 'lognormal')
+SIM_JITTER_MS = float(os.environ.get('SHOPASSIST_SIM_JITTER_MS', '200'))
+SIM_TOKEN_MS = float(os.environ.get('SHOPASSIST_SIM_TOKEN_MS', '15'))
+SIM_MODERATION_MS = float(os.environ.get('SHOPASSIST_SIM_MODERATION_MS', '150'))
+# User turns after which the simulated assistant calls get_user_info
+SIM_PROFILE_TURNS = int(os.environ.get('SHOPASSIST_SIM_PROFILE_TURNS', '3'))
+# Texts containing one of these words are flagged by the simulated moderation
+SIM_FLAG_WORDS = [w for w in os.environ.get('SHOPASSIST_SIM_FLAG_WORDS', 'flagme').split(',') if w]
+
+
+class LLMBackend(ABC):
+    """
+    Source of chat completions and moderation verdicts.
+
+    Completions are returned as plain messages {"content": str or None, "function_call":
+    {"name": str, "arguments": str} or None}, the form kept in the response cache. Streams
+    yield deltas of the same shape and are closed with close(). Each backend has a name, which
+    keeps its responses apart from other backends' in the response cache.
+    """
+
+    name = None
+
+    @abstractmethod
+    def complete(self, request):
+        pass
+
+    @abstractmethod
+    async def acomplete(self, request):
+        pass
+
+    @abstractmethod
+    def stream(self, request):
+        pass
+
+    # True if the text is flagged
+    @abstractmethod
+    def moderate(self, text):
+        pass
+
+    @abstractmethod
+    async def amoderate(self, text):
+        pass
+
+
+# Convert an API message into the plain dictionary kept in the response cache
+def _message_to_dict(message):
+    function_call = message.function_call
+    if function_call is not None:
+        function_call = {"name": function_call.name, "arguments": function_call.arguments}
+    return {"content": message.content, "function_call": function_call}
+
+
+# Record the token usage reported by the API, if any
+def _record_usage(usage):
+    if usage is not None:
+        record_tokens(usage.prompt_tokens, usage.completion_tokens)
+
+
+class OpenAIBackend(LLMBackend):
+    """
+    Backend calling the OpenAI API through the shared clients of llm_client.
+    """
+
+    name = 'openai'
+
+    def complete(self, request):
+        chat_completion = get_client().chat.completions.create(timeout=LLM_TIMEOUT, **request)
+        _record_usage(chat_completion.usage)
+        return _message_to_dict(chat_completion.choices[0].message)
+
+    async def acomplete(self, request):
+        chat_completion = await get_async_client().chat.completions.create(timeout=LLM_TIMEOUT, **request)
+        _record_usage(chat_completion.usage)
+        return _message_to_dict(chat_completion.choices[0].message)
+
+    # The request is sent here, so a failure to open the stream surfaces to the caller's retry
+    def stream(self, request):
+        # The final chunk then carries the token usage of the whole stream
+        response = get_client().chat.completions.create(stream=True, stream_options={"include_usage": True},
+                                                        timeout=LLM_TIMEOUT, **request)
+        return self._deltas(response)
+
+    @staticmethod
+    def _deltas(response):
+        try:
+            for chunk in response:
+                if getattr(chunk, 'usage', None) is not None:
+                    _record_usage(chunk.usage)
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                function_call = delta.function_call
+                if function_call is not None:
+                    function_call = {"name": function_call.name, "arguments": function_call.arguments}
+                yield {"content": delta.content, "function_call": function_call}
+        finally:
+            response.close()
+
+    def moderate(self, text):
+        response = get_client().moderations.create(input=text, timeout=MODERATION_TIMEOUT)
+        return response.results[0].flagged
+
+    async def amoderate(self, text):
+        response = await get_async_client().moderations.create(input=text, timeout=MODERATION_TIMEOUT)
+        return response.results[0].flagged
+
+
+# Questions the simulated assistant asks before it has gathered a profile
+SIMULATED_QUESTIONS = [
+    "Could you tell me what you primarily use your laptop for?",
+    "Do you work with graphics-heavy applications such as video editing or gaming?",
+    "Do you often carry your laptop around, or does it mostly stay on a desk?",
+    "Could you kindly let me know your budget for the laptop?",
+]
+
+SIMULATED_LEVELS = ('low', 'medium', 'high')
+
+
+# Budget in INR mentioned in a text such as "1.5 lakh", "80k" or "Rs 90,000"
+def _parse_budget(text):
+    match = re.search(r'(\d[\d,]*(?:\.\d+)?)\s*(k|l|lac|lacs|lakh|lakhs)?\b', text.lower())
+    if match is None:
+        return None
+    amount = float(match.group(1).replace(',', ''))
+    unit = match.group(2)
+    if unit == 'k':
+        amount *= 1000
+    elif unit is not None:
+        amount *= 100000
+    return int(amount)
+
+
+class SimulatedBackend(LLMBackend):
+    """
+    Deterministic local stand-in for the OpenAI API, for load tests and offline development.
+
+    Answers are derived from a hash of the request and the seed, so the same request always
+    gets the same answer. The assistant asks SIMULATED_QUESTIONS until the user has sent
+    profile_turns messages and then calls get_user_info; a conversation ending with the user's
+    profile makes it call compare_laptops_with_user; classification prompts get a levels
+    dictionary, the intent evaluator a JSON verdict and other conversations a fixed summary. Texts containing one of flag_words are
+    flagged by moderation. Every call sleeps for a latency drawn from the configured distribution.
+    """
+
+    name = 'simulated'
+
+    def __init__(self, seed=SIM_SEED, latency_ms=SIM_LATENCY_MS, jitter=SIM_JITTER, jitter_ms=SIM_JITTER_MS,
+                 token_ms=SIM_TOKEN_MS, moderation_ms=SIM_MODERATION_MS, profile_turns=SIM_PROFILE_TURNS,
+                 flag_words=SIM_FLAG_WORDS):
+        self.seed = seed
+        self.latency_ms = latency_ms
+        self.jitter = jitter
+        self.jitter_ms = jitter_ms
+        self.token_ms = token_ms
+        self.moderation_ms = moderation_ms
+        self.profile_turns = profile_turns
+        self.flag_words = [w.lower() for w in flag_words]
+        # Latency draws are random but reproducible for a given seed and call order
+        self._latency_rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    # Random generator seeded by the request, so answers do not depend on call order
+    def _rng(self, payload):
+        digest = hashlib.sha256(json.dumps([self.seed, payload], sort_keys=True, default=str).encode('utf-8')).digest()
+        return random.Random(int.from_bytes(digest[:8], 'big'))
+
+    # Draw one latency in seconds around mean_ms
+    def sample_latency(self, mean_ms):
+        with self._lock:
+            if self.jitter == 'uniform':
+                ms = self._latency_rng.uniform(mean_ms - self.jitter_ms, mean_ms + self.jitter_ms)
+            elif self.jitter == 'normal':
+                ms = self._latency_rng.gauss(mean_ms, self.jitter_ms)
+            elif self.jitter == 'lognormal' and mean_ms > 0:
+                # Long right tail with the requested mean and standard deviation
+                sigma2 = math.log(1 + (self.jitter_ms / mean_ms) ** 2)
+                ms = self._latency_rng.lognormvariate(math.log(mean_ms) - sigma2 / 2, sigma2 ** 0.5)
+            else:
+                ms = mean_ms
+        return max(ms, 0.0) / 1000
+
+    # Record approximate token counts (about four characters per token) like the API would report
+    @staticmethod
+    def _record_usage(request, message):
+        prompt = sum(len(str(m['content'] or '')) for m in request['messages'])
+        completion = len(message['content'] or json.dumps(message['function_call']))
+        record_tokens(math.ceil(prompt / 4), math.ceil(completion / 4))
+
+    def _levels(self, rng):
+        return {key: rng.choice(SIMULATED_LEVELS) for key in FEATURE_KEYS}
+
+    def respond(self, request):
+        """
+        Returns the simulated message for a chat completion request, without sleeping.
+        """
+        message = self._respond(request)
+        self._record_usage(request, message)
+        return message
+
+    def _respond(self, request):
+        messages = request['messages']
+        rng = self._rng(messages)
+        system = str(messages[0]['content']) if messages else ''
+
+        if 'senior evaluator' in system:
+            text = str(messages[-1]['content'])
+            missing = [key for key in FEATURE_KEYS + ['Budget'] if key.lower() not in text.lower()]
+            verdict = {'result': 'No', 'reason': f"Missing keys: {', '.join(missing)}."} if missing else {'result': 'Yes'}
+            return {"content": json.dumps(verdict), "function_call": None}
+
+        if 'Laptop Specifications Classifier' in system:
+            return {"content": json.dumps(self._levels(rng)), "function_call": None}
+
+        # Anything but the profile-gathering dialogue (e.g. the recommendation conversation) gets a summary
+        if not request.get('functions') or 'get_user_info' not in system:
+            return {"content": "Here is a summary of the laptops that match your profile. "
+                               "Let me know if you have any questions about them.", "function_call": None}
+
+        # A conversation holding the confirmed profile asks for the top 3 laptops
+        user_messages = [str(m['content']) for m in messages if m['role'] == 'user']
+        for text in reversed(user_messages):
+            try:
+                profile = json.loads(text)
+            except ValueError:
+                continue
+            if isinstance(profile, dict) and 'Budget' in profile:
+                return {"content": None,
+                        "function_call": {"name": "compare_laptops_with_user", "arguments": json.dumps(profile)}}
+
+        if len(user_messages) < self.profile_turns:
+            return {"content": SIMULATED_QUESTIONS[min(len(user_messages), len(SIMULATED_QUESTIONS) - 1)],
+                    "function_call": None}
+
+        budget = next((b for b in map(_parse_budget, reversed(user_messages)) if b is not None), 100000)
+        profile = dict(self._levels(rng), Budget=budget)
+        return {"content": None, "function_call": {"name": "get_user_info", "arguments": json.dumps(profile)}}
+
+    def complete(self, request):
+        time.sleep(self.sample_latency(self.latency_ms))
+        return self.respond(request)
+
+    async def acomplete(self, request):
+        await asyncio.sleep(self.sample_latency(self.latency_ms))
+        return self.respond(request)
+
+    def stream(self, request):
+        return self._deltas(self.respond(request))
+
+    def _deltas(self, message):
+        time.sleep(self.sample_latency(self.latency_ms))
+        if message["function_call"] is not None:
+            yield {"content": None, "function_call": message["function_call"]}
+            return
+        for token in re.findall(r'\S+\s*', message["content"]):
+            time.sleep(self.token_ms / 1000)
+            yield {"content": token, "function_call": None}
+
+    def _flagged(self, text):
+        text = str(text).lower()
+        return any(word in text for word in self.flag_words)
+
+    def moderate(self, text):
+        time.sleep(self.sample_latency(self.moderation_ms))
+        return self._flagged(text)
+
+    async def amoderate(self, text):
+        await asyncio.sleep(self.sample_latency(self.moderation_ms))
+        return self._flagged(text)
+
+
+def create_backend(name=LLM_BACKEND):
+    """
+    Creates the LLM backend selected by name ('openai' or 'simulated').
+    """
+    if name == 'openai':
+        return OpenAIBackend()
+    if name == 'simulated':
+        return SimulatedBackend()
+    raise ValueError(f"Unknown LLM backend: {name!r}")
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+# The process-wide backend, created on first use from SHOPASSIST_LLM_BACKEND
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = create_backend()
+    return _backend
+
+
+# Replace the process-wide backend, e.g. with a configured SimulatedBackend in a load test
+def set_backend(backend):
+    global _backend
+    with _backend_lock:
+        _backend = backend
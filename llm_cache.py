@@ -0,0 +1,269 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Cache configuration, overridable from the environment
+RESPONSE_CACHE_ENABLED = os.environ.get('SHOPASSIST_RESPONSE_CACHE', '1') == '1'
+# Cached responses hold users' conversations, so they are only written to disk when this is enabled
+RESPONSE_CACHE_DISK = os.environ.get('SHOPASSIST_RESPONSE_CACHE_DISK', '0') == '1'
+RESPONSE_CACHE_DB = os.environ.get('SHOPASSIST_RESPONSE_CACHE_DB', 'llm_cache.db')
+RESPONSE_CACHE_TTL = float(os.environ.get('SHOPASSIST_RESPONSE_CACHE_TTL', '3600'))
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get('SHOPASSIST_RESPONSE_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+RESPONSE_CACHE_MEMORY_ITEMS = int(os.environ.get('SHOPASSIST_RESPONSE_CACHE_MEMORY_ITEMS', '1024'))
+MODERATION_CACHE_ITEMS = int(os.environ.get('SHOPASSIST_MODERATION_CACHE_ITEMS', '10000'))
+
+
+# Content address of a request: a hash of its canonical JSON form
+def make_key(**parts):
+    payload = json.dumps(parts, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class LRUCache:
+    """
+    Thread-safe in-process LRU cache with an optional TTL (seconds) and hit/miss counters.
+    """
+
+    def __init__(self, max_items, ttl=None):
+        self.max_items = max_items
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()  # key -> (stored_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None and self.ttl is not None and time.time() - entry[0] > self.ttl:
+                del self._items[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._items.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._items[key] = (time.time(), value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+    def stats(self):
+        return {'items': len(self), 'hits': self.hits, 'misses': self.misses}
+
+
+class DiskCache:
+    """
+    Persistent JSON value cache in a local SQLite file, shared by threads and worker processes.
+
+    Entries older than ttl seconds are dropped, and the least recently used entries are
+    evicted once the stored values exceed max_bytes. The total size is kept up to date by
+    triggers, so no write has to add up the whole table.
+    """
+
+    def __init__(self, path, ttl, max_bytes):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS cache (
+                                key TEXT PRIMARY KEY,
+                                value TEXT NOT NULL,
+                                size INTEGER NOT NULL,
+                                stored_at REAL NOT NULL,
+                                last_access REAL NOT NULL)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_last_access ON cache (last_access)")
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_stored_at ON cache (stored_at)")
+            conn.execute("CREATE TABLE IF NOT EXISTS cache_size (id INTEGER PRIMARY KEY CHECK (id = 0), total INTEGER NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO cache_size (id, total) SELECT 0, COALESCE(SUM(size), 0) FROM cache")
+            conn.execute("""CREATE TRIGGER IF NOT EXISTS cache_size_insert AFTER INSERT ON cache BEGIN
+                                UPDATE cache_size SET total = total + NEW.size; END""")
+            conn.execute("""CREATE TRIGGER IF NOT EXISTS cache_size_delete AFTER DELETE ON cache BEGIN
+                                UPDATE cache_size SET total = total - OLD.size; END""")
+            conn.execute("""CREATE TRIGGER IF NOT EXISTS cache_size_update AFTER UPDATE OF size ON cache BEGIN
+                                UPDATE cache_size SET total = total + NEW.size - OLD.size; END""")
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key, default=None):
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute("SELECT value, stored_at FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is not None and now - row[1] > self.ttl:
+                conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                row = None
+            if row is not None:
+                conn.execute("UPDATE cache SET last_access = ? WHERE key = ?", (now, key))
+        with self._stats_lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return default if row is None else json.loads(row[0])
+
+    def set(self, key, value):
+        now = time.time()
+        payload = json.dumps(value)
+        with self._connect() as conn:
+            # An upsert rather than INSERT OR REPLACE, whose implicit delete would not fire the size trigger
+            conn.execute("""INSERT INTO cache (key, value, size, stored_at, last_access) VALUES (?, ?, ?, ?, ?)
+                            ON CONFLICT (key) DO UPDATE SET value = excluded.value, size = excluded.size,
+                                stored_at = excluded.stored_at, last_access = excluded.last_access""",
+                         (key, payload, len(payload), now, now))
+            self._evict(conn, now)
+
+    def _evict(self, conn, now):
+        conn.execute("DELETE FROM cache WHERE stored_at < ?", (now - self.ttl,))
+        total = self.size(conn)
+        if total <= self.max_bytes:
+            return
+        # Walk from the least recently used entry and drop until the cache fits again
+        excess = total - self.max_bytes
+        stale = []
+        for key, size in conn.execute("SELECT key, size FROM cache ORDER BY last_access"):
+            stale.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        conn.executemany("DELETE FROM cache WHERE key = ?", stale)
+
+    # Total size of the stored values in bytes
+    def size(self, conn=None):
+        return (conn or self._connect()).execute("SELECT total FROM cache_size").fetchone()[0]
+
+    def delete(self, key):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM cache")
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def stats(self):
+        return {'items': len(self), 'hits': self.hits, 'misses': self.misses}
+
+
+class ResponseCache:
+    """
+    Cache for LLM responses: an in-process LRU, optionally in front of the on-disk cache
+    (use_disk). Disk hits are promoted into the in-process tier.
+    """
+
+    def __init__(self, path=RESPONSE_CACHE_DB, ttl=RESPONSE_CACHE_TTL, max_bytes=RESPONSE_CACHE_MAX_BYTES,
+                 memory_items=RESPONSE_CACHE_MEMORY_ITEMS, enabled=RESPONSE_CACHE_ENABLED, use_disk=RESPONSE_CACHE_DISK):
+        self.enabled = enabled
+        self.use_disk = use_disk
+        self.memory = LRUCache(memory_items, ttl)
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._disk = None
+        self._disk_lock = threading.Lock()
+
+    # The SQLite file is only opened when the cache is first used
+    @property
+    def disk(self):
+        if self._disk is None:
+            with self._disk_lock:
+                if self._disk is None:
+                    self._disk = DiskCache(self.path, self.ttl, self.max_bytes)
+        return self._disk
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        value = self.memory.get(key)
+        if value is None and self.use_disk:
+            value = self.disk.get(key)
+            if value is not None:
+                self.memory.set(key, value)
+        return value
+
+    def set(self, key, value):
+        if not self.enabled:
+            return
+        self.memory.set(key, value)
+        if self.use_disk:
+            self.disk.set(key, value)
+
+    def delete(self, key):
+        if not self.enabled:
+            return
+        self.memory.delete(key)
+        if self.use_disk:
+            self.disk.delete(key)
+
+    def clear(self):
+        self.memory.clear()
+        if self.use_disk:
+            self.disk.clear()
+
+    def stats(self):
+        memory = self.memory.stats()
+        disk = self.disk.stats() if self._disk is not None else {'items': 0, 'hits': 0, 'misses': memory['misses']}
+        return {'memory_hits': memory['hits'], 'disk_hits': disk['hits'], 'misses': disk['misses'],
+                'memory_items': memory['items'], 'disk_items': disk['items']}
+
+
+class ModerationCache(LRUCache):
+    """
+    LRU of moderation verdicts keyed by a hash of the normalised text, which also counts
+    the inputs passed by the local pre-screen without a lookup or a remote call.
+    """
+
+    def __init__(self, max_items=MODERATION_CACHE_ITEMS):
+        super().__init__(max_items)
+        self.prescreened = 0
+
+    @staticmethod
+    def key(normalized_text):
+        return hashlib.sha256(normalized_text.encode('utf-8')).hexdigest()
+
+    def count_prescreened(self):
+        with self._lock:
+            self.prescreened += 1
+
+    def stats(self):
+        stats = super().stats()
+        stats['prescreened'] = self.prescreened
+        return stats
+
+
+# Shared cache used by get_chat_completions and intent_confirmation_layer
+response_cache = ResponseCache()
+
+# Shared cache of moderation_check verdicts
+moderation_cache = ModerationCache()
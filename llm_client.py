@@ -0,0 +1,91 @@
+import asyncio
+import os
+import threading
+import weakref
+
+import openai
+
+# Connection pool and timeout settings of the shared OpenAI clients, overridable from the environment
+LLM_TIMEOUT = float(os.environ.get('SHOPASSIST_LLM_TIMEOUT', '60'))
+LLM_CONNECT_TIMEOUT = float(os.environ.get('SHOPASSIST_LLM_CONNECT_TIMEOUT', '5'))
+MODERATION_TIMEOUT = float(os.environ.get('SHOPASSIST_MODERATION_TIMEOUT', '10'))
+LLM_MAX_CONNECTIONS = int(os.environ.get('SHOPASSIST_LLM_MAX_CONNECTIONS', '100'))
+LLM_MAX_KEEPALIVE = int(os.environ.get('SHOPASSIST_LLM_MAX_KEEPALIVE', '20'))
+LLM_KEEPALIVE_EXPIRY = float(os.environ.get('SHOPASSIST_LLM_KEEPALIVE_EXPIRY', '30'))
+
+# Maximum number of async requests in flight per event loop
+LLM_MAX_CONCURRENCY = int(os.environ.get('SHOPASSIST_LLM_MAX_CONCURRENCY', '64'))
+
+_client = None
+_client_lock = threading.Lock()
+
+# Async clients and semaphores are bound to the event loop they were created in
+_async_clients = weakref.WeakKeyDictionary()
+_async_limits = weakref.WeakKeyDictionary()
+
+
+# Keyword arguments shared by the sync and async clients
+def _client_options():
+    # httpx is a dependency of openai; imported here so importing this module stays cheap
+    import httpx
+
+    limits = httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_KEEPALIVE,
+                          keepalive_expiry=LLM_KEEPALIVE_EXPIRY)
+    timeout = httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+    # Retries are handled by the resilience layer (resilience.py)
+    return {'api_key': openai.api_key, 'timeout': timeout, 'max_retries': 0}, limits
+
+
+def get_client():
+    """
+    Returns the process-wide OpenAI client, created on first use.
+
+    The client keeps connections alive between calls in a bounded pool, so concurrent
+    requests from the chat server and the enrichment job reuse TLS connections.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                options, limits = _client_options()
+                _client = openai.OpenAI(http_client=openai.DefaultHttpxClient(limits=limits), **options)
+    return _client
+
+
+def get_async_client():
+    """
+    Returns the AsyncOpenAI client of the running event loop, created on first use.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        options, limits = _client_options()
+        client = openai.AsyncOpenAI(http_client=openai.DefaultAsyncHttpxClient(limits=limits), **options)
+        _async_clients[loop] = client
+    return client
+
+
+# Close the AsyncOpenAI client of the running event loop, e.g. before the loop finishes
+async def close_async_client():
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.close()
+
+
+# Semaphore capping the async requests in flight on the running event loop
+def async_limit():
+    loop = asyncio.get_running_loop()
+    semaphore = _async_limits.get(loop)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+        _async_limits[loop] = semaphore
+    return semaphore
+
+
+# Drop the shared clients, e.g. after openai.api_key changed or in a forked worker
+def reset_clients():
+    global _client
+    with _client_lock:
+        _client = None
+    _async_clients.clear()
+    _async_limits.clear()
@@ -0,0 +1,253 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# Histogram buckets in seconds, from fast local stages up to slow LLM calls
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Histogram buckets of tokens per LLM call
+TOKEN_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096, 8192)
+
+# Histogram buckets of LLM calls per chat turn
+CALL_BUCKETS = (0, 1, 2, 3, 4, 5, 6, 8, 10)
+
+
+# Escape a label value for the Prometheus text format
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """
+    Base class of a labelled metric; one child value is kept per combination of label values.
+    """
+
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(self._render_child(key, value) for key, value in items)
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    """
+    Monotonically increasing count.
+    """
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def _render_child(self, key, value):
+        return f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+
+
+class Gauge(Metric):
+    """
+    Value that can go up and down.
+    """
+
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def _render_child(self, key, value):
+        return f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+
+
+class Histogram(Metric):
+    """
+    Distribution of observed values over fixed cumulative buckets, with their sum and count.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            child = self._values.get(key)
+            if child is None:
+                # Per-bucket counts (not yet cumulative), sum and count
+                child = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            child[0][bisect.bisect_left(self.buckets, value)] += 1
+            child[1] += value
+            child[2] += 1
+
+    # Observe the duration of the with-block in seconds
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels):
+        child = self._values.get(self._key(labels))
+        return child[2] if child else 0
+
+    def _render_child(self, key, child):
+        counts, total, count = child
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += bucket_count
+            labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+        lines.append(f'{self.name}_count{labels} {count}')
+        return '\n'.join(lines)
+
+
+class Registry:
+    """
+    Collection of metrics rendered together in the Prometheus text exposition format.
+    """
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        return '\n'.join(metric.render() for metric in self._metrics) + '\n'
+
+
+# Metrics of this process, served by the /metrics route
+registry = Registry()
+
+TURN_STAGE_SECONDS = registry.register(Histogram(
+    'shopassist_turn_stage_seconds', 'Duration of each stage of a chat turn.', ['stage']))
+TURN_SECONDS = registry.register(Histogram(
+    'shopassist_turn_seconds', 'Duration of chat turns.', ['outcome']))
+TURN_LLM_CALLS = registry.register(Histogram(
+    'shopassist_turn_llm_calls', 'LLM backend calls (cache misses, before retries) per chat turn.', buckets=CALL_BUCKETS))
+LLM_REQUEST_SECONDS = registry.register(Histogram(
+    'shopassist_llm_request_seconds', 'Duration of requests to the LLM backend.', ['operation']))
+LLM_TOKENS = registry.register(Counter(
+    'shopassist_llm_tokens_total', 'Tokens used by LLM calls.', ['kind']))
+LLM_TOKENS_PER_CALL = registry.register(Histogram(
+    'shopassist_llm_tokens_per_call', 'Tokens used per LLM call.', ['kind'], buckets=TOKEN_BUCKETS))
+LLM_RETRIES = registry.register(Counter(
+    'shopassist_llm_retries_total', 'Retries of failed LLM calls.', ['function']))
+LLM_FAILURES = registry.register(Counter(
+    'shopassist_llm_failures_total', 'LLM calls that failed after their retries.', ['operation', 'reason']))
+LLM_BREAKER_TRANSITIONS = registry.register(Counter(
+    'shopassist_llm_breaker_transitions_total', 'State changes of the LLM circuit breakers.', ['breaker', 'state']))
+LLM_HEDGES = registry.register(Counter(
+    'shopassist_llm_hedged_requests_total', 'Hedged LLM calls, by which request answered first.', ['operation', 'winner']))
+LLM_CACHE = registry.register(Counter(
+    'shopassist_llm_cache_requests_total', 'Response cache lookups of chat completions.', ['result']))
+LLM_QUEUE_DEPTH = registry.register(Gauge(
+    'shopassist_llm_queue_depth', 'LLM requests waiting for admission by the scheduler.', ['priority']))
+LLM_QUEUE_WAIT_SECONDS = registry.register(Histogram(
+    'shopassist_llm_queue_wait_seconds', 'Time LLM requests waited for admission by the scheduler.', ['priority']))
+LLM_RATE_LIMITED = registry.register(Counter(
+    'shopassist_llm_rate_limited_total', 'LLM requests rejected by the API with a rate-limit error.', ['priority']))
+HTTP_REQUEST_SECONDS = registry.register(Histogram(
+    'shopassist_http_request_seconds', 'Duration of HTTP requests.', ['route', 'method', 'status']))
+
+
+# Record the prompt and completion tokens of one LLM call
+def record_tokens(prompt_tokens, completion_tokens):
+    for kind, tokens in (('prompt', prompt_tokens), ('completion', completion_tokens)):
+        if tokens is None:
+            continue
+        LLM_TOKENS.inc(tokens, kind=kind)
+        LLM_TOKENS_PER_CALL.observe(tokens, kind=kind)
+
+
+class CallCounter:
+    """
+    Thread-safe count of the LLM backend calls of one chat turn, by operation.
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def inc(self, operation):
+        with self._lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+
+    def total(self):
+        return sum(self.calls.values())
+
+    def as_dict(self):
+        with self._lock:
+            return dict(self.calls, total=sum(self.calls.values()))
+
+
+_turn_calls = contextvars.ContextVar('shopassist_turn_calls', default=None)
+
+
+# Count the LLM calls made in the with-block (and in work submitted with resilience.submit) on counter
+@contextmanager
+def counting_llm_calls(counter):
+    token = _turn_calls.set(counter)
+    try:
+        yield counter
+    finally:
+        _turn_calls.reset(token)
+
+
+# Record one LLM backend call on the current turn's counter, if any
+def record_llm_call(operation):
+    counter = _turn_calls.get()
+    if counter is not None:
+        counter.inc(operation)
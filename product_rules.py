@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+
+from catalog import FEATURE_KEYS
+
+# Rule tables mirroring the product_map_layer prompt. Patterns are matched case-insensitively
+# and checked in order, so the first matching level wins.
+GPU_RULES = [
+    ('high', r'rtx|quadro'),
+    ('medium', r'gtx|radeon|iris|apple m\d|\bm\d\b|arc'),
+    ('low', r'uhd|hd graphics|integrated'),
+]
+
+PROCESSOR_RULES = [
+    ('high', r'\bi[79]\b|ryzen [79]|xeon|core ultra [79]'),
+    ('medium', r'\bi5\b|ryzen 5|core ultra 5'),
+    ('low', r'\bi3\b|ryzen 3|celeron|pentium|athlon'),
+]
+
+# Laptop weight thresholds in kg: below the first is high portability, up to the second medium
+PORTABILITY_THRESHOLDS = (1.51, 2.51)
+
+# RAM thresholds in GB: below the first is low multitasking, below the second medium
+MULTITASKING_THRESHOLDS = (16, 32)
+
+# Pixel counts of Full HD and 4K: below Full HD is low display quality, 4K and up is high
+DISPLAY_THRESHOLDS = (1920 * 1080, 3840 * 2160)
+
+
+# Map each value of a text column to the level of the first matching rule
+def _match_rules(values, rules):
+    values = values.fillna('').astype(str).str.lower()
+    levels = pd.Series(np.nan, index=values.index, dtype=object)
+    for level, pattern in reversed(rules):
+        levels = levels.mask(values.str.contains(pattern, regex=True), level)
+    return levels
+
+
+# Bucket a numeric column into low / medium / high using two thresholds
+def _bucket(numbers, thresholds, ascending=True):
+    first, second = thresholds
+    order = ('low', 'medium', 'high') if ascending else ('high', 'medium', 'low')
+    levels = np.select([numbers < first, numbers < second, numbers >= second], order, default='')
+    return pd.Series(levels, index=numbers.index, dtype=object).replace('', np.nan)
+
+
+def classify_catalog(laptop_df):
+    """
+    Derives the five feature levels from the structured catalogue columns in one vectorised pass.
+
+    Parameters:
+    laptop_df (DataFrame): The catalogue, with the columns of laptop_data.csv.
+
+    Returns:
+    DataFrame: One column per FEATURE_KEYS entry holding 'low', 'medium', 'high' or NaN where
+    the rules could not resolve the value.
+    """
+    features = pd.DataFrame(index=laptop_df.index)
+
+    features['GPU intensity'] = _match_rules(laptop_df['Graphics Processor'], GPU_RULES)
+
+    resolution = laptop_df['Screen Resolution'].astype(str).str.extract(r'(\d+)\s*[x×]\s*(\d+)').astype(float)
+    display = _bucket(resolution[0] * resolution[1], DISPLAY_THRESHOLDS)
+    retina = laptop_df['Display Type'].astype(str).str.contains('retina', case=False)
+    features['Display quality'] = display.mask(retina, 'high')
+
+    weight = laptop_df['Laptop Weight'].astype(str).str.lower().str.extract(r'([\d.]+)\s*(kg|lbs?|pounds?)?')
+    kg = pd.to_numeric(weight[0], errors='coerce')
+    kg = kg.mask(weight[1].fillna('kg').str.startswith(('lb', 'pound')), kg * 0.4536)
+    # Thresholds are inclusive on the medium side: exactly 2.51 kg is still medium
+    features['Portability'] = _bucket(kg, (PORTABILITY_THRESHOLDS[0], np.nextafter(PORTABILITY_THRESHOLDS[1], np.inf)),
+                                      ascending=False)
+
+    ram = pd.to_numeric(laptop_df['RAM Size'].astype(str).str.extract(r'(\d+)', expand=False), errors='coerce')
+    features['Multitasking'] = _bucket(ram, MULTITASKING_THRESHOLDS)
+
+    features['Processing speed'] = _match_rules(laptop_df['Core'], PROCESSOR_RULES)
+
+    return features[FEATURE_KEYS]
+
+
+# Summary of how many rows the rules resolved and how many need the LLM
+def classification_stats(features):
+    unresolved = int(features.isna().any(axis=1).sum())
+    rows = len(features)
+    return {'rows': rows,
+            'resolved': rows - unresolved,
+            'fallback': unresolved,
+            'fallback_rate': round(unresolved / rows, 4) if rows else 0.0}
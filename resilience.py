@@ -0,0 +1,486 @@
+import asyncio
+import bisect
+import contextvars
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+
+from metrics import LLM_RETRIES, LLM_FAILURES, LLM_BREAKER_TRANSITIONS, LLM_HEDGES
+
+logger = logging.getLogger(__name__)
+
+# End-to-end time budget of one chat turn in seconds, overridable from the environment
+TURN_DEADLINE = float(os.environ.get('SHOPASSIST_TURN_DEADLINE', '30'))
+
+# Attempts per LLM call and the exponential backoff between them (full jitter), in seconds.
+# Retries never outlive the turn deadline; calls without one (the catalogue enrichment) use them all
+RETRY_ATTEMPTS = int(os.environ.get('SHOPASSIST_RETRY_ATTEMPTS', '6'))
+RETRY_MIN_WAIT = float(os.environ.get('SHOPASSIST_RETRY_MIN_WAIT', '1'))
+RETRY_MAX_WAIT = float(os.environ.get('SHOPASSIST_RETRY_MAX_WAIT', '20'))
+
+# Consecutive failures that open a circuit breaker, and seconds before it lets a probe call through
+BREAKER_FAILURES = int(os.environ.get('SHOPASSIST_BREAKER_FAILURES', '5'))
+BREAKER_RESET_SECONDS = float(os.environ.get('SHOPASSIST_BREAKER_RESET_SECONDS', '30'))
+
+# A duplicate request is sent when a call is slower than this percentile of recent calls; 0 (the
+# default) disables hedging, since every hedge is a second billed request
+HEDGE_PERCENTILE = float(os.environ.get('SHOPASSIST_HEDGE_PERCENTILE', '0'))
+# Recent latencies kept per operation, and how many are needed before hedging starts
+HEDGE_WINDOW = int(os.environ.get('SHOPASSIST_HEDGE_WINDOW', '200'))
+HEDGE_MIN_SAMPLES = int(os.environ.get('SHOPASSIST_HEDGE_MIN_SAMPLES', '20'))
+
+# Circuit breaker of each operation: operations sharing an upstream endpoint share its breaker
+BREAKER_OF_OPERATION = {'completion': 'chat', 'intent': 'chat', 'stream': 'chat', 'moderation': 'moderation'}
+
+
+class Unavailable(Exception):
+    """
+    The LLM backend could not answer in time; the turn should fail fast with a friendly message.
+    """
+
+
+class DeadlineExceeded(Unavailable):
+    pass
+
+
+class CircuitOpen(Unavailable):
+    pass
+
+
+# DeadlineExceeded for a request the upstream did not answer in time, which counts against its breaker
+def _upstream_timeout(message):
+    error = DeadlineExceeded(message)
+    error.upstream = True
+    return error
+
+
+_deadline = contextvars.ContextVar('shopassist_deadline', default=None)
+
+
+@contextmanager
+def deadline(seconds=TURN_DEADLINE):
+    """
+    Sets the deadline of the calls made in the with-block (and in work submitted with submit).
+    A nested deadline can only shorten the enclosing one.
+    """
+    expires = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(expires if current is None else min(current, expires))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+# Seconds left before the current deadline, or None if there is none
+def remaining():
+    expires = _deadline.get()
+    if expires is None:
+        return None
+    return expires - time.monotonic()
+
+
+# Raise DeadlineExceeded if the current deadline has passed
+def check_deadline():
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded("turn deadline exceeded")
+
+
+# Submit fn(*args) to a thread pool so it runs under the caller's deadline
+def submit(pool, fn, *args):
+    return pool.submit(contextvars.copy_context().run, fn, *args)
+
+
+class _Admission:
+    """
+    Whether a request is still waiting for local admission (see queued), so a deadline passing
+    meanwhile is not held against the upstream.
+    """
+
+    def __init__(self):
+        self.waiting = False
+
+
+_admission = contextvars.ContextVar('shopassist_admission', default=None)
+
+
+# Mark the with-block as waiting for local admission, e.g. in the rate-limit scheduler's queue.
+# A block that raises (gave up or was cancelled while queued) leaves the request marked as never admitted
+@contextmanager
+def queued():
+    state = _admission.get()
+    if state is not None:
+        state.waiting = True
+    yield
+    if state is not None:
+        state.waiting = False
+
+
+# Submit one request of _attempt with its own admission state
+def _submit_request(fn, args):
+    state = _Admission()
+
+    def run():
+        # Runs in a copy of the caller's context, so the state is only seen by this request
+        _admission.set(state)
+        return fn(*args)
+
+    return submit(_call_pool, run), state
+
+
+# DeadlineExceeded for requests that timed out: upstream unless every one was still waiting for admission
+def _timeout(operation, states):
+    if states and all(state.waiting for state in states):
+        return DeadlineExceeded(f"{operation} was not admitted before the turn deadline")
+    return _upstream_timeout(f"{operation} did not finish before the turn deadline")
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    'closed' lets every call through. After failure_threshold consecutive failures it goes
+    'open' and rejects calls for reset_seconds; then it is 'half_open' and lets one probe call
+    through, which closes it on success or opens it again on failure.
+    """
+
+    def __init__(self, name, failure_threshold=BREAKER_FAILURES, reset_seconds=BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def _transition(self, state):
+        if state != self.state:
+            self.state = state
+            LLM_BREAKER_TRANSITIONS.inc(breaker=self.name, state=state)
+            logger.debug("Circuit breaker %r is now %s", self.name, state)
+
+    # Seconds until an open breaker lets a probe through (0 if calls are allowed now)
+    def retry_after(self):
+        if self.state != 'open':
+            return 0
+        return max(self.opened_at + self.reset_seconds - time.monotonic(), 0)
+
+    # Raise CircuitOpen unless a call may go through now; returns True if the call is the half-open probe
+    def allow(self):
+        with self._lock:
+            if self.state == 'open' and self.retry_after() == 0:
+                self._transition('half_open')
+            if self.state == 'open' or (self.state == 'half_open' and self._probing):
+                raise CircuitOpen(f"circuit breaker {self.name!r} is open")
+            if self.state == 'half_open':
+                self._probing = True
+                return True
+            return False
+
+    # End a probe that neither succeeded nor failed upstream, so the next call can probe instead
+    def release(self):
+        with self._lock:
+            self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._probing = False
+            self._transition('closed')
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self._transition('open')
+
+
+class LatencyWindow:
+    """
+    Latencies of the most recent successful calls of one operation, for the hedging threshold.
+    """
+
+    def __init__(self, size=HEDGE_WINDOW):
+        self._values = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self._values.append(seconds)
+
+    # The p-th percentile (nearest rank), or None until min_samples latencies were observed
+    def percentile(self, p, min_samples=HEDGE_MIN_SAMPLES):
+        with self._lock:
+            values = sorted(self._values)
+        if len(values) < max(min_samples, 1):
+            return None
+        rank = min(max(int(round(p / 100 * len(values) + 0.5)) - 1, 0), len(values) - 1)
+        return values[rank]
+
+
+# Callables that must all return True for a hedged request to be sent, see add_hedge_guard
+_hedge_guards = []
+
+
+# Register a check that can veto hedged requests, e.g. while requests queue for rate-limit admission
+def add_hedge_guard(guard):
+    _hedge_guards.append(guard)
+
+
+_breakers = {}
+_latencies = {}
+_registry_lock = threading.Lock()
+
+
+def get_breaker(operation):
+    name = BREAKER_OF_OPERATION.get(operation, operation)
+    with _registry_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+
+def get_latencies(operation):
+    with _registry_lock:
+        if operation not in _latencies:
+            _latencies[operation] = LatencyWindow()
+        return _latencies[operation]
+
+
+# Forget breaker states and latency windows, e.g. between load-test runs
+def reset():
+    with _registry_lock:
+        _breakers.clear()
+        _latencies.clear()
+
+
+# Client errors (bad request, authentication, ...) are neither retried nor held against the upstream
+def _is_client_error(error):
+    status = getattr(error, 'status_code', None)
+    return isinstance(status, int) and 400 <= status < 500 and status not in (408, 409, 429)
+
+
+# Failures that say nothing about the upstream's health, e.g. a deadline passed while queued for admission
+def _not_upstream_failure(error):
+    return _is_client_error(error) or (isinstance(error, Unavailable) and not getattr(error, 'upstream', False))
+
+
+# Backoff before the given retry (1-based), with full jitter
+def _backoff(retry_number):
+    return random.uniform(0, min(RETRY_MAX_WAIT, RETRY_MIN_WAIT * 2 ** retry_number))
+
+
+# Seconds to wait before the next attempt, or None if the call should give up
+def _next_wait(operation, error, attempt, breaker):
+    if attempt >= RETRY_ATTEMPTS:
+        return None
+    left = remaining()
+    if isinstance(error, CircuitOpen):
+        # Interactive turns fail fast; background calls wait for the breaker's next probe
+        if left is not None:
+            return None
+        wait_seconds = breaker.retry_after() + random.uniform(0, RETRY_MIN_WAIT)
+    else:
+        wait_seconds = _backoff(attempt)
+    if left is not None and wait_seconds >= left:
+        return None
+    LLM_RETRIES.inc(function=operation)
+    logger.debug("Retrying %s (attempt %d) in %.1fs: %r", operation, attempt, wait_seconds, error)
+    return wait_seconds
+
+
+# Raise the error that ends a call, counted by reason
+def _give_up(operation, error):
+    if isinstance(error, Unavailable):
+        LLM_FAILURES.inc(operation=operation, reason='deadline' if isinstance(error, DeadlineExceeded) else 'circuit_open')
+        raise error
+    LLM_FAILURES.inc(operation=operation, reason='error')
+    raise error
+
+
+# Calls made off the request thread, so they can be abandoned at the deadline or hedged
+_call_pool = ThreadPoolExecutor(max_workers=int(os.environ.get('SHOPASSIST_LLM_CALL_WORKERS', '64')),
+                                thread_name_prefix='llm-call')
+
+
+# Run one attempt, sending a hedge if the first request is slower than the percentile threshold
+def _attempt(operation, fn, args, hedge):
+    delay = None
+    if hedge and HEDGE_PERCENTILE > 0:
+        delay = get_latencies(operation).percentile(HEDGE_PERCENTILE)
+    left = remaining()
+    if delay is None and left is None:
+        return fn(*args)
+
+    # Submitted with the caller's context, so the deadline and scheduling priority carry over
+    first, state = _submit_request(fn, args)
+    futures = [first]
+    states = {first: state}
+    if delay is not None and (left is None or delay < left):
+        done, _ = wait(futures, timeout=delay)
+        if not done and all(guard() for guard in _hedge_guards):
+            hedge_future, states[hedge_future] = _submit_request(fn, args)
+            futures.append(hedge_future)
+    while True:
+        left = remaining()
+        if left is not None and left <= 0:
+            raise _timeout(operation, [states[future] for future in futures if not future.done()])
+        done, pending = wait(futures, timeout=left, return_when=FIRST_COMPLETED)
+        if not done:
+            continue
+        for future in done:
+            if future.exception() is None:
+                if len(futures) > 1:
+                    LLM_HEDGES.inc(operation=operation, winner='primary' if future is first else 'hedge')
+                return future.result()
+        if not pending:
+            # Every request failed; report the primary's error
+            raise (first.exception() if first.done() else next(iter(done)).exception())
+        futures = list(pending)
+
+
+_end = object()
+
+
+def bounded(iterable):
+    """
+    Iterates over a blocking iterable (e.g. a completion stream) under the current deadline:
+    each item is read off the calling thread, and DeadlineExceeded is raised if the next item
+    does not arrive in time; the iterable is then closed as soon as its pending read returns.
+    Without a deadline the iterable is read directly.
+    """
+    iterator = iter(iterable)
+    while True:
+        left = remaining()
+        if left is None:
+            item = next(iterator, _end)
+        else:
+            future = _call_pool.submit(next, iterator, _end)
+            done, _ = wait([future], timeout=max(left, 0))
+            if not done:
+                if hasattr(iterator, 'close'):
+                    future.add_done_callback(lambda _: iterator.close())
+                raise _upstream_timeout("stream did not finish before the turn deadline")
+            item = future.result()
+        if item is _end:
+            return
+        yield item
+
+
+def call(operation, fn, *args, hedge=False):
+    """
+    Calls fn(*args), a request to the LLM backend, with the shared resilience policy.
+
+    The call fails fast with CircuitOpen while the operation's circuit breaker is open, and
+    with DeadlineExceeded once the current deadline (see deadline) has passed, even if the
+    request itself is still running. Failures are retried with exponential backoff, but never
+    beyond the deadline. With hedge=True a duplicate request is sent when the first is slower
+    than HEDGE_PERCENTILE of the operation's recent latencies, and the first success wins.
+    Only use hedging for idempotent requests.
+
+    Parameters:
+    operation (str): Name of the call, e.g. 'completion' or 'moderation'; selects the breaker.
+    fn (callable): The request to make.
+    hedge (bool): Allow a hedged duplicate request.
+
+    Returns:
+    The result of fn.
+    """
+    breaker = get_breaker(operation)
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            check_deadline()
+            probe = breaker.allow()
+        except Unavailable as e:
+            wait_seconds = _next_wait(operation, e, attempt, breaker)
+            if wait_seconds is None:
+                _give_up(operation, e)
+            time.sleep(wait_seconds)
+            continue
+
+        started = time.perf_counter()
+        settled = False
+        try:
+            result = _attempt(operation, fn, args, hedge)
+            breaker.record_success()
+            settled = True
+        except Exception as e:
+            if _not_upstream_failure(e):
+                _give_up(operation, e)
+            breaker.record_failure()
+            settled = True
+            wait_seconds = None if isinstance(e, DeadlineExceeded) else _next_wait(operation, e, attempt, breaker)
+            if wait_seconds is None:
+                _give_up(operation, e)
+            time.sleep(wait_seconds)
+            continue
+        finally:
+            # Client errors, local deadlines and interruptions say nothing about the upstream
+            if probe and not settled:
+                breaker.release()
+
+        get_latencies(operation).observe(time.perf_counter() - started)
+        return result
+
+
+async def acall(operation, afn, *args):
+    """
+    Async counterpart of call for coroutine functions, with the same breakers, retries and
+    deadline (awaited with asyncio.wait_for). Async calls are not hedged.
+    """
+    breaker = get_breaker(operation)
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            check_deadline()
+            probe = breaker.allow()
+        except Unavailable as e:
+            wait_seconds = _next_wait(operation, e, attempt, breaker)
+            if wait_seconds is None:
+                _give_up(operation, e)
+            await asyncio.sleep(wait_seconds)
+            continue
+
+        started = time.perf_counter()
+        settled = False
+        try:
+            # The awaited task copies the context, so it shares this admission state
+            state = _Admission()
+            token = _admission.set(state)
+            try:
+                result = await asyncio.wait_for(afn(*args), timeout=remaining())
+            except asyncio.TimeoutError:
+                raise _timeout(operation, [state])
+            finally:
+                _admission.reset(token)
+            breaker.record_success()
+            settled = True
+        except Exception as e:
+            if _not_upstream_failure(e):
+                _give_up(operation, e)
+            breaker.record_failure()
+            settled = True
+            wait_seconds = None if isinstance(e, DeadlineExceeded) else _next_wait(operation, e, attempt, breaker)
+            if wait_seconds is None:
+                _give_up(operation, e)
+            await asyncio.sleep(wait_seconds)
+            continue
+        finally:
+            # Client errors, local deadlines and cancellation say nothing about the upstream
+            if probe and not settled:
+                breaker.release()
+
+        get_latencies(operation).observe(time.perf_counter() - started)
+        return result
@@ -0,0 +1,327 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import LLM_QUEUE_DEPTH, LLM_QUEUE_WAIT_SECONDS, LLM_RATE_LIMITED
+from resilience import remaining, add_hedge_guard, queued, DeadlineExceeded
+
+# Requests and tokens per minute the API key allows for chat completions (set them to the key's
+# rate limits); 0 disables a limit
+LLM_RPM = float(os.environ.get('SHOPASSIST_LLM_RPM', '3500'))
+LLM_TPM = float(os.environ.get('SHOPASSIST_LLM_TPM', '200000'))
+# Seconds of the per-minute budgets that may be spent in one burst
+LLM_BURST_SECONDS = float(os.environ.get('SHOPASSIST_LLM_BURST_SECONDS', '10'))
+# Completion tokens assumed per request when reserving the token budget
+LLM_COMPLETION_TOKENS = int(os.environ.get('SHOPASSIST_LLM_COMPLETION_TOKENS', '300'))
+# Seconds all requests are held after a rate-limit error without a Retry-After header
+RATE_LIMIT_PAUSE = float(os.environ.get('SHOPASSIST_RATE_LIMIT_PAUSE', '2'))
+
+# Priorities, most urgent first: live chat turns, then the catalogue enrichment
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', BACKGROUND: 'background'}
+
+# Seconds between admission checks of a waiting async request
+_ASYNC_POLL_SECONDS = 0.02
+
+_priority = contextvars.ContextVar('shopassist_priority', default=INTERACTIVE)
+
+
+# Run the with-block's LLM requests (and the tasks and submitted work it starts) at this priority
+@contextmanager
+def priority(value):
+    token = _priority.set(value)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority():
+    return _priority.get()
+
+
+class TokenBucket:
+    """
+    Budget refilled continuously at rate_per_minute, holding at most burst_seconds of it.
+    A rate of 0 means unlimited.
+    """
+
+    def __init__(self, rate_per_minute, burst_seconds=LLM_BURST_SECONDS):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(self.rate * burst_seconds, 1.0)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Seconds until cost is available (0 if it is now); requests larger than the bucket wait for a full one
+    def wait_time(self, cost, now):
+        if not self.rate:
+            return 0.0
+        self._refill(now)
+        missing = min(cost, self.capacity) - self.level
+        return max(missing / self.rate, 0.0)
+
+    def take(self, cost):
+        if self.rate:
+            self.level -= min(cost, self.capacity)
+
+    # Empty the bucket, e.g. after the API reported a rate-limit error
+    def drain(self, now):
+        if self.rate:
+            self._refill(now)
+            self.level = min(self.level, 0.0)
+
+
+class Scheduler:
+    """
+    Process-wide admission control of LLM requests.
+
+    A request waits in a priority queue until it is at the head and both the requests-per-minute
+    and the tokens-per-minute budgets can cover it; interactive requests are always admitted
+    before background ones, in arrival order within a priority. Rate-limit errors from the API
+    pause all admissions for a while instead of letting every caller retry into them.
+    """
+
+    def __init__(self, rpm=LLM_RPM, tpm=LLM_TPM, burst_seconds=LLM_BURST_SECONDS):
+        self.requests = TokenBucket(rpm, burst_seconds)
+        self.tokens = TokenBucket(tpm, burst_seconds)
+        self.paused_until = 0.0
+        self._queue = []
+        self._order = itertools.count()
+        self._cond = threading.Condition()
+        self._waits = {name: [0, 0.0, 0.0] for name in PRIORITY_NAMES.values()}
+
+    # Seconds the head request must still wait, or 0 if it can be admitted now
+    def _head_wait(self, cost, now):
+        return max(self.paused_until - now, self.requests.wait_time(1, now), self.tokens.wait_time(cost, now))
+
+    # Admit the entry if it is at the head and the budgets allow; otherwise return the seconds to wait
+    def _try_admit(self, entry):
+        now = time.monotonic()
+        if self._queue[0] is not entry:
+            return None
+        wait = self._head_wait(entry[2], now)
+        if wait > 0:
+            return wait
+        heapq.heappop(self._queue)
+        self.requests.take(1)
+        self.tokens.take(entry[2])
+        self._cond.notify_all()
+        return 0.0
+
+    def _enqueue(self, cost):
+        entry = (current_priority(), next(self._order), cost)
+        with self._cond:
+            heapq.heappush(self._queue, entry)
+        LLM_QUEUE_DEPTH.inc(priority=PRIORITY_NAMES[entry[0]])
+        return entry
+
+    # Remove a request that gave up waiting
+    def _withdraw(self, entry):
+        with self._cond:
+            if entry in self._queue:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                self._cond.notify_all()
+
+    def _admitted(self, entry, started):
+        name = PRIORITY_NAMES[entry[0]]
+        waited = time.monotonic() - started
+        LLM_QUEUE_DEPTH.dec(priority=name)
+        LLM_QUEUE_WAIT_SECONDS.observe(waited, priority=name)
+        with self._cond:
+            stats = self._waits[name]
+            stats[0] += 1
+            stats[1] += waited
+            stats[2] = max(stats[2], waited)
+        return waited
+
+    # Raise DeadlineExceeded if the caller's deadline passes before the wait is over
+    @staticmethod
+    def _bounded_wait(wait):
+        left = remaining()
+        if left is not None and left <= 0:
+            raise DeadlineExceeded("LLM request was not admitted before the turn deadline")
+        if wait is None:
+            wait = left
+        elif left is not None:
+            wait = min(wait, left)
+        return wait
+
+    def acquire(self, cost):
+        """
+        Blocks until a request of cost tokens is admitted at the current priority.
+
+        Returns:
+        float: Seconds spent waiting.
+        """
+        started = time.monotonic()
+        entry = self._enqueue(cost)
+        try:
+            with self._cond:
+                while True:
+                    wait = self._try_admit(entry)
+                    if wait == 0:
+                        break
+                    self._cond.wait(self._bounded_wait(wait))
+        except BaseException:
+            LLM_QUEUE_DEPTH.dec(priority=PRIORITY_NAMES[entry[0]])
+            self._withdraw(entry)
+            raise
+        return self._admitted(entry, started)
+
+    # Async counterpart of acquire, waiting without holding a thread
+    async def aacquire(self, cost):
+        started = time.monotonic()
+        entry = self._enqueue(cost)
+        try:
+            while True:
+                with self._cond:
+                    wait = self._try_admit(entry)
+                if wait == 0:
+                    break
+                await asyncio.sleep(self._bounded_wait(min(wait or _ASYNC_POLL_SECONDS, _ASYNC_POLL_SECONDS * 10)))
+        except BaseException:
+            LLM_QUEUE_DEPTH.dec(priority=PRIORITY_NAMES[entry[0]])
+            self._withdraw(entry)
+            raise
+        return self._admitted(entry, started)
+
+    # True if nothing waits for admission; a hedged request would otherwise only lengthen the queue
+    def idle(self):
+        with self._cond:
+            return not self._queue and self.paused_until <= time.monotonic()
+
+    # Hold every request for retry_after seconds after the API answered with a rate-limit error
+    def rate_limited(self, retry_after=None):
+        LLM_RATE_LIMITED.inc(priority=PRIORITY_NAMES[current_priority()])
+        with self._cond:
+            now = time.monotonic()
+            self.paused_until = max(self.paused_until, now + (retry_after or RATE_LIMIT_PAUSE))
+            self.requests.drain(now)
+            self.tokens.drain(now)
+
+    def stats(self):
+        """
+        Returns the queue depth and wait times per priority, and the remaining budgets.
+        """
+        with self._cond:
+            depth = {name: 0 for name in PRIORITY_NAMES.values()}
+            for entry in self._queue:
+                depth[PRIORITY_NAMES[entry[0]]] += 1
+            waits = {name: {"admitted": count,
+                            "mean_wait_ms": round(total / count * 1000, 1) if count else 0.0,
+                            "max_wait_ms": round(longest * 1000, 1)}
+                     for name, (count, total, longest) in self._waits.items()}
+            now = time.monotonic()
+            for bucket in (self.requests, self.tokens):
+                if bucket.rate:
+                    bucket._refill(now)
+            return {"queue_depth": depth,
+                    "waits": waits,
+                    "paused_seconds": round(max(self.paused_until - now, 0), 2),
+                    "requests_available": round(self.requests.level, 1) if self.requests.rate else None,
+                    "tokens_available": round(self.tokens.level, 1) if self.tokens.rate else None}
+
+
+# Tokens reserved for a chat completion request: its prompt (about four characters per token) and the completion
+def request_cost(request):
+    prompt = sum(len(json.dumps(m.get('content'), default=str)) for m in request.get('messages', []))
+    if request.get('functions'):
+        prompt += len(json.dumps(request['functions']))
+    return math.ceil(prompt / 4) + LLM_COMPLETION_TOKENS
+
+
+# Seconds the API asked us to wait in a rate-limit error, if any
+def _retry_after(error):
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+def _is_rate_limited(error):
+    return getattr(error, 'status_code', None) == 429
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+# The process-wide scheduler, created on first use
+def get_scheduler():
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = Scheduler()
+    return _scheduler
+
+
+# Replace the process-wide scheduler, e.g. with a share of the budgets in a background job's process
+def set_scheduler(instance):
+    global _scheduler
+    with _scheduler_lock:
+        _scheduler = instance
+
+
+add_hedge_guard(lambda: get_scheduler().idle())
+
+
+def scheduled(fn, request):
+    """
+    Wraps a chat completion call so each invocation (every retry and hedge) is admitted by the
+    scheduler first, and rate-limit errors pause the scheduler.
+
+    Parameters:
+    fn (callable): Called as fn(request), e.g. get_backend().complete.
+    request (dict): The chat completion request.
+
+    Returns:
+    callable: fn with admission control, to pass to resilience.call.
+    """
+    cost = request_cost(request)
+
+    def call(request):
+        scheduler = get_scheduler()
+        with queued():
+            scheduler.acquire(cost)
+        try:
+            return fn(request)
+        except Exception as e:
+            if _is_rate_limited(e):
+                scheduler.rate_limited(_retry_after(e))
+            raise
+
+    return call
+
+
+# Async counterpart of scheduled, for coroutine functions such as get_backend().acomplete
+def ascheduled(afn, request):
+    cost = request_cost(request)
+
+    async def call(request):
+        scheduler = get_scheduler()
+        with queued():
+            await scheduler.aacquire(cost)
+        try:
+            return await afn(request)
+        except Exception as e:
+            if _is_rate_limited(e):
+                scheduler.rate_limited(_retry_after(e))
+            raise
+
+    return call
@@ -0,0 +1,272 @@
+import bisect
+import itertools
+import logging
+import math
+import os
+import re
+import threading
+import time
+import weakref
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Catalogue fields searched by follow-up questions, and their weight in the combined score
+SEARCH_FIELDS = {'Special Features': 2.0, 'Description': 1.0}
+
+# BM25 term-frequency saturation and length normalisation
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Words that carry no meaning in a question about laptops
+STOPWORDS = frozenset("""
+a about all also an and any are as at be but by can could do does for from has have how i if in is it its
+laptop laptops me my of on one ones or please show tell than that the them these this those to too was
+what when which who why will with would you your
+""".split())
+
+_TOKEN_PATTERN = re.compile(r'[a-z0-9]+(?:\.[0-9]+)?')
+_SENTENCE_PATTERN = re.compile(r'(?<=[.!?])\s+')
+
+
+# Lower-case word tokens without stopwords; a plural 's' is dropped so "keyboards" matches "keyboard"
+def tokenize(text):
+    tokens = []
+    for token in _TOKEN_PATTERN.findall(str(text).lower()):
+        if token in STOPWORDS:
+            continue
+        if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+class _Terms:
+    """
+    Sorted vocabulary stored as one UTF-8 blob with offsets, readable straight from a memory map.
+    """
+
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    @classmethod
+    def from_list(cls, terms):
+        encoded = [term.encode('utf-8') for term in terms]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(term) for term in encoded])
+        return cls(np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.data[self.offsets[i]:self.offsets[i + 1]].tobytes().decode('utf-8')
+
+
+class Postings:
+    """
+    Postings of one field packed into flat arrays: for the i-th term of the sorted vocabulary,
+    the rows containing it and its frequency in each are rows[offsets[i]:offsets[i + 1]] and
+    tfs[offsets[i]:offsets[i + 1]].
+    """
+
+    def __init__(self, terms, offsets, rows, tfs):
+        self.terms = terms
+        self.offsets = offsets
+        self.rows = rows
+        self.tfs = tfs
+
+    @classmethod
+    def from_dict(cls, postings):
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(postings[term][0]) for term in terms])
+        rows = np.fromiter(itertools.chain.from_iterable(postings[term][0] for term in terms),
+                           dtype=np.int32, count=offsets[-1])
+        tfs = np.fromiter(itertools.chain.from_iterable(postings[term][1] for term in terms),
+                          dtype=np.float32, count=offsets[-1])
+        return cls(_Terms.from_list(terms), offsets, rows, tfs)
+
+    # (rows, term frequencies) of a term, or None if no row contains it
+    def get(self, term):
+        i = bisect.bisect_left(self.terms, term)
+        if i == len(self.terms) or self.terms[i] != term:
+            return None
+        return self.rows[self.offsets[i]:self.offsets[i + 1]], self.tfs[self.offsets[i]:self.offsets[i + 1]]
+
+
+class SearchIndex:
+    """
+    BM25 inverted index over the text fields of laptops.
+
+    Each field of SEARCH_FIELDS has its own postings (see Postings) and length statistics; a
+    row's score is the weighted sum of its per-field BM25 scores. The arrays can be saved into
+    the catalogue artifact and memory-mapped back (see save and load).
+    """
+
+    def __init__(self, size, fields, postings, lengths):
+        """
+        Parameters:
+        size (int): Number of rows.
+        fields (dict): Field name -> weight.
+        postings (dict): Field name -> Postings.
+        lengths (dict): Field name -> number of tokens of each row.
+        """
+        self.size = size
+        self.fields = dict(fields)
+        self.postings = postings
+        self.lengths = lengths
+        self.average_length = {field: float(lengths[field].mean()) if size else 0.0 for field in self.fields}
+
+    @classmethod
+    def build(cls, documents, fields=SEARCH_FIELDS):
+        """
+        Parameters:
+        documents (list): One dict per row, mapping field names to their text.
+        fields (dict): Field name -> weight.
+        """
+        postings = {}
+        lengths = {}
+        for field in fields:
+            field_postings = {}
+            field_lengths = np.zeros(len(documents), dtype=np.float32)
+            for row, document in enumerate(documents):
+                tokens = tokenize(document.get(field) or '')
+                field_lengths[row] = len(tokens)
+                counts = {}
+                for token in tokens:
+                    counts[token] = counts.get(token, 0) + 1
+                for token, count in counts.items():
+                    field_postings.setdefault(token, ([], []))
+                    field_postings[token][0].append(row)
+                    field_postings[token][1].append(count)
+            postings[field] = Postings.from_dict(field_postings)
+            lengths[field] = field_lengths
+        return cls(len(documents), fields, postings, lengths)
+
+    @classmethod
+    def from_records(cls, records, fields=SEARCH_FIELDS):
+        return cls.build([{field: record.get(field) for field in fields} for record in records], fields)
+
+    @classmethod
+    def from_catalog(cls, catalog, fields=SEARCH_FIELDS):
+        columns = {name: values for name, values in catalog.columns if name in fields}
+        documents = [{field: columns[field][row] for field in columns} for row in range(len(catalog))]
+        return cls.build(documents, {field: weight for field, weight in fields.items() if field in columns})
+
+    def save(self, directory):
+        """
+        Writes the index arrays into directory as search.<n>.*.npy files.
+
+        Returns:
+        dict: The metadata load needs, to keep with the artifact's other metadata.
+        """
+        for n, field in enumerate(self.fields):
+            postings = self.postings[field]
+            arrays = {'terms': postings.terms.data, 'term_offsets': postings.terms.offsets,
+                      'offsets': postings.offsets, 'rows': postings.rows, 'tfs': postings.tfs,
+                      'lengths': self.lengths[field]}
+            for name, values in arrays.items():
+                np.save(os.path.join(directory, f'search.{n}.{name}.npy'), values)
+        return {'size': self.size, 'fields': list(self.fields.items())}
+
+    @classmethod
+    def load(cls, directory, meta):
+        """
+        Memory-maps an index written by save; meta is the dictionary save returned.
+        """
+        def load(file):
+            return np.asarray(np.load(os.path.join(directory, file), mmap_mode='r'))
+
+        fields = dict(meta['fields'])
+        postings = {}
+        lengths = {}
+        for n, field in enumerate(fields):
+            terms = _Terms(load(f'search.{n}.terms.npy'), load(f'search.{n}.term_offsets.npy'))
+            postings[field] = Postings(terms, load(f'search.{n}.offsets.npy'), load(f'search.{n}.rows.npy'),
+                                       load(f'search.{n}.tfs.npy'))
+            lengths[field] = load(f'search.{n}.lengths.npy')
+        return cls(meta['size'], fields, postings, lengths)
+
+    def _idf(self, document_frequency):
+        # BM25 idf with +1 inside the log, so terms found in most rows still count a little
+        return math.log(1 + (self.size - document_frequency + 0.5) / (document_frequency + 0.5))
+
+    def scores(self, query):
+        """
+        Returns the BM25 score of every row for the query (0 for rows matching no query term).
+        """
+        scores = np.zeros(self.size, dtype=np.float32)
+        terms = set(tokenize(query))
+        for field, weight in self.fields.items():
+            average = self.average_length[field] or 1.0
+            for term in terms:
+                posting = self.postings[field].get(term)
+                if posting is None:
+                    continue
+                rows, tfs = posting
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[field][rows] / average)
+                contribution = self._idf(len(rows)) * tfs * (BM25_K1 + 1) / (tfs + norm)
+                scores[rows] += weight * contribution
+        return scores
+
+    def search(self, query, k=3):
+        """
+        Returns up to k (row, score) pairs of the rows best matching the query, best first.
+        Rows matching no query term are never returned; equal scores keep row order.
+        """
+        scores = self.scores(query)
+        matching = np.flatnonzero(scores > 0)
+        if len(matching) > k:
+            # Keep every row tying with the k-th best score, so the sort below picks among them by row
+            kth = -np.partition(-scores[matching], k - 1)[k - 1]
+            matching = matching[scores[matching] >= kth]
+        order = np.lexsort((matching, -scores[matching]))[:k]
+        return [(int(matching[i]), float(scores[matching[i]])) for i in order]
+
+
+# Sentences of a text that mention one of the query's terms, in their original order
+def matching_sentences(text, query, limit=2):
+    terms = set(tokenize(query))
+    sentences = [s for s in _SENTENCE_PATTERN.split(str(text or '')) if terms & set(tokenize(s))]
+    return sentences[:limit]
+
+
+# Search indexes built in the background for catalogues loaded without one (parsed from the CSV)
+_catalog_indexes = weakref.WeakKeyDictionary()
+_building = weakref.WeakSet()
+_catalog_indexes_lock = threading.Lock()
+
+
+def _build_catalog_index(catalog):
+    started = time.perf_counter()
+    try:
+        index = SearchIndex.from_catalog(catalog)
+        logger.debug("Search index built over %d laptops in %.2fs", index.size, time.perf_counter() - started)
+        with _catalog_indexes_lock:
+            _catalog_indexes[catalog] = index
+    except Exception:
+        logger.exception("Building the search index failed")
+    finally:
+        # A failed build is retried by the next get_search_index call
+        with _catalog_indexes_lock:
+            _building.discard(catalog)
+
+
+def get_search_index(catalog):
+    """
+    Returns the search index over a CatalogIndex without blocking.
+
+    Catalogues loaded from the compiled artifact carry their index. For others the index is
+    built on a background thread, started by the first call, and None is returned until it is ready.
+    """
+    index = getattr(catalog, 'search_index', None) or _catalog_indexes.get(catalog)
+    if index is None:
+        with _catalog_indexes_lock:
+            if catalog not in _catalog_indexes and catalog not in _building:
+                _building.add(catalog)
+                threading.Thread(target=_build_catalog_index, args=(catalog,), name='search-index',
+                                 daemon=True).start()
+    return index
@@ -0,0 +1,163 @@
+import copy
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+# Backend selection and limits, overridable from the environment
+SESSION_BACKEND = os.environ.get('SHOPASSIST_SESSION_BACKEND', 'memory')
+SESSION_DB = os.environ.get('SHOPASSIST_SESSION_DB', 'sessions.db')
+SESSION_MAX = int(os.environ.get('SHOPASSIST_SESSION_MAX', '1000'))
+SESSION_TTL = float(os.environ.get('SHOPASSIST_SESSION_TTL', '1800'))
+
+
+class SessionStore(ABC):
+    """
+    Session-keyed storage for per-user chat state.
+
+    A state is a JSON-serialisable dictionary holding 'conversation', 'conversation_bot',
+    'top_3_laptops' and 'conversation_reco'. Sessions idle for longer than ttl seconds are
+    evicted, and at most max_sessions are kept (least recently used are dropped first).
+    """
+
+    def __init__(self, max_sessions=SESSION_MAX, ttl=SESSION_TTL):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+
+    @abstractmethod
+    def get(self, session_id):
+        pass
+
+    @abstractmethod
+    def save(self, session_id, state):
+        pass
+
+    @abstractmethod
+    def delete(self, session_id):
+        pass
+
+    @abstractmethod
+    def __len__(self):
+        pass
+
+
+class MemorySessionStore(SessionStore):
+    """
+    Bounded in-process LRU with TTL eviction. Sessions are only visible to the worker
+    process that created them, so multi-process deployments should use SQLiteSessionStore.
+    States are copied in and out like the SQLite store does, so concurrent turns of one
+    session never mutate the same conversation lists.
+    """
+
+    def __init__(self, max_sessions=SESSION_MAX, ttl=SESSION_TTL):
+        super().__init__(max_sessions, ttl)
+        self._sessions = OrderedDict()  # session_id -> (last_access, state)
+        self._lock = threading.Lock()
+
+    def _evict(self, now):
+        # Entries are kept in access order, so expired sessions are at the front
+        while self._sessions:
+            session_id, (last_access, _) = next(iter(self._sessions.items()))
+            if now - last_access <= self.ttl and len(self._sessions) <= self.max_sessions:
+                break
+            del self._sessions[session_id]
+
+    def get(self, session_id):
+        now = time.time()
+        with self._lock:
+            self._evict(now)
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            self._sessions[session_id] = (now, entry[1])
+            self._sessions.move_to_end(session_id)
+            state = entry[1]
+        return copy.deepcopy(state)
+
+    def save(self, session_id, state):
+        now = time.time()
+        state = copy.deepcopy(state)
+        with self._lock:
+            self._sessions[session_id] = (now, state)
+            self._sessions.move_to_end(session_id)
+            self._evict(now)
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Session store backed by a local SQLite file, shared by every worker process on the host.
+    """
+
+    def __init__(self, path=SESSION_DB, max_sessions=SESSION_MAX, ttl=SESSION_TTL):
+        super().__init__(max_sessions, ttl)
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS sessions (
+                                session_id TEXT PRIMARY KEY,
+                                state TEXT NOT NULL,
+                                last_access REAL NOT NULL)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_last_access ON sessions (last_access)")
+
+    # One connection per thread; WAL lets readers and a writer proceed concurrently
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _evict(self, conn, now):
+        conn.execute("DELETE FROM sessions WHERE last_access < ?", (now - self.ttl,))
+        conn.execute("""DELETE FROM sessions WHERE session_id IN (
+                            SELECT session_id FROM sessions ORDER BY last_access DESC LIMIT -1 OFFSET ?)""",
+                     (self.max_sessions,))
+
+    def get(self, session_id):
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute("SELECT state, last_access FROM sessions WHERE session_id = ?",
+                               (session_id,)).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl:
+                conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+                return None
+            conn.execute("UPDATE sessions SET last_access = ? WHERE session_id = ?", (now, session_id))
+        return json.loads(row[0])
+
+    def save(self, session_id, state):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO sessions (session_id, state, last_access) VALUES (?, ?, ?)",
+                         (session_id, json.dumps(state), now))
+            self._evict(conn, now)
+
+    def delete(self, session_id):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+
+# Create the session store selected by SHOPASSIST_SESSION_BACKEND ('memory' or 'sqlite')
+def create_session_store(backend=SESSION_BACKEND):
+    if backend == 'memory':
+        return MemorySessionStore()
+    if backend == 'sqlite':
+        return SQLiteSessionStore()
+    raise ValueError(f"Unknown session backend: {backend}")
@@ -0,0 +1,43 @@
+import json
+
+import pytest
+
+import functions
+from catalog import parse_budget, RECORD_CACHE_FIELD_SETS
+
+
+def run_batch(*profiles):
+    lines = [line if isinstance(line, str) else json.dumps(line) for line in profiles]
+    return [json.loads(line) for block in functions.recommend_batch_jsonl(lines) for line in block.splitlines()]
+
+
+@pytest.mark.parametrize('value', [10 ** 30, -10 ** 30, float('inf'), float('nan'), 'Infinity', 'abc', [1]])
+def test_parse_budget_rejects_non_finite_and_oversized(value):
+    assert parse_budget(value) is None
+
+
+def test_parse_budget_accepts_numbers():
+    assert parse_budget(90000) == 90000
+    assert parse_budget('90000') == 90000
+    assert parse_budget(None) == 0
+
+
+def test_out_of_range_budgets_are_error_lines():
+    results = run_batch('{"Budget": 1000000000000000000000000000000}', '{"Budget": Infinity}',
+                        {"Budget": 90000, "GPU intensity": "low"})
+    assert [sorted(result) for result in results] == [['error', 'id'], ['error', 'id'], ['id', 'laptops']]
+    assert all(laptop['Price'] <= 90000 for laptop in results[2]['laptops'])
+
+
+def test_error_lines_keep_the_callers_id():
+    results = run_batch({"id": "a", "Budget": "abc"}, 'not json', {"id": "c", "Budget": 90000, "GPU intensity": "low"})
+    assert [result['id'] for result in results] == ['a', 1, 'c']
+    assert 'error' in results[0] and 'error' in results[1] and 'laptops' in results[2]
+
+
+def test_record_caches_keep_a_bounded_number_of_field_selections():
+    catalog = functions.get_catalog(functions.LAPTOP_DATA)
+    for i in range(50):
+        catalog.record_prefix(0, ('Brand',) * (i + 1))
+    assert len(catalog._record_prefixes) <= RECORD_CACHE_FIELD_SETS
+    assert len(catalog._record_fields) <= RECORD_CACHE_FIELD_SETS
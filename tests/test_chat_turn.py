@@ -0,0 +1,25 @@
+import chat_turn
+
+
+def new_state():
+    return {"conversation": [{"role": "system", "content": "system"}],
+            "conversation_bot": [{"bot": "Hello"}],
+            "top_3_laptops": None,
+            "conversation_reco": None}
+
+
+def test_unexpected_error_undoes_the_turn(monkeypatch):
+    def broken_turn(state, user_input, stream, timings):
+        state["conversation"].append({"role": "user", "content": user_input})
+        state["top_3_laptops"] = "[]"
+        yield {"event": "token", "data": "partial"}
+        raise ValueError("unparseable reply")
+
+    monkeypatch.setattr(chat_turn, "_run_turn", broken_turn)
+    state = new_state()
+    events = list(chat_turn.run_turn(state, "hi", stream=True))
+
+    assert [event["event"] for event in events] == ["token", "error", "timings"]
+    assert state["conversation"] == new_state()["conversation"]
+    assert state["top_3_laptops"] is None
+    assert state["conversation_bot"][-2:] == [{"user": "hi"}, {"bot": chat_turn.ERROR_MESSAGE}]
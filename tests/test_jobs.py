@@ -0,0 +1,80 @@
+import pytest
+
+import jobs
+
+
+written = []
+
+
+def fake_kind(store, job_id, steps):
+    def run(on_progress):
+        for step in steps:
+            step(store, job_id)
+            on_progress({'completed': 1, 'total': 2, 'rows_per_second': 1.0})
+        on_progress({'completed': 2, 'total': 2, 'phase': 'writing'})
+        written.append(job_id)
+        return {'written': True}
+    return run
+
+
+def run_job(tmp_path, monkeypatch, *steps):
+    store = jobs.JobStore(str(tmp_path / 'jobs.db'))
+    job, created = store.create('test')
+    assert created
+    monkeypatch.setitem(jobs.JOB_KINDS, 'test', fake_kind(store, job['id'], steps))
+    monkeypatch.setattr(jobs, 'JOB_PROGRESS_INTERVAL', 0)
+    jobs._run_job(job['id'], 'test', store.path, None)
+    return store, store.get(job['id'])
+
+
+def expire(store, job_id):
+    with store._connect() as conn:
+        conn.execute("UPDATE jobs SET state = ?, error = ? WHERE id = ?", (jobs.FAILED, jobs.LOST_WORKER_ERROR, job_id))
+
+
+def test_job_completes_with_progress(tmp_path, monkeypatch):
+    store, job = run_job(tmp_path, monkeypatch, lambda store, job_id: None)
+    assert job['state'] == jobs.COMPLETED
+    assert job['result'] == {'written': True}
+    assert job['progress']['phase'] == 'writing'
+
+
+def test_cancelled_job_stops_at_next_progress_update(tmp_path, monkeypatch):
+    store, job = run_job(tmp_path, monkeypatch, lambda store, job_id: store.cancel(job_id))
+    assert job['state'] == jobs.CANCELLED
+    assert job['id'] not in written
+
+
+def test_worker_stops_once_its_job_is_no_longer_running(tmp_path, monkeypatch):
+    store, job = run_job(tmp_path, monkeypatch, expire)
+    assert job['state'] == jobs.FAILED
+    assert job['id'] not in written
+    assert job['result'] is None
+    assert store.beat(job['id']) == (jobs.FAILED, False)
+    # The unique index is free again, so a new job can start
+    assert store.create('test')[1]
+
+
+def test_one_active_job_per_kind(tmp_path):
+    store = jobs.JobStore(str(tmp_path / 'jobs.db'))
+    first, created = store.create('test')
+    second, created_again = store.create('test')
+    assert created and not created_again and second['id'] == first['id']
+    assert store.cancel(first['id'])['state'] == jobs.CANCELLED
+
+
+def test_job_process_gets_a_share_of_the_llm_budgets(tmp_path, monkeypatch):
+    import scheduler
+    budgets = []
+
+    def record_budget(store, job_id):
+        budgets.append(scheduler.get_scheduler().requests.rate * 60)
+
+    monkeypatch.setattr(scheduler, 'LLM_RPM', 1000.0)
+    monkeypatch.setattr(jobs, 'JOB_LLM_SHARE', 0.25)
+    previous = scheduler.get_scheduler()
+    try:
+        run_job(tmp_path, monkeypatch, record_budget)
+    finally:
+        scheduler.set_scheduler(previous)
+    assert budgets == [pytest.approx(250.0)]
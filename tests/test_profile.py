@@ -0,0 +1,27 @@
+import functions
+
+PROFILE = {'GPU intensity': 'high', 'Display quality': 'medium', 'Portability': 'low',
+           'Multitasking': 'high', 'Processing speed': 'medium', 'Budget': 90000}
+
+
+def test_extract_user_profile_skips_unparseable_braces():
+    text = f"Odd output {{[1]: 2}} and then the profile {PROFILE}"
+    assert functions.extract_user_profile(text) == PROFILE
+    assert functions.extract_user_profile("{[1]: 2}") is None
+
+
+def test_intent_check_of_malformed_literal_does_not_raise():
+    verdict = functions._intent_local_check("{[1]: 2}")
+    assert verdict is None or verdict['result'] == 'No'
+
+
+def test_non_finite_budgets_fail_validation():
+    for budget in (float('inf'), float('nan'), 1e999):
+        assert functions.validate_user_profile(dict(PROFILE, Budget = budget))['result'] == 'No'
+        assert functions.structured_profile(dict(PROFILE, Budget = budget)) is None
+
+
+def test_structured_profile_budgets():
+    assert functions.structured_profile(dict(PROFILE, Budget = '1,50,000'))['Budget'] == 150000
+    assert functions.structured_profile(dict(PROFILE, Budget = 89999.5))['Budget'] == 89999
+    assert functions.structured_profile(dict(PROFILE, Budget = '9' * 400)) is None
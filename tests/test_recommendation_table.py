@@ -0,0 +1,110 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from catalog import CatalogIndex, RecommendationTable, FEATURE_KEYS, encode_profiles
+
+
+def catalog(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    levels = rng.integers(1, 4, size=(rows, len(FEATURE_KEYS)), dtype=np.uint8)
+    prices = rng.integers(20000, 200000, size=rows, dtype=np.int64)
+    return CatalogIndex([('Price', prices)], prices, levels)
+
+
+def profiles(budgets):
+    levels = ['low', 'medium', 'high']
+    return [dict(zip(FEATURE_KEYS, combo), Budget=int(budget))
+            for combo, budget in zip(itertools.product(levels, repeat=len(FEATURE_KEYS)), itertools.cycle(budgets))]
+
+
+# Full-scan answers of top_k, without the table
+def scanned(index, requests, k=3):
+    table, index.table = index.table, None
+    try:
+        return [index.top_k(request, k) for request in requests]
+    finally:
+        index.table = table
+
+
+@pytest.mark.parametrize('max_buckets', [1, 7, 64, 10000])
+def test_table_matches_a_full_scan(max_buckets):
+    index = catalog(2000)
+    index.table = RecommendationTable.build(index.levels, index.prices, max_buckets=max_buckets)
+    budgets = np.concatenate([index.prices[:40], index.prices[:40] + 1, [0, 19999, 250000]])
+    requests = profiles(budgets)
+
+    expected = scanned(index, requests)
+    for request, (rows, scores) in zip(requests, expected):
+        found_rows, found_scores = index.top_k(request)
+        assert list(found_rows) == list(rows) and list(found_scores) == list(scores)
+
+    codes, batch_budgets, _ = encode_profiles(requests)
+    batch_rows, batch_scores = index.table.lookup_batch(codes, batch_budgets, index.prices)
+    for (rows, scores), found_rows, found_scores in zip(expected, batch_rows, batch_scores):
+        assert list(found_rows[found_rows >= 0]) == list(rows)
+        assert list(found_scores[:len(rows)]) == list(scores)
+
+
+def test_bucket_count_is_bounded():
+    index = catalog(5000)
+    table = RecommendationTable.build(index.levels, index.prices, max_buckets=100)
+    assert len(np.unique(index.prices)) > 100
+    assert table.stats()['budget_buckets'] <= 101
+
+
+def test_csv_catalogue_builds_its_table_in_the_background(tmp_path, monkeypatch):
+    import shutil
+    import threading
+    import time
+
+    import catalog as catalog_module
+
+    release = threading.Event()
+    build = CatalogIndex.build_table
+
+    def slow_build(self, k=3):
+        release.wait(10)
+        return build(self, k)
+
+    monkeypatch.setattr(CatalogIndex, 'build_table', slow_build)
+    path = shutil.copy(catalog_module.LAPTOP_DATA, tmp_path / 'laptops.csv')
+    index = catalog_module.get_catalog(str(path), str(tmp_path / 'artifact'))
+    assert index.table is None
+    request = profiles([100000])[0]
+    expected = index.top_k(request)
+
+    release.set()
+    deadline = time.monotonic() + 10
+    while index.table is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert index.table is not None
+    assert [list(found) for found in index.top_k(request)] == [list(found) for found in expected]
+
+
+def test_stream_mode_maps_the_artifact_once_and_never_parses_the_csv(tmp_path, monkeypatch):
+    import json
+    import shutil
+
+    import catalog as catalog_module
+    import catalog_stream
+
+    def no_csv(*args, **kwargs):
+        raise AssertionError('stream mode parsed the CSV into memory')
+
+    path = str(shutil.copy(catalog_module.LAPTOP_DATA, tmp_path / 'laptops.csv'))
+    artifact_dir = str(tmp_path / 'artifact')
+    request = profiles([100000])[0]
+    monkeypatch.setattr(CatalogIndex, 'from_csv', classmethod(no_csv))
+    from_csv = json.loads(catalog_stream.stream_top_k_json(request, path, artifact_dir))
+
+    monkeypatch.undo()
+    catalog_module.compile_catalog(path, artifact_dir)
+    loads = []
+    load_artifact = catalog_module.load_artifact
+    monkeypatch.setattr(catalog_module, 'load_artifact', lambda *args: loads.append(args) or load_artifact(*args))
+    monkeypatch.setattr(CatalogIndex, 'from_csv', classmethod(no_csv))
+    for _ in range(3):
+        assert json.loads(catalog_stream.stream_top_k_json(request, path, artifact_dir)) == from_csv
+    assert len(loads) == 1
@@ -0,0 +1,163 @@
+import time
+
+import pytest
+
+import resilience
+
+
+class ClientError(Exception):
+    status_code = 400
+
+
+@pytest.fixture(autouse=True)
+def fresh_breakers():
+    resilience.reset()
+    yield
+    resilience.reset()
+
+
+# Open the operation's breaker and wait until it lets a probe through
+def half_open(operation, reset_seconds=0.05):
+    breaker = resilience.get_breaker(operation)
+    breaker.reset_seconds = reset_seconds
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    assert breaker.state == 'open'
+    time.sleep(reset_seconds * 2)
+    return breaker
+
+
+def fail_with(error):
+    def fn():
+        raise error
+    return fn
+
+
+def test_client_error_probe_releases_half_open_breaker():
+    breaker = half_open('completion')
+    with pytest.raises(ClientError):
+        resilience.call('completion', fail_with(ClientError()))
+    assert breaker.state == 'half_open'
+    assert not breaker._probing
+
+    assert resilience.call('completion', lambda: 'ok') == 'ok'
+    assert breaker.state == 'closed'
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = resilience.CircuitBreaker('test', failure_threshold=3, reset_seconds=60)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == 'closed'
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    with pytest.raises(resilience.CircuitOpen):
+        breaker.allow()
+
+
+def test_half_open_breaker_lets_one_probe_through():
+    breaker = half_open('completion')
+    assert breaker.allow() is True
+    with pytest.raises(resilience.CircuitOpen):
+        breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+
+    time.sleep(breaker.reset_seconds * 2)
+    assert breaker.allow() is True
+    breaker.record_success()
+    assert breaker.state == 'closed'
+    assert breaker.allow() is False
+
+
+def test_open_breaker_fails_fast_within_a_deadline():
+    breaker = resilience.get_breaker('completion')
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    with resilience.deadline(5), pytest.raises(resilience.CircuitOpen):
+        resilience.call('completion', lambda: 'ok')
+    assert breaker.state == 'open'
+
+
+def test_failures_are_retried(monkeypatch):
+    monkeypatch.setattr(resilience, '_backoff', lambda retry_number: 0)
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ConnectionError("reset")
+        return 'ok'
+
+    assert resilience.call('completion', flaky) == 'ok'
+    assert len(attempts) == 3
+
+
+def test_deadline_abandons_a_slow_request():
+    started = time.monotonic()
+    with resilience.deadline(0.1), pytest.raises(resilience.DeadlineExceeded) as raised:
+        resilience.call('completion', time.sleep, 1)
+    assert time.monotonic() - started < 0.5
+    assert raised.value.upstream
+    assert resilience.get_breaker('completion').failures == 1
+
+
+def test_nested_deadline_only_shortens():
+    with resilience.deadline(10):
+        with resilience.deadline(60):
+            assert resilience.remaining() <= 10
+        with resilience.deadline(0.01):
+            time.sleep(0.02)
+            with pytest.raises(resilience.DeadlineExceeded):
+                resilience.check_deadline()
+        assert resilience.remaining() > 9
+
+
+def test_slow_request_is_hedged(monkeypatch):
+    monkeypatch.setattr(resilience, 'HEDGE_PERCENTILE', 95)
+    latencies = resilience.get_latencies('completion')
+    for _ in range(resilience.HEDGE_MIN_SAMPLES):
+        latencies.observe(0.01)
+    requests = []
+
+    def answer():
+        requests.append(1)
+        if len(requests) == 1:
+            time.sleep(1)
+            return 'primary'
+        return 'hedge'
+
+    started = time.monotonic()
+    assert resilience.call('completion', answer, hedge=True) == 'hedge'
+    assert time.monotonic() - started < 0.5
+    assert len(requests) == 2
+
+
+def test_requests_are_not_hedged_without_enough_samples():
+    requests = []
+
+    def answer():
+        requests.append(1)
+        time.sleep(0.05)
+        return 'ok'
+
+    assert resilience.call('completion', answer, hedge=True) == 'ok'
+    assert len(requests) == 1
+
+
+def test_requests_are_not_hedged_by_default():
+    latencies = resilience.get_latencies('completion')
+    for _ in range(resilience.HEDGE_MIN_SAMPLES):
+        latencies.observe(0.01)
+    requests = []
+
+    def answer():
+        requests.append(1)
+        time.sleep(0.1)
+        return 'ok'
+
+    assert resilience.call('completion', answer, hedge=True) == 'ok'
+    assert len(requests) == 1
@@ -0,0 +1,80 @@
+import pytest
+
+import functions
+import llm_backend
+import resilience
+from llm_cache import DiskCache, ResponseCache
+
+
+class StubBackend(llm_backend.SimulatedBackend):
+    """
+    Backend answering every completion with a fixed message, counting the calls.
+    """
+
+    name = 'stub'
+
+    def __init__(self, message):
+        super().__init__(latency_ms=0, jitter='none')
+        self.message = message
+        self.calls = 0
+
+    def complete(self, request):
+        self.calls += 1
+        return self.message
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = ResponseCache(path=str(tmp_path / 'cache.db'), use_disk=True)
+    monkeypatch.setattr(functions, 'response_cache', cache)
+    resilience.reset()
+    yield cache
+    llm_backend.set_backend(None)
+
+
+def test_unparseable_function_call_is_not_cached(cache):
+    backend = StubBackend({"content": None, "function_call": {"name": "get_user_info", "arguments": "{not json"}})
+    llm_backend.set_backend(backend)
+    conversation = [{"role": "user", "content": "hello"}]
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            functions.get_chat_completions(conversation)
+    assert backend.calls == 2
+    assert len(cache.disk) == 0
+
+
+def test_unparseable_cached_reply_is_evicted(cache):
+    llm_backend.set_backend(StubBackend({"content": "{}", "function_call": None}))
+    request = functions._intent_request("the profile")
+    key = functions._response_cache_key(request)
+    cache.set(key, {"content": "not json", "function_call": None})
+    with pytest.raises(ValueError):
+        functions._cached_completion(request, functions._intent_output)
+    assert cache.get(key) is None
+    assert functions._cached_completion(request, functions._intent_output) == {}
+    assert cache.get(key) is not None
+
+
+def test_disk_tier_is_opt_in(tmp_path):
+    path = tmp_path / 'cache.db'
+    cache = ResponseCache(path=str(path))
+    cache.set('key', {'content': 'hi'})
+    assert cache.get('key') == {'content': 'hi'}
+    assert not path.exists()
+
+    cache = ResponseCache(path=str(path), use_disk=True)
+    cache.set('key', {'content': 'hi'})
+    assert ResponseCache(path=str(path), use_disk=True).get('key') == {'content': 'hi'}
+
+
+def test_disk_tier_tracks_its_size_and_evicts_least_recently_used(tmp_path):
+    disk = DiskCache(str(tmp_path / 'cache.db'), ttl=3600, max_bytes=100)
+    disk.set('a', 'x' * 30)
+    disk.set('b', 'x' * 30)
+    disk.set('a', 'x' * 10)
+    assert disk.size() == 12 + 32
+    disk.get('a')
+    disk.set('c', 'x' * 60)
+    assert disk.get('b') is None and disk.get('a') is not None
+    disk.delete('a')
+    assert disk.size() == 62
@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+
+import resilience
+import scheduler
+
+
+@pytest.fixture
+def drained(monkeypatch):
+    # One request per second with its only token already spent, so the next request queues
+    instance = scheduler.Scheduler(rpm=60, tpm=0, burst_seconds=1)
+    instance.acquire(1)
+    monkeypatch.setattr(scheduler, '_scheduler', instance)
+    resilience.reset()
+    yield instance
+    resilience.reset()
+
+
+def request():
+    return {'messages': [{'role': 'user', 'content': 'hi'}]}
+
+
+def test_queued_timeouts_do_not_count_against_the_breaker(drained):
+    fn = scheduler.scheduled(lambda request: 'ok', request())
+    for _ in range(6):
+        with resilience.deadline(0.05), pytest.raises(resilience.DeadlineExceeded) as raised:
+            resilience.call('completion', fn, request())
+        assert not getattr(raised.value, 'upstream', False)
+    breaker = resilience.get_breaker('completion')
+    assert breaker.state == 'closed' and breaker.failures == 0
+
+
+def test_async_queued_timeouts_do_not_count_against_the_breaker(drained):
+    async def answer(request):
+        return 'ok'
+
+    async def run():
+        with resilience.deadline(0.05):
+            await resilience.acall('completion', scheduler.ascheduled(answer, request()), request())
+
+    for _ in range(6):
+        with pytest.raises(resilience.DeadlineExceeded) as raised:
+            asyncio.run(run())
+        assert not getattr(raised.value, 'upstream', False)
+    assert resilience.get_breaker('completion').failures == 0
+
+
+def test_interactive_requests_are_admitted_before_background_ones():
+    import threading
+    import time
+
+    # Unlimited budgets, but paused so every request queues before the first is admitted
+    instance = scheduler.Scheduler(rpm=1200, tpm=0, burst_seconds=0.05)
+    instance.acquire(1)
+    instance.paused_until = time.monotonic() + 60
+    admitted = []
+
+    def request(name, level):
+        with scheduler.priority(level):
+            instance.acquire(1)
+        admitted.append(name)
+
+    threads = []
+    for name, level in [('background 1', scheduler.BACKGROUND), ('interactive 1', scheduler.INTERACTIVE),
+                        ('background 2', scheduler.BACKGROUND), ('interactive 2', scheduler.INTERACTIVE)]:
+        thread = threading.Thread(target=request, args=(name, level))
+        thread.start()
+        threads.append(thread)
+        while len(instance._queue) < len(threads):
+            time.sleep(0.001)
+    with instance._cond:
+        instance.paused_until = 0.0
+        instance._cond.notify_all()
+    for thread in threads:
+        thread.join(5)
+
+    assert admitted == ['interactive 1', 'interactive 2', 'background 1', 'background 2']
+    assert instance.stats()['waits']['background']['admitted'] == 2
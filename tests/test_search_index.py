@@ -0,0 +1,74 @@
+import time
+
+from catalog import CatalogIndex
+from search_index import SearchIndex, get_search_index, matching_sentences, tokenize
+
+RECORDS = [
+    {'Special Features': 'Backlit Keyboard', 'Description': 'A thin laptop with a backlit keyboard for late nights.'},
+    {'Special Features': 'Fingerprint Sensor', 'Description': 'Secure login with the fingerprint sensor.'},
+    {'Special Features': 'None', 'Description': 'The keyboard is comfortable. The screen is bright.'},
+    {'Special Features': 'None', 'Description': 'A gaming laptop with a dedicated graphics card.'},
+]
+
+
+def test_tokenize_drops_stopwords_and_plural_s():
+    assert tokenize("Which laptops have backlit keyboards?") == ['backlit', 'keyboard']
+
+
+def test_bm25_ranks_special_features_matches_first():
+    index = SearchIndex.from_records(RECORDS)
+    rows = [row for row, score in index.search("backlit keyboard", k=3)]
+    assert rows == [0, 2]
+    assert index.search("fingerprint", k=3)[0][0] == 1
+    assert index.search("touchscreen", k=3) == []
+
+
+def test_equal_scores_keep_row_order():
+    index = SearchIndex.from_records([{'Special Features': 'Keyboard', 'Description': ''}] * 4)
+    assert [row for row, score in index.search("keyboard", k=2)] == [0, 1]
+    records = [{'Special Features': 'Keyboard', 'Description': ''}] * 500
+    records[300] = {'Special Features': 'Keyboard', 'Description': 'Keyboard'}
+    index = SearchIndex.from_records(records)
+    assert [row for row, score in index.search("keyboard", k=3)] == [300, 0, 1]
+
+
+def test_saved_index_matches_built_index(tmp_path):
+    index = SearchIndex.from_records(RECORDS)
+    loaded = SearchIndex.load(str(tmp_path), index.save(str(tmp_path)))
+    for query in ("backlit keyboard", "fingerprint sensor", "gaming graphics", "bright screen"):
+        assert loaded.search(query, k=4) == index.search(query, k=4)
+
+
+def test_matching_sentences():
+    assert matching_sentences(RECORDS[2]['Description'], "keyboard") == ['The keyboard is comfortable.']
+
+
+def test_catalogue_index_is_built_in_the_background():
+    catalog = CatalogIndex.from_csv()
+    assert catalog.search_index is None
+    index = get_search_index(catalog)
+    deadline = time.monotonic() + 10
+    while index is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+        index = get_search_index(catalog)
+    assert index is not None and index.size == len(catalog)
+
+
+def test_failed_background_build_is_retried(monkeypatch):
+    catalog = CatalogIndex.from_csv()
+    from_catalog = SearchIndex.from_catalog.__func__
+    attempts = []
+
+    def flaky(cls, catalog):
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise MemoryError('no room for the index')
+        return from_catalog(cls, catalog)
+
+    monkeypatch.setattr(SearchIndex, 'from_catalog', classmethod(flaky))
+    index = get_search_index(catalog)
+    deadline = time.monotonic() + 10
+    while index is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+        index = get_search_index(catalog)
+    assert index is not None and len(attempts) == 2
@@ -0,0 +1,33 @@
+import pytest
+
+from session_store import MemorySessionStore, SQLiteSessionStore
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        return MemorySessionStore()
+    return SQLiteSessionStore(str(tmp_path / 'sessions.db'))
+
+
+def state(text):
+    return {"conversation": [{"role": "assistant", "content": text}],
+            "conversation_bot": [{"bot": text}],
+            "top_3_laptops": None,
+            "conversation_reco": None}
+
+
+def test_loaded_states_are_independent_copies(store):
+    store.save('session', state('Hello'))
+    first = store.get('session')
+    second = store.get('session')
+    first["conversation"].append({"role": "user", "content": "hi"})
+    assert len(second["conversation"]) == 1
+    assert len(store.get('session')["conversation"]) == 1
+
+
+def test_saved_state_is_not_changed_by_later_mutations(store):
+    saved = state('Hello')
+    store.save('session', saved)
+    saved["conversation_bot"].append({"user": "hi"})
+    assert store.get('session')["conversation_bot"] == [{"bot": "Hello"}]